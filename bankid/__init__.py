@@ -18,12 +18,17 @@ about how the BankID methods are defined and how to use them.
 
 """
 
-from bankid import exceptions
+import importlib
+from typing import TYPE_CHECKING, Any, List
+
 from bankid.__version__ import __version__, version
-from bankid.certutils import create_bankid_test_server_cert_and_key
-from bankid.syncclient import BankIDClient
-from bankid.asyncclient import BankIDAsyncClient
-from bankid.qr import generate_qr_code_content
+
+if TYPE_CHECKING:
+    from bankid import exceptions
+    from bankid.asyncclient import BankIDAsyncClient
+    from bankid.certutils import create_bankid_test_server_cert_and_key
+    from bankid.qr import generate_qr_code_content
+    from bankid.syncclient import BankIDClient
 
 __all__ = [
     "BankIDClient",
@@ -34,3 +39,49 @@ __all__ = [
     "__version__",
     "version",
 ]
+
+# Public names are imported on first access, so that e.g. using only the QR code
+# generation does not import httpx and the clients.
+_LAZY_ATTRIBUTES = {
+    "BankIDClient": "bankid.syncclient",
+    "BankIDAsyncClient": "bankid.asyncclient",
+    "create_bankid_test_server_cert_and_key": "bankid.certutils",
+    "generate_qr_code_content": "bankid.qr",
+}
+_SUBMODULES = {
+    "archive",
+    "asgi",
+    "asyncclient",
+    "baseclient",
+    "certs",
+    "certutils",
+    "exceptions",
+    "experimental",
+    "loadtest",
+    "metrics",
+    "orderstore",
+    "polling",
+    "qr",
+    "resilience",
+    "responses",
+    "structs",
+    "syncclient",
+    "testing",
+    "tracing",
+    "watcher",
+}
+
+
+def __getattr__(name: str) -> Any:
+    if name in _LAZY_ATTRIBUTES:
+        value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name]), name)
+    elif name in _SUBMODULES:
+        value = importlib.import_module("bankid." + name)
+    else:
+        raise AttributeError("module 'bankid' has no attribute '{0}'".format(name))
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> List[str]:
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES) | _SUBMODULES)
@@ -0,0 +1,464 @@
+# -*- coding: utf-8 -*-
+"""
+:mod:`bankid.archive` -- Long term storage of completed orders
+==============================================================
+
+The ``completionData`` of a completed order, with its signature XML and OCSP response, is the
+evidence of an authentication or signature and often has to be kept for years.
+:py:class:`ArchiveWriter` appends collect responses of completed orders to an archive directory
+and :py:class:`ArchiveReader` reads them back, by ``orderRef``, personal number or time.
+
+.. code-block:: python
+
+    with ArchiveWriter("/var/lib/myapp/bankid-archive") as archive:
+        archive.append(await client.collect(order_ref))
+
+    with ArchiveReader("/var/lib/myapp/bankid-archive") as archive:
+        response = archive.get(order_ref)
+        for entry in archive.entries(personal_number="190000000000", start=time.time() - 86400):
+            print(entry.order_ref, archive.read(entry)["completionData"]["user"]["name"])
+
+The archive is a sequence of append-only segment files of at most ``segment_size`` bytes. Each
+record holds one response, with the signature XML and the OCSP response stored decoded rather
+than in base64, compressed on its own with :py:mod:`zlib` and a dictionary shared by all records
+of the archive. The signature XML of different orders largely consists of the same elements and
+CA certificates, so that the records compress to a fraction of their size while any of them can
+be read without the others. The dictionary is taken from the first record unless one is given.
+
+Next to each segment is an index file of fixed size entries with the ``orderRef``, personal
+number and time of its records, which readers memory map and search without reading the
+segments. An archive has one writer at a time; after a crash the writer drops a partially
+written last record and indexes records that were written but not indexed when it is opened.
+
+"""
+
+import base64
+import binascii
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import uuid
+import zlib
+from typing import Any, BinaryIO, Dict, Iterator, List, NamedTuple, Tuple, TypeVar, Union
+
+_PathType = Union[str, "os.PathLike[str]"]
+_ArchiveType = TypeVar("_ArchiveType", bound="_Archive")
+
+_MAGIC = b"BANKIDA1"
+_DICTIONARY = "dictionary.zdict"
+_SEGMENT = re.compile(r"^(\d{8})\.seg$")
+# The length of the compressed payload, its CRC-32 and the time it is indexed by.
+_RECORD = struct.Struct("<IId")
+# orderRef as UUID bytes, personal number, time, payload offset in the segment and payload length.
+_ENTRY = struct.Struct("<16s12sdQI")
+# The lengths of the response without signature and OCSP response, of the signature XML and of
+# the OCSP response, and flags telling whether these are stored as their base64 text.
+_PAYLOAD = struct.Struct("<IIIB")
+_SIGNATURE_AS_TEXT = 1
+_OCSP_RESPONSE_AS_TEXT = 2
+
+
+class ArchiveEntry(NamedTuple):
+    """The index entry of an archived response, as given by :py:meth:`ArchiveReader.entries`."""
+
+    order_ref: str
+    personal_number: Union[str, None]
+    time: float
+    segment: int
+    offset: int
+    length: int
+
+
+def _segment_path(directory: str, number: int, suffix: str) -> str:
+    return os.path.join(directory, "{0:08d}.{1}".format(number, suffix))
+
+
+def _segment_numbers(directory: str) -> List[int]:
+    numbers = []
+    for name in os.listdir(directory):
+        match = _SEGMENT.match(name)
+        if match is not None:
+            numbers.append(int(match.group(1)))
+    return sorted(numbers)
+
+
+def _decoded(text: str) -> Tuple[bytes, bool]:
+    """The bytes of base64 ``text``, or the text itself if it would not be encoded the same way again."""
+    try:
+        data = base64.b64decode(text, validate=True)
+    except (binascii.Error, ValueError):
+        return text.encode("utf-8"), True
+    if base64.b64encode(data).decode("ascii") != text:
+        return text.encode("utf-8"), True
+    return data, False
+
+
+def _encode_payload(response: Dict[str, Any]) -> bytes:
+    completion_data = dict(response["completionData"])
+    signature, signature_as_text = _decoded(completion_data.pop("signature"))
+    ocsp_response, ocsp_response_as_text = _decoded(completion_data.pop("ocspResponse"))
+    rest = json.dumps(dict(response, completionData=completion_data), separators=(",", ":")).encode("utf-8")
+    flags = (_SIGNATURE_AS_TEXT if signature_as_text else 0) | (_OCSP_RESPONSE_AS_TEXT if ocsp_response_as_text else 0)
+    return _PAYLOAD.pack(len(rest), len(signature), len(ocsp_response), flags) + rest + signature + ocsp_response
+
+
+def _decode_payload(payload: bytes) -> Dict[str, Any]:
+    rest_length, signature_length, ocsp_response_length, flags = _PAYLOAD.unpack_from(payload)
+    position = _PAYLOAD.size + rest_length
+    response: Dict[str, Any] = json.loads(payload[_PAYLOAD.size : position])
+    signature = payload[position : position + signature_length]
+    position += signature_length
+    ocsp_response = payload[position : position + ocsp_response_length]
+    completion_data = response["completionData"]
+    completion_data["signature"] = (
+        signature.decode("utf-8") if flags & _SIGNATURE_AS_TEXT else base64.b64encode(signature).decode("ascii")
+    )
+    completion_data["ocspResponse"] = (
+        ocsp_response.decode("utf-8")
+        if flags & _OCSP_RESPONSE_AS_TEXT
+        else base64.b64encode(ocsp_response).decode("ascii")
+    )
+    return response
+
+
+def _index_fields(response: Dict[str, Any]) -> Tuple[bytes, bytes]:
+    order_ref = uuid.UUID(response["orderRef"]).bytes
+    personal_number = response["completionData"].get("user", {}).get("personalNumber") or ""
+    return order_ref, personal_number.encode("ascii")
+
+
+def _entry(fields: Tuple[bytes, bytes, float, int, int], segment: int) -> ArchiveEntry:
+    order_ref, personal_number, t, offset, length = fields
+    number = personal_number.rstrip(b"\0").decode("ascii")
+    return ArchiveEntry(str(uuid.UUID(bytes=order_ref)), number or None, t, segment, offset, length)
+
+
+class _Archive:
+    def __init__(self, path: _PathType):
+        self.path = os.fspath(path)
+        self._lock = threading.RLock()
+        self._dictionary: Union[bytes, None] = None
+
+    def __enter__(self: _ArchiveType) -> _ArchiveType:
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        raise NotImplementedError
+
+    def _load_dictionary(self) -> Union[bytes, None]:
+        if self._dictionary is None:
+            try:
+                with open(os.path.join(self.path, _DICTIONARY), "rb") as f:
+                    self._dictionary = f.read()
+            except FileNotFoundError:
+                return None
+        return self._dictionary
+
+    def _decompress(self, data: bytes) -> Dict[str, Any]:
+        dictionary = self._load_dictionary()
+        if dictionary is None:
+            raise ValueError("Archive {0} has no compression dictionary".format(self.path))
+        decompressor = zlib.decompressobj(zdict=dictionary)
+        return _decode_payload(decompressor.decompress(data) + decompressor.flush())
+
+
+class ArchiveWriter(_Archive):
+    """Appends collect responses of completed orders to an archive directory.
+
+    Each response is written to the current segment and its index at once, so that readers see
+    it after :py:meth:`append` returns; :py:meth:`sync` makes the written responses durable.
+
+    :param path: The archive directory, created if it does not exist.
+    :type path: str
+    :param segment_size: Number of bytes after which a new segment is started.
+    :type segment_size: int
+    :param dictionary: The compression dictionary of a new archive, by default the first
+        record written. Ignored if the archive has a dictionary.
+    :type dictionary: bytes
+    :param level: The :py:mod:`zlib` compression level.
+    :type level: int
+
+    """
+
+    def __init__(
+        self,
+        path: _PathType,
+        segment_size: int = 64 * 1024 * 1024,
+        dictionary: Union[bytes, None] = None,
+        level: int = 9,
+    ):
+        super().__init__(path)
+        self.segment_size = segment_size
+        self.level = level
+        os.makedirs(self.path, exist_ok=True)
+        if dictionary is not None and self._load_dictionary() is None:
+            self._write_dictionary(dictionary)
+        numbers = _segment_numbers(self.path)
+        self._segment = numbers[-1] if numbers else 1
+        self._data: BinaryIO
+        self._index: BinaryIO
+        self._open_segment(recover=bool(numbers))
+
+    def append(self, response: Dict[str, Any], t: Union[float, None] = None) -> ArchiveEntry:
+        """Archive the collect response of a completed order.
+
+        :param response: The collect response, with ``status`` ``complete``.
+        :type response: dict
+        :param t: The time to index the response by, by default now.
+        :type t: float
+        :return: The index entry of the archived response.
+        :rtype: ArchiveEntry
+
+        """
+        if response.get("status") != "complete" or "completionData" not in response:
+            raise ValueError("Only collect responses of completed orders can be archived")
+        order_ref, personal_number = _index_fields(response)
+        payload = _encode_payload(response)
+        t = time.time() if t is None else t
+        with self._lock:
+            dictionary = self._load_dictionary()
+            if dictionary is None:
+                # The signature XML and OCSP response of the first record are much like those of the rest.
+                dictionary = self._write_dictionary(payload[-32768:])
+            compressor = zlib.compressobj(self.level, zdict=dictionary)
+            data = compressor.compress(payload) + compressor.flush()
+            if self._data.tell() >= self.segment_size:
+                self._close_segment()
+                self._segment += 1
+                self._open_segment(recover=False)
+            offset = self._data.tell() + _RECORD.size
+            self._data.write(_RECORD.pack(len(data), zlib.crc32(data), t) + data)
+            self._data.flush()
+            self._index.write(_ENTRY.pack(order_ref, personal_number, t, offset, len(data)))
+            self._index.flush()
+            return _entry((order_ref, personal_number, t, offset, len(data)), self._segment)
+
+    def sync(self) -> None:
+        """Write the appended responses through to disk."""
+        with self._lock:
+            for f in (self._data, self._index):
+                f.flush()
+                os.fsync(f.fileno())
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._data.closed:
+                self.sync()
+                self._close_segment()
+
+    def _write_dictionary(self, dictionary: bytes) -> bytes:
+        path = os.path.join(self.path, _DICTIONARY)
+        with open(path + ".tmp", "wb") as f:
+            f.write(dictionary)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        self._dictionary = dictionary
+        return dictionary
+
+    def _open_segment(self, recover: bool) -> None:
+        data_path = _segment_path(self.path, self._segment, "seg")
+        index_path = _segment_path(self.path, self._segment, "idx")
+        if not recover:
+            with open(data_path, "xb") as f:
+                f.write(_MAGIC)
+            open(index_path, "wb").close()
+        self._data = open(data_path, "r+b")
+        self._index = open(index_path, "r+b")
+        if recover:
+            self._recover()
+        self._data.seek(0, os.SEEK_END)
+        self._index.seek(0, os.SEEK_END)
+
+    def _close_segment(self) -> None:
+        self._data.close()
+        self._index.close()
+
+    def _recover(self) -> None:
+        """Make the index and the data of the last segment agree after an interrupted write."""
+        data_size = self._data.seek(0, os.SEEK_END)
+        index_size = self._index.seek(0, os.SEEK_END)
+        entries = index_size // _ENTRY.size
+        end = len(_MAGIC)
+        # Drop a partially written entry, and entries of records that were not written in full.
+        while entries:
+            self._index.seek((entries - 1) * _ENTRY.size)
+            fields = _ENTRY.unpack(self._index.read(_ENTRY.size))
+            if fields[3] + fields[4] <= data_size:
+                end = fields[3] + fields[4]
+                break
+            entries -= 1
+        self._index.truncate(entries * _ENTRY.size)
+        self._index.seek(0, os.SEEK_END)
+
+        # Index complete records after the last indexed one, and drop what follows them.
+        self._data.seek(end)
+        while True:
+            header = self._data.read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                break
+            length, crc, t = _RECORD.unpack(header)
+            data = self._data.read(length)
+            if len(data) < length or zlib.crc32(data) != crc:
+                break
+            try:
+                response = self._decompress(data)
+            except (ValueError, zlib.error):
+                break
+            order_ref, personal_number = _index_fields(response)
+            self._index.write(_ENTRY.pack(order_ref, personal_number, t, end + _RECORD.size, length))
+            end += _RECORD.size + length
+        self._data.truncate(end)
+        self._index.flush()
+
+
+class _Mapping:
+    """A read-only memory map of a file that may grow, remapped when a read goes beyond its end.
+
+    A replaced map is left to be closed when it is no longer used, e.g. by an ongoing iteration.
+
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.map: Union[mmap.mmap, None] = None
+
+    def refresh(self, needed: int = 0) -> Union[mmap.mmap, None]:
+        if self.map is not None and len(self.map) >= needed and needed:
+            return self.map
+        size = os.path.getsize(self.path)
+        if size and (self.map is None or size > len(self.map)):
+            with open(self.path, "rb") as f:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.map
+
+    def close(self) -> None:
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+
+class ArchiveReader(_Archive):
+    """Reads the collect responses in an archive directory, also while it is being written to.
+
+    :param path: The archive directory.
+    :type path: str
+
+    """
+
+    def __init__(self, path: _PathType):
+        super().__init__(path)
+        if not os.path.isdir(self.path):
+            raise FileNotFoundError("No archive at {0}".format(self.path))
+        self._indexes: Dict[int, _Mapping] = {}
+        self._segments: Dict[int, _Mapping] = {}
+
+    def __len__(self) -> int:
+        return sum(len(index) // _ENTRY.size for _, index in self._index_maps())
+
+    def __contains__(self, order_ref: object) -> bool:
+        return isinstance(order_ref, str) and self.find(order_ref) is not None
+
+    def find(self, order_ref: str) -> Union[ArchiveEntry, None]:
+        """The index entry of the last response archived for ``order_ref``, if any."""
+        try:
+            needle = uuid.UUID(order_ref).bytes
+        except ValueError:
+            return None
+        for segment, index in reversed(self._index_maps()):
+            stop = len(index) - len(index) % _ENTRY.size
+            position = index.rfind(needle, 0, stop)
+            while position >= 0 and position % _ENTRY.size:
+                position = index.rfind(needle, 0, position + len(needle) - 1)
+            if position >= 0:
+                return _entry(_ENTRY.unpack_from(index, position), segment)
+        return None
+
+    def get(self, order_ref: str) -> Dict[str, Any]:
+        """The collect response archived for ``order_ref``.
+
+        :raises KeyError: If there is none.
+
+        """
+        entry = self.find(order_ref)
+        if entry is None:
+            raise KeyError(order_ref)
+        return self.read(entry)
+
+    def read(self, entry: ArchiveEntry) -> Dict[str, Any]:
+        """The collect response of an index entry."""
+        with self._lock:
+            mapping = self._segments.get(entry.segment)
+            if mapping is None:
+                mapping = self._segments[entry.segment] = _Mapping(_segment_path(self.path, entry.segment, "seg"))
+            segment = mapping.refresh(entry.offset + entry.length)
+            if segment is None or len(segment) < entry.offset + entry.length:
+                raise ValueError("Archive record at {0}:{1} is missing".format(entry.segment, entry.offset))
+            length, crc, _ = _RECORD.unpack_from(segment, entry.offset - _RECORD.size)
+            data = segment[entry.offset : entry.offset + entry.length]
+        if length != entry.length or zlib.crc32(data) != crc:
+            raise ValueError("Archive record at {0}:{1} is corrupt".format(entry.segment, entry.offset))
+        return self._decompress(data)
+
+    def entries(
+        self,
+        personal_number: Union[str, None] = None,
+        start: Union[float, None] = None,
+        end: Union[float, None] = None,
+    ) -> Iterator[ArchiveEntry]:
+        """The index entries of the archived responses, in the order they were archived.
+
+        :param personal_number: Only entries of responses for this personal number.
+        :type personal_number: str
+        :param start: Only entries indexed at or after this time.
+        :type start: float
+        :param end: Only entries indexed before this time.
+        :type end: float
+
+        """
+        needle = personal_number.encode("ascii").ljust(12, b"\0") if personal_number is not None else None
+        for segment, index in self._index_maps():
+            size = len(index) - len(index) % _ENTRY.size
+            if needle is None:
+                positions: Iterator[int] = iter(range(0, size, _ENTRY.size))
+            else:
+                positions = self._positions(index, needle, size)
+            for position in positions:
+                fields = _ENTRY.unpack_from(index, position)
+                if (start is None or fields[2] >= start) and (end is None or fields[2] < end):
+                    yield _entry(fields, segment)
+
+    def close(self) -> None:
+        with self._lock:
+            for mapping in list(self._indexes.values()) + list(self._segments.values()):
+                mapping.close()
+            self._indexes.clear()
+            self._segments.clear()
+
+    @staticmethod
+    def _positions(index: mmap.mmap, personal_number: bytes, size: int) -> Iterator[int]:
+        # The personal number is the second field of an entry, after the 16 bytes of the orderRef.
+        position = index.find(personal_number, 16, size)
+        while position >= 0:
+            if (position - 16) % _ENTRY.size == 0:
+                yield position - 16
+            position = index.find(personal_number, position + 1, size)
+
+    def _index_maps(self) -> List[Tuple[int, mmap.mmap]]:
+        maps = []
+        with self._lock:
+            for segment in _segment_numbers(self.path):
+                mapping = self._indexes.get(segment)
+                if mapping is None:
+                    mapping = self._indexes[segment] = _Mapping(_segment_path(self.path, segment, "idx"))
+                index = mapping.refresh()
+                if index is not None:
+                    maps.append((segment, index))
+        return maps
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+:mod:`bankid.asgi` -- Server-Sent Events for QR codes and collect status
+========================================================================
+
+A mountable ASGI application that streams the animated QR code content and the collect
+status of an order to the browser over one `Server-Sent Events
+<https://html.spec.whatwg.org/multipage/server-sent-events.html>`_ connection, instead of
+the browser polling one endpoint for the QR code every second and another for collect.
+
+Collect calls are made by an :py:class:`~bankid.watcher.OrderWatcher`, so one upstream
+collect per order serves all connections open for it.
+
+.. code-block:: python
+
+    client = BankIDAsyncClient(certificates=(cert, key), test_server=True)
+    events = BankIDEventStream(client)
+    app.mount("/bankid/events", events)  # e.g. in Starlette or FastAPI
+
+    # In the endpoint initiating an order:
+    order = await events.authenticate(end_user_ip=request.client.host)
+
+The browser then listens on ``/bankid/events/<orderRef>``:
+
+.. code-block:: javascript
+
+    const source = new EventSource(`/bankid/events/${orderRef}`);
+    source.addEventListener("qr", (e) => qr.value = e.data);
+    source.addEventListener("status", (e) => {
+        const status = JSON.parse(e.data);
+        if (status.status !== "pending") source.close();
+    });
+
+"""
+
+import asyncio
+import json
+import time
+from datetime import datetime
+from logging import getLogger
+from math import floor
+from typing import Any, Awaitable, Callable, Dict, List, MutableMapping, Set, Tuple, Union
+
+from bankid.asyncclient import BankIDAsyncClient
+from bankid.orderstore import MemoryOrderStore, OrderStore, StoredOrder
+from bankid.qr import QRCodeContentCache
+from bankid.structs import _Struct
+from bankid.watcher import OrderUpdate, OrderWatcher
+
+_LOG = getLogger(__name__)
+
+Scope = MutableMapping[str, Any]
+Message = MutableMapping[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+
+
+class _Stream:
+    """The state of the connections streaming one order in this process."""
+
+    __slots__ = ("result", "connections", "expires")
+
+    def __init__(self, expires: float):
+        self.result: Union[bytes, None] = None
+        self.connections = 0
+        self.expires = expires
+
+
+def _event(name: str, data: str) -> bytes:
+    return "event: {0}\ndata: {1}\n\n".format(name, data).encode()
+
+
+class BankIDEventStream:
+    """ASGI application streaming QR code content and collect status of orders.
+
+    Orders are made known to the application by adding them to its ``store``, with
+    :py:meth:`register`, or by initiating them through :py:meth:`authenticate` or :py:meth:`sign`.
+    A ``GET`` request to ``/<orderRef>``, relative to where the application is mounted, then
+    responds with a ``text/event-stream`` of the following events:
+
+    - ``qr``: the current QR code content, sent when connecting and then on every new second
+      since the order was started. Not sent for phone orders.
+    - ``status``: a JSON object with ``orderRef``, ``status`` and ``hintCode`` (and
+      ``completionData`` if ``include_completion_data`` is set), sent whenever these change.
+      The ``completionData`` is only sent to the connections open when the order completes;
+      connections made later get the final status without it.
+    - ``error``: a JSON object with ``errorCode`` and ``details`` if collect failed.
+
+    The stream ends after the final ``status`` or an ``error``. Unknown orders get a 404 response.
+
+    The watcher is started by the ASGI lifespan protocol if the server sends it, otherwise on the
+    first connection. Orders are no longer collected when all their connections are closed.
+
+    :param client: The client to collect with.
+    :type client: BankIDAsyncClient
+    :param watcher: The watcher to collect with, by default a new one polling every two seconds.
+    :type watcher: OrderWatcher
+    :param store: Where registered orders are kept, by default a new :py:class:`~bankid.orderstore.MemoryOrderStore`.
+        Use a :py:class:`~bankid.orderstore.SQLiteOrderStore` to stream orders initiated in other worker processes.
+    :type store: OrderStore
+    :param qr_cache: The QR code content cache to use, by default a new one.
+    :type qr_cache: QRCodeContentCache
+    :param order_ttl: Seconds a registered order can be streamed, if no ``store`` is given.
+    :type order_ttl: float
+    :param include_completion_data: Whether to send ``completionData`` to the browser.
+    :type include_completion_data: bool
+    :param clock: Time source, defaults to :py:func:`time.time`.
+
+    """
+
+    def __init__(
+        self,
+        client: BankIDAsyncClient,
+        watcher: Union[OrderWatcher, None] = None,
+        store: Union[OrderStore, None] = None,
+        qr_cache: Union[QRCodeContentCache, None] = None,
+        order_ttl: float = 300.0,
+        include_completion_data: bool = False,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.client = client
+        self.watcher = watcher if watcher is not None else OrderWatcher(client)
+        self.store = store if store is not None else MemoryOrderStore(ttl=order_ttl, clock=clock)
+        self.qr_cache = qr_cache if qr_cache is not None else QRCodeContentCache(clock=clock)
+        self.include_completion_data = include_completion_data
+        self._clock = clock
+        self._streams: Dict[str, _Stream] = {}
+
+    def register(self, order_response: Dict[str, Any], start_t: Union[float, datetime, None] = None) -> None:
+        """Make an order initiated elsewhere available for streaming.
+
+        :param order_response: The response from an auth, sign or other order initiating call.
+        :type order_response: dict
+        :param start_t: When the order response was received, as :py:func:`time.time` or UTC
+            datetime. Defaults to now.
+        :type start_t: float or datetime
+
+        """
+        self.store.add_order(order_response, start_t)
+
+    async def authenticate(self, *args: Any, **kwargs: Any) -> Dict[str, Any]:
+        """Same as :py:meth:`bankid.BankIDAsyncClient.authenticate`, registering the initiated order."""
+        response: Dict[str, Any] = await self.client.authenticate(*args, **kwargs)  # type: ignore[assignment]
+        self.register(response)
+        return response
+
+    async def sign(self, *args: Any, **kwargs: Any) -> Dict[str, Any]:
+        """Same as :py:meth:`bankid.BankIDAsyncClient.sign`, registering the initiated order."""
+        response: Dict[str, Any] = await self.client.sign(*args, **kwargs)  # type: ignore[assignment]
+        self.register(response)
+        return response
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            raise ValueError("Unsupported ASGI scope type: {0}".format(scope["type"]))
+
+        path = scope["path"]
+        root_path = scope.get("root_path", "")
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+        order_ref = path.strip("/")
+        if scope["method"] != "GET":
+            await self._respond(send, 405, b"Method Not Allowed", [(b"allow", b"GET")])
+            return
+        stream = self._streams.get(order_ref)
+        if stream is not None and stream.result is not None:
+            await self._stream_result(stream.result, send)
+            return
+        order = self.store.get(order_ref) if order_ref and "/" not in order_ref else None
+        if order is None:
+            await self._respond(send, 404, b"Not Found")
+            return
+        if stream is None:
+            now = self._clock()
+            for o in [o for o, s in self._streams.items() if s.expires <= now and not s.connections]:
+                del self._streams[o]
+            stream = self._streams[order_ref] = _Stream(order.expires)
+        await self._stream(order, stream, receive, send)
+
+    async def _lifespan(self, receive: Receive, send: Send) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self.watcher.start()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.watcher.stop()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    @staticmethod
+    async def _respond(send: Send, status: int, body: bytes, headers: Union[List[Tuple[bytes, bytes]], None] = None) -> None:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [(b"content-type", b"text/plain; charset=utf-8")] + (headers or []),
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
+
+    def _status_event(self, update: OrderUpdate, with_completion_data: bool = True) -> bytes:
+        if update.error is not None:
+            return _event(
+                "error",
+                json.dumps({"errorCode": update.error.json.get("errorCode"), "details": update.error.json.get("details")}),
+            )
+        response = update.response or {}
+        data = {"orderRef": update.order_ref, "status": response.get("status"), "hintCode": response.get("hintCode")}
+        if with_completion_data and self.include_completion_data and "completionData" in response:
+            completion_data = response["completionData"]
+            # Responses decoded with response_format="struct" are converted back to dicts.
+            data["completionData"] = completion_data.to_dict() if isinstance(completion_data, _Struct) else completion_data
+        return _event("status", json.dumps(data))
+
+    @staticmethod
+    async def _start_stream(send: Send) -> None:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream"),
+                    (b"cache-control", b"no-cache"),
+                    (b"x-accel-buffering", b"no"),
+                ],
+            }
+        )
+
+    async def _stream_result(self, result: bytes, send: Send) -> None:
+        await self._start_stream(send)
+        await send({"type": "http.response.body", "body": result})
+
+    def _qr_event(self, order: StoredOrder) -> bytes:
+        if order.qr_start_token is None or order.qr_start_secret is None:
+            return b""
+        return _event("qr", self.qr_cache.get(order.qr_start_token, order.start_t, order.qr_start_secret))
+
+    async def _stream(self, order: StoredOrder, stream: _Stream, receive: Receive, send: Send) -> None:
+        order_ref = order.order_ref
+        await self._start_stream(send)
+
+        async def wait_for_disconnect() -> None:
+            while (await receive())["type"] != "http.disconnect":
+                pass
+
+        if not self.watcher.running:
+            self.watcher.start()
+        queue = self.watcher.subscribe(order_ref=order_ref)
+        stream.connections += 1
+        self.watcher.watch(order_ref)
+        disconnected = asyncio.ensure_future(wait_for_disconnect())
+        update: "Union[asyncio.Task[OrderUpdate], None]" = None
+        try:
+            last = self.watcher.last_response(order_ref)
+            body = b"" if last is None else self._status_event(OrderUpdate(order_ref, last))
+            while True:
+                now = self._clock()
+                body += self._qr_event(order)
+                if body:
+                    await send({"type": "http.response.body", "body": body, "more_body": True})
+                    body = b""
+
+                # Wait until the next whole second since the order was started, when the QR code changes.
+                next_second = order.start_t + floor(now - order.start_t) + 1
+                while True:
+                    timeout: Union[float, None] = None
+                    if order.qr_start_token is not None:
+                        timeout = next_second - self._clock()
+                        if timeout <= 0:
+                            break
+                    if update is None:
+                        update = asyncio.ensure_future(queue.get())
+                    pending: Set["asyncio.Future[Any]"] = {update, disconnected}
+                    done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                    if disconnected in done:
+                        return
+                    if update in done:
+                        event = self._status_event(update.result())
+                        if update.result().is_final:
+                            # The personal data is not kept to be sent again to later connections.
+                            stream.result = self._status_event(update.result(), with_completion_data=False)
+                            if order.qr_start_token is not None:
+                                self.qr_cache.discard(order.qr_start_token)
+                            await send({"type": "http.response.body", "body": event})
+                            return
+                        await send({"type": "http.response.body", "body": event, "more_body": True})
+                        update = None
+        finally:
+            for task in (disconnected, update):
+                if task is not None and not task.done():
+                    task.cancel()
+            self.watcher.unsubscribe(queue)
+            stream.connections -= 1
+            if not stream.connections and stream.result is None:
+                self.watcher.unwatch(order_ref)
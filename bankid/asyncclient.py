@@ -1,18 +1,25 @@
-from typing import Any, Dict, Tuple, Union
+import asyncio
+from concurrent.futures import Executor
+from contextlib import ExitStack
+from typing import Any, Dict, Iterable, Tuple, Union
 
 import httpx
 
-from bankid.baseclient import BankIDClientBaseclass
-from bankid.exceptions import get_json_error_class
+from bankid import structs
+from bankid.baseclient import BankIDClientBaseclass, PayloadTemplate, _order_ref_body
+from bankid.exceptions import BankIDError, SignatureVerificationError, get_json_error_class
+from bankid.metrics import BankIDMetrics
 from bankid.responses import (
     AuthenticateResponse,
     CollectCompleteResponse,
     CollectFailedResponse,
     CollectPendingResponse,
+    CollectResponse,
     PhoneAuthenticateResponse,
     PhoneSignResponse,
     SignResponse,
 )
+from bankid.tracing import BankIDTracer
 
 
 class BankIDAsyncClient(BankIDClientBaseclass[httpx.AsyncClient]):
@@ -25,14 +32,79 @@ class BankIDAsyncClient(BankIDClientBaseclass[httpx.AsyncClient]):
     :type test_server: bool
     :param request_timeout: Timeout for BankID requests.
     :type request_timeout: int
+    :param transport: Optional ``httpx`` transport to send requests through, e.g.
+        :py:class:`bankid.testing.FakeBankIDTransport`.
+    :type transport: httpx.AsyncBaseTransport
+    :param http2: Use HTTP/2, multiplexing concurrent requests over few connections.
+        Requires the ``h2`` package, e.g. through ``pip install pybankid[http2]``.
+    :type http2: bool
+    :param max_connections: Maximum number of concurrent connections to the BankID server.
+    :type max_connections: int
+    :param max_keepalive_connections: Maximum number of idle connections kept in the pool.
+    :type max_keepalive_connections: int
+    :param keepalive_expiry: Seconds an idle connection is kept in the pool.
+    :type keepalive_expiry: float
+    :param response_format: ``"dict"`` to return responses as dicts, or ``"struct"`` to return the
+        typed objects of :py:mod:`bankid.structs`, which also support read-only dict access.
+    :type response_format: str
+    :param metrics: Optional metrics to record the calls in, see :py:mod:`bankid.metrics`.
+    :type metrics: BankIDMetrics
+    :param tracer: Optional tracer making spans of the calls, see :py:mod:`bankid.tracing`.
+    :type tracer: BankIDTracer
+    :param bankid_root_cert: The BankID root certificate in PEM, to verify completed orders
+        with in :py:meth:`collect`. Requires the ``signature-verification`` extra.
+    :type bankid_root_cert: str
+    :param verify_executor: The thread or process executor completed orders are verified in,
+        by default the event loop's default executor.
+    :type verify_executor: concurrent.futures.Executor
 
     """
 
-    def __init__(self, certificates: Tuple[str, str], test_server: bool = False, request_timeout: int = 5):
-        super().__init__(certificates, test_server, request_timeout)
+    def __init__(
+        self,
+        certificates: Tuple[str, str],
+        test_server: bool = False,
+        request_timeout: int = 5,
+        transport: Union[httpx.AsyncBaseTransport, None] = None,
+        http2: bool = False,
+        max_connections: Union[int, None] = 100,
+        max_keepalive_connections: Union[int, None] = 20,
+        keepalive_expiry: Union[float, None] = 5.0,
+        response_format: str = "dict",
+        metrics: Union[BankIDMetrics, None] = None,
+        tracer: Union[BankIDTracer, None] = None,
+        bankid_root_cert: Union[str, None] = None,
+        verify_executor: Union[Executor, None] = None,
+    ):
+        super().__init__(certificates, test_server, request_timeout, response_format, metrics, tracer, http2)
+        self.bankid_root_cert = bankid_root_cert
+        self.verify_executor = verify_executor
 
         headers = {"Content-Type": "application/json"}
-        self.client = httpx.AsyncClient(cert=self.certs, headers=headers, verify=self.ctx, timeout=request_timeout)
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.client = httpx.AsyncClient(
+            headers=headers,
+            verify=self.ctx,
+            timeout=request_timeout,
+            transport=transport,
+            http2=http2,
+            limits=limits,
+        )
+
+    async def _post(self, url: str, **kwargs: Any) -> httpx.Response:
+        """Send a request to a BankID endpoint, recording it in :py:attr:`metrics` and :py:attr:`tracer` if set."""
+        if self.metrics is None and self.tracer is None:
+            return await self.client.post(url, **kwargs)
+        with ExitStack() as stack:
+            records = self._instrument(stack, url, kwargs, asynchronous=True)
+            response = await self.client.post(url, **kwargs)
+            for record in records:
+                record.response = response
+        return response
 
     async def authenticate(
         self,
@@ -85,10 +157,10 @@ class BankIDAsyncClient(BankIDClientBaseclass[httpx.AsyncClient]):
             user_visible_data_format=user_visible_data_format,
         )
 
-        response = await self.client.post(self._auth_endpoint, json=data)
+        response = await self._post(self._auth_endpoint, json=data)
 
         if response.status_code == 200:
-            return response.json()  # type: ignore[no-any-return]
+            return self._decode(response, structs.AuthenticateResponse.decode)  # type: ignore[no-any-return]
         else:
             raise get_json_error_class(response)
 
@@ -150,10 +222,10 @@ class BankIDAsyncClient(BankIDClientBaseclass[httpx.AsyncClient]):
         data["personalNumber"] = personal_number
         data["callInitiator"] = call_initiator
 
-        response = await self.client.post(self._phone_auth_endpoint, json=data)
+        response = await self._post(self._phone_auth_endpoint, json=data)
 
         if response.status_code == 200:
-            return response.json()  # type: ignore[no-any-return]
+            return self._decode(response, structs.PhoneAuthenticateResponse.decode)  # type: ignore[no-any-return]
         else:
             raise get_json_error_class(response)
 
@@ -206,10 +278,10 @@ class BankIDAsyncClient(BankIDClientBaseclass[httpx.AsyncClient]):
             user_visible_data_format=user_visible_data_format,
         )
 
-        response = await self.client.post(self._sign_endpoint, json=data)
+        response = await self._post(self._sign_endpoint, json=data)
 
         if response.status_code == 200:
-            return response.json()  # type: ignore[no-any-return]
+            return self._decode(response, structs.SignResponse.decode)  # type: ignore[no-any-return]
         else:
             raise get_json_error_class(response)
 
@@ -269,20 +341,71 @@ class BankIDAsyncClient(BankIDClientBaseclass[httpx.AsyncClient]):
         data["personalNumber"] = personal_number
         data["callInitiator"] = call_initiator
 
-        response = await self.client.post(self._phone_sign_endpoint, json=data)
+        response = await self._post(self._phone_sign_endpoint, json=data)
 
         if response.status_code == 200:
-            return response.json()  # type: ignore[no-any-return]
+            return self._decode(response, structs.PhoneSignResponse.decode)  # type: ignore[no-any-return]
         else:
             raise get_json_error_class(response)
 
-    async def collect(self, order_ref: str) -> Union[CollectPendingResponse, CollectCompleteResponse, CollectFailedResponse]:
+    async def authenticate_with_template(self, template: PayloadTemplate, end_user_ip: str) -> AuthenticateResponse:
+        """Request an authentication order with a body from :py:meth:`payload_template`.
+
+        This is the same as calling :py:meth:`authenticate` with the arguments the template was created with,
+        but the request body is encoded only once for all orders.
+
+        :param template: The encoded requirement and user data.
+        :type template: PayloadTemplate
+        :param end_user_ip: The user IP address as seen by RP. String. IPv4 and IPv6 is allowed.
+        :type end_user_ip: str
+        :return: The order response parsed as a dict.
+        :rtype: AuthenticateResponse
+        :raises BankIDError: raises a subclass of this error
+                             when error has been returned from server.
+
+        """
+        response = await self._post(self._auth_endpoint, content=template.render(end_user_ip))
+
+        if response.status_code == 200:
+            return self._decode(response, structs.AuthenticateResponse.decode)  # type: ignore[no-any-return]
+        else:
+            raise get_json_error_class(response)
+
+    async def sign_with_template(self, template: PayloadTemplate, end_user_ip: str) -> SignResponse:
+        """Request a signing order with a body from :py:meth:`payload_template`.
+
+        This is the same as calling :py:meth:`sign` with the arguments the template was created with,
+        but the request body is encoded only once for all orders.
+
+        :param template: The encoded requirement and user data, which must include ``user_visible_data``.
+        :type template: PayloadTemplate
+        :param end_user_ip: The user IP address as seen by RP. String. IPv4 and IPv6 is allowed.
+        :type end_user_ip: str
+        :return: The order response parsed as a dict.
+        :rtype: SignResponse
+        :raises BankIDError: raises a subclass of this error
+                             when error has been returned from server.
+
+        """
+        if "userVisibleData" not in template.payload:
+            raise ValueError("Sign templates must have user_visible_data")
+        response = await self._post(self._sign_endpoint, content=template.render(end_user_ip))
+
+        if response.status_code == 200:
+            return self._decode(response, structs.SignResponse.decode)  # type: ignore[no-any-return]
+        else:
+            raise get_json_error_class(response)
+
+    async def collect(
+        self, order_ref: str, verify: bool = False
+    ) -> Union[CollectPendingResponse, CollectCompleteResponse, CollectFailedResponse]:
         """Collects the result of a sign or auth order using the
         ``orderRef`` as reference.
 
         RP should keep on calling collect every two seconds if status is pending.
         RP must abort if status indicates failed. The user identity is returned
-        when complete.
+        when complete. :py:class:`bankid.polling.AdaptivePollingPolicy` can choose
+        the interval between calls from the ``hintCode`` and age of the order instead.
 
         Example collect results returned while authentication or signing is
         still pending:
@@ -335,19 +458,88 @@ class BankIDAsyncClient(BankIDClientBaseclass[httpx.AsyncClient]):
 
         :param order_ref: The ``orderRef`` UUID returned from auth or sign.
         :type order_ref: str
+        :param verify: Verify the signature and OCSP response of a completed order with
+            :py:func:`bankid.experimental.verify.verify_bankid_response_async` in
+            :py:attr:`verify_executor`, against :py:attr:`bankid_root_cert`.
+        :type verify: bool
         :return: The order response parsed to a dict.
         :rtype: Union[CollectPendingResponse, CollectCompleteResponse, CollectFailedResponse]
         :raises BankIDError: raises a subclass of this error
                              when error has been returned from server.
+        :raises SignatureVerificationError: if ``verify`` is set and a completed order does not verify.
 
         """
-        response = await self.client.post(self._collect_endpoint, json={"orderRef": order_ref})
+        if verify and self.bankid_root_cert is None:
+            raise ValueError("Verifying completed orders requires the client's bankid_root_cert")
+        response = await self._post(self._collect_endpoint, content=_order_ref_body(order_ref))
 
         if response.status_code == 200:
-            return response.json()  # type: ignore[no-any-return]
+            result = self._decode(response, structs.decode_collect)
+            if self.metrics is not None:
+                self.metrics.observe_collect(result)
+            if verify and result["status"] == "complete":
+                await self._verify(result, response)
+            return result  # type: ignore[no-any-return]
         else:
             raise get_json_error_class(response)
 
+    async def _verify(self, result: Any, response: httpx.Response) -> None:
+        from bankid.experimental.verify import data_errors, verify_bankid_response_async
+
+        completion_data = result["completionData"]
+        # Structs support dict access, but the verification takes a dict of the fields it uses.
+        bank_id_response = {
+            "completionData": {
+                "signature": completion_data["signature"],
+                "ocspResponse": completion_data["ocspResponse"],
+            }
+        }
+        try:
+            await verify_bankid_response_async(
+                bank_id_response, BANK_ID_ROOT_CERT=self.bankid_root_cert, executor=self.verify_executor
+            )
+        except data_errors() as e:
+            # Other errors, e.g. from the executor, are not about the response and are raised as they are.
+            raise SignatureVerificationError(
+                "Completed order could not be verified: {0}".format(e), raw_data=response.json()
+            ) from e
+
+    async def collect_many(
+        self, order_refs: Iterable[str], concurrency: int = 10
+    ) -> Dict[str, Union[CollectResponse, BankIDError, httpx.HTTPError]]:
+        """Collects the results of several orders concurrently, with at most
+        ``concurrency`` collect calls in flight.
+
+        An error for one order does not abort the batch; the raised
+        :py:class:`~bankid.exceptions.BankIDError` or :py:class:`httpx.HTTPError`
+        is returned in place of its response.
+
+        :param order_refs: The ``orderRef`` UUIDs returned from auth or sign.
+        :type order_refs: iterable
+        :param concurrency: Maximum number of collect calls in flight.
+        :type concurrency: int
+        :return: Mapping of each ``orderRef`` to its collect response, or to the
+            :py:class:`~bankid.exceptions.BankIDError` or :py:class:`httpx.HTTPError`
+            raised when collecting it.
+        :rtype: Dict[str, Union[CollectResponse, BankIDError, httpx.HTTPError]]
+        :raises ValueError: If ``concurrency`` is less than 1.
+
+        """
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def _collect(order_ref: str) -> Union[CollectResponse, BankIDError, httpx.HTTPError]:
+            async with semaphore:
+                try:
+                    return await self.collect(order_ref)
+                except (BankIDError, httpx.HTTPError) as e:
+                    return e
+
+        refs = list(dict.fromkeys(order_refs))
+        results = await asyncio.gather(*(_collect(order_ref) for order_ref in refs))
+        return dict(zip(refs, results))
+
     async def cancel(self, order_ref: str) -> bool:
         """Cancels an ongoing sign or auth order.
 
@@ -362,7 +554,7 @@ class BankIDAsyncClient(BankIDClientBaseclass[httpx.AsyncClient]):
                              when error has been returned from server.
 
         """
-        response = await self.client.post(self._cancel_endpoint, json={"orderRef": order_ref})
+        response = await self._post(self._cancel_endpoint, content=_order_ref_body(order_ref))
 
         if response.status_code == 200:
             return response.json() == {}  # type: ignore[no-any-return]
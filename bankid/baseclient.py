@@ -1,16 +1,58 @@
 import base64
-import ssl
+import json
+import re
+from contextlib import ExitStack
 from datetime import datetime
-from typing import Any, Dict, Generic, Tuple, TypeVar, Union
+from typing import Any, Callable, Dict, Generic, List, Tuple, TypeVar, Union
 from urllib.parse import urljoin
 
 from bankid.qr import generate_qr_code_content
-from bankid.certutils import resolve_cert_path
+from bankid.certutils import get_ssl_context, resolve_cert_path
+from bankid.metrics import BankIDMetrics
+from bankid.structs import loads
+from bankid.tracing import BankIDTracer
 
 import httpx
 
 TClient = TypeVar("TClient", httpx.AsyncClient, httpx.Client)
 
+# Strings made up of these characters, e.g. UUIDs and IP addresses, need no escaping in JSON.
+_JSON_SAFE = re.compile(r"[0-9A-Za-z.:%_-]*\Z")
+
+
+def _json_string(value: str) -> bytes:
+    if _JSON_SAFE.match(value):
+        return b'"' + value.encode("ascii") + b'"'
+    return json.dumps(value, ensure_ascii=False).encode("utf-8")
+
+
+def _order_ref_body(order_ref: str) -> bytes:
+    """The JSON body of collect and cancel calls."""
+    return b'{"orderRef":' + _json_string(order_ref) + b"}"
+
+
+class PayloadTemplate:
+    """An auth or sign request body encoded once, to be stamped with only ``endUserIp`` per order.
+
+    Create templates with :py:meth:`BankIDClientBaseclass.payload_template` and send them
+    with the ``authenticate_with_template`` and ``sign_with_template`` client methods.
+
+    :param payload: The request body without ``endUserIp``.
+    :type payload: dict
+
+    """
+
+    __slots__ = ("payload", "_tail")
+
+    def __init__(self, payload: Dict[str, Any]):
+        self.payload = payload
+        body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self._tail = b"," + body[1:] if payload else b"}"
+
+    def render(self, end_user_ip: str) -> bytes:
+        """The request body for an order from ``end_user_ip``."""
+        return b'{"endUserIp":' + _json_string(end_user_ip) + self._tail
+
 
 class BankIDClientBaseclass(Generic[TClient]):
     """Baseclass for BankID clients.
@@ -25,8 +67,17 @@ class BankIDClientBaseclass(Generic[TClient]):
         certificates: Tuple[str, str],
         test_server: bool = False,
         request_timeout: int = 5,
+        response_format: str = "dict",
+        metrics: Union[BankIDMetrics, None] = None,
+        tracer: Union[BankIDTracer, None] = None,
+        http2: bool = False,
     ):
+        if response_format not in ("dict", "struct"):
+            raise ValueError("response_format must be 'dict' or 'struct', not {0!r}".format(response_format))
         self.certs = certificates
+        self.response_format = response_format
+        self.metrics = metrics
+        self.tracer = tracer
 
         if test_server:
             self.api_url = "https://appapi2.test.bankid.com/rp/v6.0/"
@@ -34,7 +85,9 @@ class BankIDClientBaseclass(Generic[TClient]):
         else:
             self.api_url = "https://appapi2.bankid.com/rp/v6.0/"
             self.verify_cert = resolve_cert_path("appapi2.bankid.com.pem")
-        self.ctx = ssl.create_default_context(cafile=self.verify_cert)
+        # The client certificate is loaded into the pinned context, which is shared between clients
+        # using the same HTTP version, as ALPN is set on the context.
+        self.ctx = get_ssl_context(self.verify_cert, certificates[0], certificates[1], http2)
 
         self._auth_endpoint = urljoin(self.api_url, "auth")
         self._phone_auth_endpoint = urljoin(self.api_url, "phone/auth")
@@ -47,6 +100,51 @@ class BankIDClientBaseclass(Generic[TClient]):
     def generate_qr_code_content(qr_start_token: str, start_t: Union[float, datetime], qr_start_secret: str) -> str:
         return generate_qr_code_content(qr_start_token, start_t, qr_start_secret)
 
+    def _instrument(self, stack: ExitStack, url: str, kwargs: Dict[str, Any], asynchronous: bool) -> List[Any]:
+        """Enter the metrics and tracing records of a call to ``url`` on ``stack``, adding the
+        ``httpx`` trace extension to the request ``kwargs``. The ``response`` of each returned record
+        must be set once the call has returned one."""
+        endpoint = url[len(self.api_url) :]
+        records: List[Any] = []
+        if self.metrics is not None:
+            records.append(stack.enter_context(self.metrics.track(endpoint)))
+        if self.tracer is not None:
+            span = stack.enter_context(self.tracer.span("POST", url, endpoint, kwargs.get("content")))
+            kwargs["extensions"] = {"trace": span.atrace if asynchronous else span.trace}
+            records.append(span)
+        return records
+
+    def _decode(self, response: httpx.Response, decoder: Callable[[bytes], Any]) -> Any:
+        """Decode a successful response body, with ``decoder`` from :py:mod:`bankid.structs` if structs are used."""
+        if self.response_format == "struct":
+            return decoder(response.content)
+        return loads(response.content)
+
+    def payload_template(
+        self,
+        requirement: Union[Dict[str, Any], None] = None,
+        user_visible_data: Union[str, None] = None,
+        user_non_visible_data: Union[str, None] = None,
+        user_visible_data_format: Union[str, None] = None,
+    ) -> PayloadTemplate:
+        """Encode the parts of an auth or sign request that are the same for many orders.
+
+        The parameters are the same as for ``authenticate`` and ``sign``. The template is then sent
+        with ``authenticate_with_template`` or ``sign_with_template``, which only add ``endUserIp``.
+
+        :return: The encoded request body template.
+        :rtype: PayloadTemplate
+
+        """
+        return PayloadTemplate(
+            self._create_payload(
+                requirement=requirement,
+                user_visible_data=user_visible_data,
+                user_non_visible_data=user_non_visible_data,
+                user_visible_data_format=user_visible_data_format,
+            )
+        )
+
     @staticmethod
     def _encode_user_data(user_data: str) -> str:
         return base64.b64encode(user_data.encode("utf-8")).decode("ascii")
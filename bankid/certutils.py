@@ -6,9 +6,12 @@
 """
 
 import os
+import ssl
 import sys
-import subprocess
-from typing import Tuple, Union
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Mapping, Tuple, Union
 
 import pathlib
 if sys.version_info < (3, 9):
@@ -21,6 +24,8 @@ from bankid.exceptions import BankIDError
 
 _TEST_CERT_PASSWORD = "qwerty123"
 
+_PathType = Union[str, "os.PathLike[str]"]
+
 
 def resolve_cert_path(file: str) -> pathlib.Path:
     path = impres.files("bankid.certs").joinpath(file)
@@ -28,6 +33,63 @@ def resolve_cert_path(file: str) -> pathlib.Path:
     return path
 
 
+class SSLContextRegistry:
+    """Process-wide cache of mTLS :py:class:`ssl.SSLContext` objects.
+
+    Each context is built once per CA file, certificate file, key file and HTTP version and
+    then shared by all clients using the same files. Clients using HTTP/2 get a context of
+    their own, as ``httpx`` sets the ALPN protocols of the context when connecting. The files are checked with
+    ``os.stat`` on every lookup and the context is rebuilt if any of them has changed.
+
+    """
+
+    def __init__(self) -> None:
+        self._contexts: Dict[Tuple[str, str, str, bool], Tuple[Tuple[Tuple[int, int, int], ...], ssl.SSLContext]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._contexts)
+
+    def get(self, cafile: _PathType, certfile: _PathType, keyfile: _PathType, http2: bool = False) -> ssl.SSLContext:
+        """Return the shared context pinning ``cafile`` and presenting the ``certfile``/``keyfile`` client certificate.
+
+        ``http2`` tells whether the context is for clients offering HTTP/2 in ALPN.
+
+        :raises OSError: if any of the files cannot be read.
+        :raises ssl.SSLError: if the certificate or key cannot be loaded.
+
+        """
+        paths = (os.path.abspath(cafile), os.path.abspath(certfile), os.path.abspath(keyfile))
+        key = paths + (http2,)
+        signature = tuple(_file_signature(path) for path in paths)
+        with self._lock:
+            entry = self._contexts.get(key)
+            if entry is not None and entry[0] == signature:
+                return entry[1]
+            ctx = ssl.create_default_context(cafile=paths[0])
+            ctx.load_cert_chain(paths[1], paths[2])
+            ctx.set_alpn_protocols(["h2", "http/1.1"] if http2 else ["http/1.1"])
+            self._contexts[key] = (signature, ctx)
+            return ctx
+
+    def clear(self) -> None:
+        with self._lock:
+            self._contexts.clear()
+
+
+def _file_signature(path: str) -> Tuple[int, int, int]:
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+ssl_context_registry = SSLContextRegistry()
+
+
+def get_ssl_context(cafile: _PathType, certfile: _PathType, keyfile: _PathType, http2: bool = False) -> ssl.SSLContext:
+    """Get the shared mTLS context for the given files from the process-wide :py:class:`SSLContextRegistry`."""
+    return ssl_context_registry.get(cafile, certfile, keyfile, http2)
+
+
 def create_bankid_test_server_cert_and_key(destination_path: str = ".") -> Tuple[str, str]:
     """Split the bundled test certificate into certificate and key parts and save them
     as separate files, stored in PEM format.
@@ -55,6 +117,71 @@ def create_bankid_test_server_cert_and_key(destination_path: str = ".") -> Tuple
     return certificate, key
 
 
+def pkcs12_to_pem(data: bytes, password: Union[str, bytes, None] = None) -> Tuple[bytes, bytes]:
+    """Splits PKCS12 data into the PEM encoded certificate and unencrypted key, in this process.
+
+    Like ``openssl pkcs12 -clcerts -nodes``, only the certificate belonging to the key is
+    kept, and the key is given in PKCS8. Requires the ``cryptography`` package, e.g. through
+    ``pip install pybankid[pkcs12]``.
+
+    :param data: The contents of a ``.p12`` or ``.pfx`` file.
+    :type data: bytes
+    :param password: The password of the PKCS12 data, if any.
+    :type password: str
+    :returns: Tuple of certificate and key PEM data.
+    :rtype: tuple
+    :raises BankIDError: if the data cannot be decrypted or holds no certificate and key.
+
+    """
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.serialization import pkcs12
+
+    if isinstance(password, str):
+        password = password.encode("utf-8")
+    try:
+        key, certificate, _ = pkcs12.load_key_and_certificates(data, password)
+    except ValueError as e:
+        raise BankIDError("Error converting certificate: {0}".format(e))
+    if key is None or certificate is None:
+        raise BankIDError("Error converting certificate: PKCS12 data holds no certificate and key")
+    return (
+        certificate.public_bytes(serialization.Encoding.PEM),
+        key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        ),
+    )
+
+
+def _destination_paths(destination_folder: _PathType, cert_name: str, key_name: str) -> Tuple[str, str]:
+    folder = os.path.abspath(os.path.expanduser(destination_folder))
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, cert_name), os.path.join(folder, key_name)
+
+
+def _write_atomically(path: str, data: bytes, mode: int = 0o644) -> None:
+    """Write ``data`` to ``path`` through a temporary file, so that ``path`` is never partially written."""
+    fd, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            os.chmod(temporary_path, mode)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+
+def _write_pem(certificate_path: _PathType, out_cert_path: str, out_key_path: str, password: Union[str, None]) -> None:
+    with open(certificate_path, "rb") as f:
+        cert_pem, key_pem = pkcs12_to_pem(f.read(), password)
+    _write_atomically(out_cert_path, cert_pem)
+    # Only the owner may read the unencrypted key.
+    _write_atomically(out_key_path, key_pem, 0o600)
+
+
 def split_certificate(certificate_path: str, destination_folder: str, password: Union[str, None] = None) -> Tuple[str, str]:
     """Splits a PKCS12 certificate into Base64-encoded DER certificate and key.
 
@@ -62,12 +189,94 @@ def split_certificate(certificate_path: str, destination_folder: str, password:
     `PKCS12 <https://en.wikipedia.org/wiki/PKCS_12>`_ certificate
     (format ``.p12`` or ``.pfx``) into one certificate and one key part, both in
     `pem <https://en.wikipedia.org/wiki/X.509#Certificate_filename_extensions>`_
-    format.
+    format, saved as ``certificate.pem`` and ``key.pem`` in ``destination_folder``.
 
-    :returns: Tuple of certificate and key string data.
+    The files are written atomically with :py:func:`pkcs12_to_pem` if the ``cryptography``
+    package is installed, and with the ``openssl`` executable otherwise.
+
+    :returns: Tuple of certificate and key file paths.
     :rtype: tuple
 
     """
+    try:
+        import cryptography  # noqa: F401
+    except ImportError:
+        return _split_certificate_with_openssl(certificate_path, destination_folder, password)
+
+    out_cert_path, out_key_path = _destination_paths(destination_folder, "certificate.pem", "key.pem")
+    _write_pem(certificate_path, out_cert_path, out_key_path, password)
+    return out_cert_path, out_key_path
+
+
+def _split_one(certificate_path: str, destination_folder: str, password: Union[str, None]) -> Tuple[str, str]:
+    stem = os.path.splitext(os.path.basename(certificate_path))[0]
+    try:
+        out_cert_path, out_key_path = _destination_paths(destination_folder, stem + "_cert.pem", stem + "_key.pem")
+        _write_pem(certificate_path, out_cert_path, out_key_path, password)
+    except OSError as e:
+        raise BankIDError("Error converting certificate: {0}".format(e))
+    return out_cert_path, out_key_path
+
+
+def split_certificates(
+    source_folder: _PathType,
+    destination_folder: _PathType,
+    password: Union[str, Mapping[str, str], None] = None,
+    workers: Union[int, None] = None,
+) -> Dict[str, Union[Tuple[str, str], BankIDError]]:
+    """Splits all ``.p12`` and ``.pfx`` files in a folder into certificate and key PEM files, in parallel.
+
+    The files of ``name.p12`` are saved atomically as ``name_cert.pem`` and ``name_key.pem`` in
+    ``destination_folder``. An error for one file does not stop the others; the raised
+    :py:class:`~bankid.exceptions.BankIDError` is returned in place of its paths. Requires the
+    ``cryptography`` package.
+
+    :param source_folder: The folder with the PKCS12 files.
+    :type source_folder: str
+    :param destination_folder: The folder to save the PEM files in.
+    :type destination_folder: str
+    :param password: The password of all files, or a mapping of file names to their passwords.
+    :type password: Union[str, Mapping[str, str]]
+    :param workers: Number of worker processes, by default the number of CPUs. With 0 the
+        files are split in this process.
+    :type workers: int
+    :returns: Mapping of each PKCS12 file path to its certificate and key paths, or to the error.
+    :rtype: dict
+
+    """
+    paths = sorted(
+        os.path.join(source_folder, name)
+        for name in os.listdir(source_folder)
+        if name.lower().endswith((".p12", ".pfx"))
+    )
+    passwords = [password.get(os.path.basename(p)) if isinstance(password, Mapping) else password for p in paths]
+    destination = os.fspath(destination_folder)
+
+    results: Dict[str, Union[Tuple[str, str], BankIDError]] = {}
+    if workers == 0:
+        for path, pw in zip(paths, passwords):
+            try:
+                results[path] = _split_one(path, destination, pw)
+            except BankIDError as e:
+                results[path] = e
+        return results
+
+    with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count() or 1, max(len(paths), 1))) as executor:
+        futures = [executor.submit(_split_one, path, destination, pw) for path, pw in zip(paths, passwords)]
+        for path, future in zip(paths, futures):
+            try:
+                results[path] = future.result()
+            except BankIDError as e:
+                results[path] = e
+    return results
+
+
+def _split_certificate_with_openssl(
+    certificate_path: str, destination_folder: str, password: Union[str, None] = None
+) -> Tuple[str, str]:
+    """Split a PKCS12 certificate with the ``openssl`` executable, for when ``cryptography`` is not installed."""
+    import subprocess
+
     try:
         # Attempt Linux and Darwin call first.
         p = subprocess.Popen(["openssl", "version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
@@ -88,12 +297,7 @@ def split_certificate(certificate_path: str, destination_folder: str, password:
             raise BankIDError("OpenSSL executable could not be found. " "Splitting cannot be performed.")
         openssl_executable = "C:\\Program Files\\Git\\mingw64\\bin\\openssl.exe"
 
-    if not os.path.exists(os.path.abspath(os.path.expanduser(destination_folder))):
-        os.makedirs(os.path.abspath(os.path.expanduser(destination_folder)))
-
-    # Paths to output files.
-    out_cert_path = os.path.join(os.path.abspath(os.path.expanduser(destination_folder)), "certificate.pem")
-    out_key_path = os.path.join(os.path.abspath(os.path.expanduser(destination_folder)), "key.pem")
+    out_cert_path, out_key_path = _destination_paths(destination_folder, "certificate.pem", "key.pem")
 
     # Use openssl for converting to pem format.
     pipeline_1 = [
@@ -1,6 +1,8 @@
 from __future__ import annotations
-import httpx
-from typing import Any, Dict, Union
+from typing import TYPE_CHECKING, Any, Dict, Union
+
+if TYPE_CHECKING:
+    import httpx
 
 
 def get_json_error_class(response: httpx.Response) -> BankIDError:
@@ -140,6 +142,41 @@ class RequestTimeoutError(BankIDError):
         self.rfa = 5
 
 
+class CircuitOpenError(BankIDError):
+    """The request was not sent since BankID has recently been failing.
+
+    Raised by :py:mod:`bankid.resilience` clients, without calling BankID, while the circuit
+    breaker is open after too many ``internalError``, ``maintenance``, ``requestTimeout`` or
+    transport errors.
+
+    **Action by RP:** RP may try again after ``retry_after`` seconds. RP must
+    inform the user that a technical error has occurred. Message RFA5.
+
+    """
+
+    def __init__(self, *args: Any, retry_after: float = 0.0, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.rfa = 5
+        self.retry_after = retry_after
+
+
+class SignatureVerificationError(BankIDError):
+    """The signature or OCSP response of a completed order did not verify.
+
+    Raised by :py:meth:`bankid.BankIDAsyncClient.collect` when it is asked to verify completed
+    orders, see :py:func:`bankid.experimental.verify.verify_bankid_response_async`. The collect
+    response is available as ``json``.
+
+    **Action by RP:** RP must not accept the authentication or signature. RP must
+    inform the user that a technical error has occurred. Message RFA22.
+
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.rfa = 22
+
+
 _JSON_ERROR_CODE_TO_CLASS: Dict[str, type[BankIDError]] = {
     "invalidParameters": InvalidParametersError,
     "alreadyInProgress": AlreadyInProgressError,
@@ -0,0 +1,91 @@
+"""Cache of the certificate work that repeats across verified BankID responses.
+
+The bank and BankID CA certificates, the root certificate and the OCSP responder certificates
+are the same in most responses. :py:class:`VerificationCache` keeps them parsed, keeps the
+certificate stores built from them, and remembers which OCSP responder certificates were
+verified up to the root, so that :py:func:`bankid.experimental.verify.verify_bankid_response`
+is left with the checks of the user's certificate, signature and OCSP response::
+
+    cache = VerificationCache(maxsize=1024, ttl=3600)
+    verify_bankid_response(response, BANK_ID_ROOT_CERT=root, cache=cache)
+
+Entries are keyed by the SHA-256 fingerprint of the certificates, expire after ``ttl`` seconds,
+or when a certificate they depend on expires if that is sooner, and the least recently used
+entries are evicted beyond ``maxsize``.
+
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Tuple, Union
+
+
+def fingerprint(data: Union[bytes, str]) -> bytes:
+    """The SHA-256 digest of a certificate's DER or PEM encoding."""
+    return hashlib.sha256(data.encode("ascii") if isinstance(data, str) else data).digest()
+
+
+class VerificationCache:
+    """A thread safe LRU cache whose entries expire.
+
+    :param maxsize: Greatest number of entries, 0 to cache nothing.
+    :type maxsize: int
+    :param ttl: Seconds an entry is kept at most.
+    :type ttl: float
+    :param clock: Time source in seconds since the epoch, so that entries can expire with certificates.
+
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600.0, clock: Callable[[], float] = time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, factory: Callable[[], Any], expires: Union[Callable[[Any], float], None] = None) -> Any:
+        """The value cached for ``key``, made by ``factory`` if it is missing or has expired.
+
+        Exceptions raised by ``factory`` are not cached.
+
+        :param key: The cache key.
+        :param factory: Makes the value.
+        :param expires: Gives the time a new value must expire at the latest, e.g. when its certificate does.
+
+        """
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        value = factory()
+        if self.maxsize <= 0:
+            return value
+        expiry = now + self.ttl
+        if expires is not None:
+            expiry = min(expiry, expires(value))
+        with self._lock:
+            self._entries[key] = (expiry, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+
+#: The cache used by :py:func:`~bankid.experimental.verify.verify_bankid_response` unless another one is given.
+default_cache = VerificationCache()
@@ -0,0 +1,302 @@
+"""Verification of complete collect responses with the ``cryptography`` package.
+
+An alternative to :py:func:`bankid.experimental.verify.verify_bankid_response` with the same
+checks, arguments and errors, that does without pyOpenSSL and asn1crypto::
+
+    from bankid.experimental.engine import verify_bankid_response
+
+    produced_at = verify_bankid_response(response, BANK_ID_ROOT_CERT=root)
+
+The certificates are loaded as DER straight from the base64 ``X509Certificate`` elements, the
+digests and the signature value are read from the offsets of the signature XML without parsing
+it, and the OCSP response is parsed once, its signature checked over its ``tbs_response_data``
+and its nonce read from the same bytes. The CA certificates are verified up to the root once and
+kept in the :py:class:`~bankid.experimental.cache.VerificationCache` with their public keys,
+as is the public key of each verified OCSP responder, so that a response takes three signature
+verifications: of ``SignedInfo``, of the user's certificate and of the OCSP response.
+
+Requires the ``cryptography`` and ``pytz`` packages, which the ``signature-verification`` extra installs.
+
+"""
+
+import base64
+import binascii
+import datetime
+import hashlib
+import re
+from typing import Any, Dict, Tuple, Union
+
+import pytz
+from cryptography import x509
+from cryptography.exceptions import InvalidSignature, UnsupportedAlgorithm
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
+from cryptography.hazmat.primitives.asymmetric.utils import encode_dss_signature
+from cryptography.x509 import ocsp
+
+from bankid.experimental.cache import VerificationCache, default_cache, fingerprint
+from bankid.experimental.helper import CompletionDataContainer
+
+_DIGEST_VALUE = re.compile(rb"<DigestValue>([^<]*)</DigestValue>")
+_SIGNATURE_METHOD = re.compile(rb'<SignatureMethod Algorithm="[^"#]*#(rsa|ecdsa)-(sha\d+)"')
+_SIGNATURE_VALUE = re.compile(rb"<SignatureValue[^>]*>([^<]*)</SignatureValue>")
+_X509_CERTIFICATE = re.compile(rb"<X509Certificate>([^<]*)</X509Certificate>")
+
+# The DER encoded object identifier of the OCSP nonce extension, 1.3.6.1.5.5.7.48.1.2.
+_NONCE_OID = bytes.fromhex("06092b0601050507300102")
+
+_STOCKHOLM = pytz.timezone("Europe/Stockholm")
+
+# The CA certificates verified up to the root, with their public keys, by subject.
+_Issuers = Dict[x509.Name, Tuple[x509.Certificate, Any]]
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _not_before(certificate: x509.Certificate) -> datetime.datetime:
+    if hasattr(certificate, "not_valid_before_utc"):
+        return certificate.not_valid_before_utc
+    return certificate.not_valid_before.replace(tzinfo=datetime.timezone.utc)
+
+
+def _not_after(certificate: x509.Certificate) -> datetime.datetime:
+    if hasattr(certificate, "not_valid_after_utc"):
+        return certificate.not_valid_after_utc
+    return certificate.not_valid_after.replace(tzinfo=datetime.timezone.utc)
+
+
+def _is_valid(certificate: x509.Certificate, now: datetime.datetime, ensure_certificates_still_valid: bool) -> bool:
+    # Like the pyOpenSSL engine, expired certificates are accepted unless the expiry is ensured.
+    return _not_before(certificate) <= now and (not ensure_certificates_still_valid or now <= _not_after(certificate))
+
+
+def _verify(
+    public_key: Any,
+    signature: bytes,
+    data: bytes,
+    hash_algorithm: hashes.HashAlgorithm,
+    rsa_padding: Union[padding.AsymmetricPadding, None] = None,
+) -> None:
+    """Verify ``signature`` of ``data`` with an RSA or EC ``public_key``, raising ``InvalidSignature`` if it is not valid."""
+    if isinstance(public_key, rsa.RSAPublicKey):
+        public_key.verify(signature, data, rsa_padding or padding.PKCS1v15(), hash_algorithm)
+    elif isinstance(public_key, ec.EllipticCurvePublicKey):
+        public_key.verify(signature, data, ec.ECDSA(hash_algorithm))
+    else:
+        raise InvalidSignature("Unsupported public key type {0}".format(type(public_key).__name__))
+
+
+def _signed_by(certificate: x509.Certificate, issuer_key: Any) -> bool:
+    """Whether ``certificate`` is signed with the private key of ``issuer_key``."""
+    hash_algorithm = certificate.signature_hash_algorithm
+    if hash_algorithm is None:
+        return False
+    parameters = certificate.signature_algorithm_parameters
+    rsa_padding = parameters if isinstance(parameters, padding.AsymmetricPadding) else None
+    try:
+        _verify(issuer_key, certificate.signature, certificate.tbs_certificate_bytes, hash_algorithm, rsa_padding)
+    except (InvalidSignature, UnsupportedAlgorithm):
+        return False
+    return True
+
+
+def _is_ca(certificate: x509.Certificate) -> bool:
+    try:
+        return bool(certificate.extensions.get_extension_for_class(x509.BasicConstraints).value.ca)
+    except x509.ExtensionNotFound:
+        return False
+
+
+def _cached_certificate(cache: VerificationCache, data: bytes, pem: bool = False) -> x509.Certificate:
+    def load() -> x509.Certificate:
+        return x509.load_pem_x509_certificate(data) if pem else x509.load_der_x509_certificate(data)
+
+    return cache.get(  # type: ignore[no-any-return]
+        ("cryptography.certificate", fingerprint(data)), load, lambda c: _not_after(c).timestamp()
+    )
+
+
+def _issuers(
+    root: x509.Certificate, intermediates: Tuple[x509.Certificate, ...], ensure_certificates_still_valid: bool
+) -> _Issuers:
+    """The root and the ``intermediates`` that are CAs verified up to it, with their public keys."""
+    now = _now()
+    issuers: _Issuers = {}
+    if _is_valid(root, now, ensure_certificates_still_valid):
+        issuers[root.subject] = (root, root.public_key())
+    pending = [c for c in intermediates if c.subject not in issuers]
+    progress = True
+    while progress:
+        progress = False
+        for certificate in list(pending):
+            issuer = issuers.get(certificate.issuer)
+            if issuer is None:
+                continue
+            pending.remove(certificate)
+            progress = True
+            if (
+                _is_ca(certificate)
+                and _is_valid(certificate, now, ensure_certificates_still_valid)
+                and _signed_by(certificate, issuer[1])
+            ):
+                issuers[certificate.subject] = (certificate, certificate.public_key())
+    return issuers
+
+
+def _issued_by(certificate: x509.Certificate, issuers: _Issuers, ensure_certificates_still_valid: bool) -> bool:
+    issuer = issuers.get(certificate.issuer)
+    if issuer is None or not _is_valid(certificate, _now(), ensure_certificates_still_valid):
+        return False
+    return _signed_by(certificate, issuer[1])
+
+
+def _nonce(tbs_response_data: bytes) -> bytes:
+    """The value of the nonce extension in the DER encoded ``tbs_response_data``, empty if there is none."""
+    position = tbs_response_data.rfind(_NONCE_OID)
+    if position < 0:
+        return b""
+    position += len(_NONCE_OID)
+    if tbs_response_data[position : position + 1] == b"\x01":
+        # Skip the critical flag.
+        position += 3
+    if tbs_response_data[position : position + 1] != b"\x04":
+        return b""
+    length = tbs_response_data[position + 1]
+    position += 2
+    if length & 0x80:
+        size = length & 0x7F
+        length = int.from_bytes(tbs_response_data[position : position + size], "big")
+        position += size
+    return tbs_response_data[position : position + length]
+
+
+def verify_bankid_response(
+    bank_id_response: Dict[str, Any],
+    ensure_certificates_still_valid: bool = True,
+    BANK_ID_ROOT_CERT: Union[str, None] = None,
+    cache: Union[VerificationCache, None] = None,
+) -> str:
+    """Verify the signature, OCSP response and certificate chains of a complete collect response.
+
+    :param bank_id_response: The complete collect response.
+    :type bank_id_response: dict
+    :param ensure_certificates_still_valid: Whether expired certificates fail verification.
+    :type ensure_certificates_still_valid: bool
+    :param BANK_ID_ROOT_CERT: The BankID root certificate in PEM.
+    :type BANK_ID_ROOT_CERT: str
+    :param cache: Cache of the CA certificates and the OCSP responders' public keys,
+        by default :py:data:`bankid.experimental.cache.default_cache`.
+    :type cache: :py:class:`bankid.experimental.cache.VerificationCache`
+    :return: The time the OCSP response was produced, in Swedish time.
+    :rtype: str
+    :raises AssertionError: If the response does not verify.
+    :raises ValueError: If ``BANK_ID_ROOT_CERT`` is not given.
+
+    """
+    if cache is None:
+        cache = default_cache
+
+    if not isinstance(bank_id_response, dict):
+        raise TypeError("Response not a dictionary")
+
+    if "completionData" not in bank_id_response:
+        raise AttributeError("Completion data missing in dictionary")
+
+    if BANK_ID_ROOT_CERT is None:
+        raise ValueError("BANK_ID_ROOT_CERT, the BankID root certificate in PEM, is required")
+
+    cdc = CompletionDataContainer(bank_id_response["completionData"])
+    container = cdc.signature_container
+    xml = container.xml
+
+    # 1. The digests of the signed data and the key info, given in SignedInfo.
+    signed_info_start, signed_info_stop = container.signed_info_span
+    digests = _DIGEST_VALUE.findall(xml, signed_info_start, signed_info_stop)
+    if len(digests) < 2:
+        raise AssertionError("Signature has no digests of the signed data and key info")
+    if hashlib.sha256(container.bid_signed_data_bytes).digest() != base64.b64decode(digests[0]):
+        raise AssertionError("Signed Data hash does not match!")
+    if hashlib.sha256(container.key_info_bytes).digest() != base64.b64decode(digests[1]):
+        raise AssertionError("Key Info hash does not match!")
+
+    # 2. The signature of SignedInfo by the user's certificate, loaded from its DER.
+    key_info_start, key_info_stop = container.key_info_span
+    certificates = [base64.b64decode(c) for c in _X509_CERTIFICATE.findall(xml, key_info_start, key_info_stop)]
+    if not certificates:
+        raise AssertionError("Signature has no certificates")
+    user_certificate = x509.load_der_x509_certificate(certificates[0])
+
+    method = _SIGNATURE_METHOD.search(xml, signed_info_start, signed_info_stop)
+    signature_value = _SIGNATURE_VALUE.search(xml, signed_info_stop)
+    if method is None or signature_value is None:
+        raise AssertionError("The BankID signature is not valid!")
+    signature = base64.b64decode(signature_value.group(1))
+    if method.group(1) == b"ecdsa":
+        # XML signatures hold the ECDSA signature as the concatenated integers r and s.
+        half = len(signature) // 2
+        signature = encode_dss_signature(int.from_bytes(signature[:half], "big"), int.from_bytes(signature[half:], "big"))
+    try:
+        hash_algorithm = getattr(hashes, method.group(2).decode().upper())()
+        _verify(user_certificate.public_key(), signature, container.signed_info_bytes.tobytes(), hash_algorithm)
+    except (AttributeError, InvalidSignature, UnsupportedAlgorithm):
+        raise AssertionError("The BankID signature is not valid!")
+
+    # 3. The OCSP response, its signature and its nonce, the SHA-1 digest of the signature.
+    try:
+        ocsp_response = ocsp.load_der_ocsp_response(base64.b64decode(cdc.ocsp_response))
+    except (ValueError, binascii.Error):
+        raise AssertionError("OCSP response could not be parsed")
+    if ocsp_response.response_status != ocsp.OCSPResponseStatus.SUCCESSFUL:
+        raise AssertionError("OCSP response status was not successful")
+    if not ocsp_response.certificates or ocsp_response.signature_hash_algorithm is None:
+        raise AssertionError("The OCSP signature is not valid!")
+
+    ocsp_certificate = ocsp_response.certificates[0]
+    tbs_response_data = ocsp_response.tbs_response_bytes
+    try:
+        _verify(
+            ocsp_certificate.public_key(),
+            ocsp_response.signature,
+            tbs_response_data,
+            ocsp_response.signature_hash_algorithm,
+        )
+    except (InvalidSignature, UnsupportedAlgorithm):
+        raise AssertionError("The OCSP signature is not valid!")
+
+    nonce_computed = hashlib.sha1(bank_id_response["completionData"]["signature"].encode("utf-8")).digest()
+    if not _nonce(tbs_response_data).startswith(nonce_computed):
+        raise AssertionError("Computed nonce not matching the OCSP nonce")
+
+    if hasattr(ocsp_response, "produced_at_utc"):
+        produced_at = ocsp_response.produced_at_utc
+    else:
+        produced_at = ocsp_response.produced_at.replace(tzinfo=datetime.timezone.utc)
+
+    # 4. The certificate chains, relying on the BankID root certificate as the trusted one.
+    root_pem = BANK_ID_ROOT_CERT.encode()
+    root = _cached_certificate(cache, root_pem, pem=True)
+    intermediates = tuple(_cached_certificate(cache, data) for data in certificates[1:])
+    chain_key: Tuple[Any, ...] = ("cryptography.issuers", ensure_certificates_still_valid, fingerprint(root_pem))
+    chain_key += tuple(fingerprint(data) for data in certificates[1:])
+    expires = None
+    if ensure_certificates_still_valid:
+        expires = lambda issuers: min((_not_after(c).timestamp() for c, _ in issuers.values()), default=0.0)  # noqa: E731
+    issuers = cache.get(chain_key, lambda: _issuers(root, intermediates, ensure_certificates_still_valid), expires)
+
+    if not _issued_by(user_certificate, issuers, ensure_certificates_still_valid):
+        raise AssertionError("BankID user certificate chain could not be verified.")
+
+    def verify_ocsp_certificate() -> bool:
+        if not _issued_by(ocsp_certificate, issuers, ensure_certificates_still_valid):
+            raise AssertionError("OCSP certificate chain could not be verified.")
+        return True
+
+    cache.get(
+        ("cryptography.verified", ocsp_certificate.fingerprint(hashes.SHA256())) + chain_key,
+        verify_ocsp_certificate,
+        (lambda _: _not_after(ocsp_certificate).timestamp()) if ensure_certificates_still_valid else None,
+    )
+
+    return produced_at.astimezone(_STOCKHOLM).strftime("%Y-%m-%d %H:%M:%S")
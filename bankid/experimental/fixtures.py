@@ -0,0 +1,278 @@
+"""Synthetic BankID completion data for tests and benchmarks of the signature verification.
+
+The signatures and OCSP responses are made by a throwaway CA chain laid out as the BankID one,
+root -> BankID CA -> bank CA -> user and OCSP responder certificates, and pass
+:py:func:`bankid.experimental.verify.verify_bankid_response` with the root of that chain::
+
+    fixtures = SignatureFixtures()
+    response = fixtures.collect_response(user_visible_data="Sign the agreement")
+    verify_bankid_response(response, BANK_ID_ROOT_CERT=fixtures.root_cert_pem)
+
+Requires the ``cryptography`` and ``asn1crypto`` packages.
+
+"""
+
+import base64
+import datetime
+import hashlib
+import uuid
+from typing import Any, Dict, List, Tuple, Union
+
+from asn1crypto import core, ocsp
+from asn1crypto import x509 as asn1_x509
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from cryptography.x509.oid import ExtendedKeyUsageOID, NameOID
+
+_SIGNATURE_TEMPLATE = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="no"?>'
+    '<Signature xmlns="http://www.w3.org/2000/09/xmldsig#">'
+    "{signed_info}<SignatureValue>{signature_value}</SignatureValue>{key_info}<Object>{signed_data}</Object></Signature>"
+)
+_SIGNED_INFO_TEMPLATE = (
+    '<SignedInfo xmlns="http://www.w3.org/2000/09/xmldsig#">'
+    '<CanonicalizationMethod Algorithm="http://www.w3.org/2006/12/xml-c14n11"></CanonicalizationMethod>'
+    '<SignatureMethod Algorithm="http://www.w3.org/2001/04/xmldsig-more#rsa-sha256"></SignatureMethod>'
+    '<Reference Type="http://www.bankid.com/signature/v1.0.0/types" URI="#bidSignedData">'
+    '<Transforms><Transform Algorithm="http://www.w3.org/2006/12/xml-c14n11"></Transform></Transforms>'
+    '<DigestMethod Algorithm="http://www.w3.org/2001/04/xmlenc#sha256"></DigestMethod>'
+    "<DigestValue>{signed_data_digest}</DigestValue></Reference>"
+    '<Reference URI="#bidKeyInfo">'
+    '<Transforms><Transform Algorithm="http://www.w3.org/2006/12/xml-c14n11"></Transform></Transforms>'
+    '<DigestMethod Algorithm="http://www.w3.org/2001/04/xmlenc#sha256"></DigestMethod>'
+    "<DigestValue>{key_info_digest}</DigestValue></Reference></SignedInfo>"
+)
+_SIGNED_DATA_TEMPLATE = (
+    '<bankIdSignedData xmlns="http://www.bankid.com/signature/v1.0.0/types" Id="bidSignedData">'
+    '<usrVisibleData charset="UTF-8" visible="wysiwys">{visible}</usrVisibleData>'
+    "<usrNonVisibleData>{non_visible}</usrNonVisibleData>"
+    "<srvInfo><name>{name}</name><nonce>{nonce}</nonce><displayName>{display_name}</displayName></srvInfo>"
+    "<clientInfo><funcId>Signing</funcId><version>{version}</version><env><ai><type>{device_type}</type>"
+    "<deviceInfo>{device_info}</deviceInfo><uhi>{uhi}</uhi><fsib>0</fsib><utb>cs1</utb><requirement>"
+    "<condition><type>AllowFingerprint</type><value>yes</value></condition></requirement>"
+    "<uauth>pw</uauth></ai></env></clientInfo></bankIdSignedData>"
+)
+
+# The OCSP nonce extension as BankID encodes it: critical, with the SHA-1 digest directly in extnValue.
+_NONCE_EXTENSION_PREFIX = bytes.fromhex("3024" "06092b0601050507300102" "0101ff" "0414")
+
+
+def _b64(data: Union[bytes, str]) -> str:
+    return base64.b64encode(data.encode("utf-8") if isinstance(data, str) else data).decode("ascii")
+
+
+def _name(common_name: str) -> x509.Name:
+    return x509.Name(
+        [
+            x509.NameAttribute(NameOID.COUNTRY_NAME, "SE"),
+            x509.NameAttribute(NameOID.ORGANIZATION_NAME, "Testbank A AB (publ)"),
+            x509.NameAttribute(NameOID.COMMON_NAME, common_name),
+        ]
+    )
+
+
+class SignatureFixtures:
+    """A CA chain issuing the certificates of signed, OCSP checked BankID completion data.
+
+    Creating the keys takes some time, so one instance should make all fixtures of a test run.
+
+    :param key_size: Size in bits of the RSA keys.
+    :type key_size: int
+    :param validity: Validity period of the certificates, starting a day ago.
+    :type validity: datetime.timedelta
+
+    """
+
+    def __init__(self, key_size: int = 2048, validity: datetime.timedelta = datetime.timedelta(days=365)):
+        self.key_size = key_size
+        self._not_before = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=1)
+        self._not_after = self._not_before + validity
+        self.root_key, self.root_cert = self._issue("Test BankID Root CA v1 Test", ca=True)
+        self.bankid_ca_key, self.bankid_ca_cert = self._issue(
+            "Test BankID Customer CA v1 Test", ca=True, issuer=(self.root_key, self.root_cert)
+        )
+        self.bank_ca_key, self.bank_ca_cert = self._issue(
+            "Testbank A Customer CA1 v1 for BankID Test", ca=True, issuer=(self.bankid_ca_key, self.bankid_ca_cert)
+        )
+        self.ocsp_key, self.ocsp_cert = self._issue(
+            "Testbank A OCSP Responder for BankID Test", issuer=(self.bank_ca_key, self.bank_ca_cert), ocsp_signing=True
+        )
+        self._user_certs: Dict[str, Tuple[rsa.RSAPrivateKey, x509.Certificate]] = {}
+
+    @property
+    def root_cert_pem(self) -> str:
+        """The root certificate in PEM, as the ``BANK_ID_ROOT_CERT`` to verify with."""
+        return self.root_cert.public_bytes(serialization.Encoding.PEM).decode("ascii")
+
+    def _issue(
+        self,
+        common_name: str,
+        ca: bool = False,
+        issuer: Union[Tuple[rsa.RSAPrivateKey, x509.Certificate], None] = None,
+        ocsp_signing: bool = False,
+    ) -> Tuple[rsa.RSAPrivateKey, x509.Certificate]:
+        key = rsa.generate_private_key(public_exponent=65537, key_size=self.key_size)
+        subject = _name(common_name)
+        issuer_key, issuer_name = (key, subject) if issuer is None else (issuer[0], issuer[1].subject)
+        builder = (
+            x509.CertificateBuilder()
+            .subject_name(subject)
+            .issuer_name(issuer_name)
+            .public_key(key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(self._not_before)
+            .not_valid_after(self._not_after)
+            .add_extension(x509.BasicConstraints(ca=ca, path_length=None), critical=True)
+            .add_extension(
+                x509.KeyUsage(
+                    digital_signature=not ca,
+                    content_commitment=not ca and not ocsp_signing,
+                    key_encipherment=False,
+                    data_encipherment=False,
+                    key_agreement=False,
+                    key_cert_sign=ca,
+                    crl_sign=ca,
+                    encipher_only=False,
+                    decipher_only=False,
+                ),
+                critical=True,
+            )
+        )
+        if ocsp_signing:
+            builder = builder.add_extension(x509.ExtendedKeyUsage([ExtendedKeyUsageOID.OCSP_SIGNING]), critical=False)
+        return key, builder.sign(issuer_key, hashes.SHA256())
+
+    def user_certificate(self, personal_number: str) -> Tuple[rsa.RSAPrivateKey, x509.Certificate]:
+        """The key and certificate of a user, issued on first use."""
+        if personal_number not in self._user_certs:
+            self._user_certs[personal_number] = self._issue(
+                "Karl Karlsson {0}".format(personal_number), issuer=(self.bank_ca_key, self.bank_ca_cert)
+            )
+        return self._user_certs[personal_number]
+
+    def signature(
+        self,
+        personal_number: str = "190000000000",
+        user_visible_data: str = "Sign the agreement",
+        user_non_visible_data: str = "",
+        device_type: str = "IOS",
+    ) -> str:
+        """The base64 encoded signature XML of an order signed by ``personal_number``."""
+        user_key, user_cert = self.user_certificate(personal_number)
+        certificates = [user_cert, self.bank_ca_cert, self.bankid_ca_cert]
+        key_info = (
+            '<KeyInfo xmlns="http://www.w3.org/2000/09/xmldsig#" Id="bidKeyInfo"><X509Data>{0}</X509Data></KeyInfo>'.format(
+                "".join(
+                    "<X509Certificate>{0}</X509Certificate>".format(_b64(c.public_bytes(serialization.Encoding.DER)))
+                    for c in certificates
+                )
+            )
+        )
+        signed_data = _SIGNED_DATA_TEMPLATE.format(
+            visible=_b64(user_visible_data),
+            non_visible=_b64(user_non_visible_data),
+            name=_b64("Name=Test RP,OU=0000000000,O=Test RP AB,C=SE"),
+            nonce=_b64(uuid.uuid4().bytes),
+            display_name=_b64("Test RP"),
+            version=_b64("Personal=8.0.0&OS=iOS 17&Device=iPhone"),
+            device_type=device_type,
+            device_info=_b64("iOS 17"),
+            uhi=_b64(hashlib.sha1(personal_number.encode()).digest()),
+        )
+        signed_info = _SIGNED_INFO_TEMPLATE.format(
+            signed_data_digest=_b64(hashlib.sha256(signed_data.encode("utf-8")).digest()),
+            key_info_digest=_b64(hashlib.sha256(key_info.encode("utf-8")).digest()),
+        )
+        signature_value = user_key.sign(signed_info.encode("utf-8"), padding.PKCS1v15(), hashes.SHA256())
+        return _b64(
+            _SIGNATURE_TEMPLATE.format(
+                signed_info=signed_info, signature_value=_b64(signature_value), key_info=key_info, signed_data=signed_data
+            )
+        )
+
+    def ocsp_response(
+        self,
+        signature: str,
+        personal_number: str = "190000000000",
+        produced_at: Union[datetime.datetime, None] = None,
+    ) -> str:
+        """The base64 encoded OCSP response for the user certificate, with the nonce of ``signature``."""
+        _, user_cert = self.user_certificate(personal_number)
+        now = produced_at or datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+        issuer = asn1_x509.Certificate.load(self.bank_ca_cert.public_bytes(serialization.Encoding.DER))
+        cert_id = ocsp.CertId(
+            {
+                "hash_algorithm": {"algorithm": "sha1"},
+                "issuer_name_hash": issuer.subject.sha1,
+                "issuer_key_hash": issuer.public_key.sha1,
+                "serial_number": user_cert.serial_number,
+            }
+        )
+        responder = asn1_x509.Certificate.load(self.ocsp_cert.public_bytes(serialization.Encoding.DER))
+        nonce = hashlib.sha1(signature.encode("utf-8")).digest()
+        tbs = ocsp.ResponseData(
+            {
+                "responder_id": ocsp.ResponderId(name="by_key", value=responder.public_key.sha1),
+                "produced_at": now,
+                "responses": [
+                    {
+                        "cert_id": cert_id,
+                        "cert_status": ocsp.CertStatus(name="good", value=core.Null()),
+                        "this_update": now,
+                    }
+                ],
+                "response_extensions": [ocsp.ResponseDataExtension.load(_NONCE_EXTENSION_PREFIX + nonce)],
+            }
+        )
+        basic = ocsp.BasicOCSPResponse(
+            {
+                "tbs_response_data": tbs,
+                "signature_algorithm": {"algorithm": "sha256_rsa"},
+                "signature": self.ocsp_key.sign(tbs.dump(), padding.PKCS1v15(), hashes.SHA256()),
+                "certs": [responder],
+            }
+        )
+        response = ocsp.OCSPResponse(
+            {
+                "response_status": "successful",
+                "response_bytes": {"response_type": "basic_ocsp_response", "response": basic},
+            }
+        )
+        return _b64(response.dump())
+
+    def completion_data(
+        self,
+        personal_number: str = "190000000000",
+        user_visible_data: str = "Sign the agreement",
+        user_non_visible_data: str = "",
+        end_user_ip: str = "192.168.0.1",
+    ) -> Dict[str, Any]:
+        """The ``completionData`` of a completed sign order."""
+        signature = self.signature(personal_number, user_visible_data, user_non_visible_data)
+        return {
+            "user": {
+                "personalNumber": personal_number,
+                "name": "Karl Karlsson",
+                "givenName": "Karl",
+                "surname": "Karlsson",
+            },
+            "device": {"ipAddress": end_user_ip, "uhi": "OZvYM9VvyiAmG7NA5jU5zqGcVpo="},
+            "stepUp": {"mrtd": False},
+            "bankIdIssueDate": self._not_before.strftime("%Y-%m-%d"),
+            "signature": signature,
+            "ocspResponse": self.ocsp_response(signature, personal_number),
+        }
+
+    def collect_response(self, order_ref: Union[str, None] = None, **kwargs: Any) -> Dict[str, Any]:
+        """A complete collect response, with :py:meth:`completion_data` made with ``kwargs``."""
+        return {
+            "orderRef": order_ref or str(uuid.uuid4()),
+            "status": "complete",
+            "completionData": self.completion_data(**kwargs),
+        }
+
+    def collect_responses(self, n: int, personal_numbers: Union[List[str], None] = None) -> List[Dict[str, Any]]:
+        """``n`` complete collect responses, by users taking turns from ``personal_numbers``."""
+        personal_numbers = personal_numbers or ["190000000000"]
+        return [self.collect_response(personal_number=personal_numbers[i % len(personal_numbers)]) for i in range(n)]
@@ -1,124 +1,256 @@
 import base64
 import xml.etree.ElementTree as ET
 from textwrap import wrap
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Tuple, Union
+from xml.sax.saxutils import unescape
 
-make_cert = lambda e: "-----BEGIN CERTIFICATE-----\n" + "\n".join(wrap(e, 54)) + "\n-----END CERTIFICATE-----"
+if TYPE_CHECKING:
+    from bankid.archive import ArchiveReader
+
+
+def make_cert(e: str) -> str:
+    return "-----BEGIN CERTIFICATE-----\n" + "\n".join(wrap(e, 54)) + "\n-----END CERTIFICATE-----"
 
 
 class B64Value:
-    def __init__(self, value):
+    __slots__ = ("value", "_decoded")
+
+    def __init__(self, value: str):
         self.value = value
+        self._decoded: Union[bytes, None] = None
 
     @property
-    def decode(self):
-        return base64.b64decode(self.value)
+    def decode(self) -> bytes:
+        # Decoded on first access only; signatures are tens of kilobytes.
+        if self._decoded is None:
+            self._decoded = base64.b64decode(self.value)
+        return self._decoded
 
-    def raw(self):
+    def raw(self) -> str:
         return self.value
 
-    def __str__(self):
+    def __str__(self) -> str:
         return self.raw()
 
 
+def _element_span(xml: bytes, tag: bytes) -> Tuple[int, int]:
+    """The byte offsets of the first ``tag`` element in ``xml``, from its start tag to the end of its end tag."""
+    start = xml.find(b"<" + tag)
+    stop = xml.find(b"</" + tag + b">", start)
+    if start < 0 or stop < 0:
+        raise ValueError("Signature has no {0} element".format(tag.decode()))
+    return start, stop + len(tag) + 3
+
+
+# The bytes that can follow the name in a start tag.
+_AFTER_TAG_NAME = (b">", b"/", b" ", b"\t", b"\n", b"\r")
+
+
+def _element_text(xml: bytes, tag: bytes, start: int, stop: int) -> Tuple[Union[str, None], int]:
+    """The text of the first ``tag`` element between the ``start`` and ``stop`` offsets of ``xml`` and the offset
+    after its end tag, or ``None`` and ``start`` if there is none, found without parsing the XML.
+
+    Like the ``text`` of an element tree, the text of an empty element is ``None``.
+
+    """
+    open_tag = b"<" + tag
+    position = xml.find(open_tag, start, stop)
+    while position >= 0 and xml[position + len(open_tag) : position + len(open_tag) + 1] not in _AFTER_TAG_NAME:
+        position = xml.find(open_tag, position + len(open_tag), stop)
+    if position < 0:
+        return None, start
+    content_start = xml.find(b">", position, stop) + 1
+    if content_start <= 0:
+        return None, start
+    if xml[content_start - 2 : content_start] == b"/>":
+        return None, content_start
+    content_stop = xml.find(b"</" + tag + b">", content_start, stop)
+    if content_stop < 0:
+        return None, start
+    text = str(xml[content_start:content_stop], "utf-8")
+    return unescape(text) if "&" in text else text or None, content_stop + len(tag) + 3
+
+
 class BankIdSignatureContainer:
-    def __init__(self, signature):
-        self.root = ET.fromstring(signature.decode)
+    """The signature XML of a completed order, decoded and split up once.
+
+    The byte offsets of ``SignedInfo``, ``KeyInfo`` and the contents of ``Object`` are found
+    when the container is created and the parts are available as memoryview slices of the
+    decoded XML, which is only parsed to an element tree if an element is asked for.
+
+    """
+
+    __slots__ = (
+        "raw",
+        "xml",
+        "signed_info_span",
+        "key_info_span",
+        "signed_data_span",
+        "_view",
+        "_root",
+        "_certificates",
+    )
+
+    def __init__(self, signature: B64Value):
         self.raw = signature
+        self.xml = xml = signature.decode
+        self._view = memoryview(xml)
+        self.signed_info_span = _element_span(xml, b"SignedInfo")
+        self.key_info_span = _element_span(xml, b"KeyInfo")
+        start, stop = _element_span(xml, b"Object")
+        # Only the contents of the Object element are signed.
+        self.signed_data_span = (xml.index(b">", start) + 1, stop - len(b"</Object>"))
+        self._root: Union[ET.Element, None] = None
+        self._certificates: Union[List[ET.Element], None] = None
 
     @property
-    def signed_data_digest(self):
+    def root(self) -> ET.Element:
+        if self._root is None:
+            self._root = ET.fromstring(self.xml)
+        return self._root
+
+    @property
+    def signed_info_bytes(self) -> memoryview:
+        return self._view[slice(*self.signed_info_span)]
+
+    @property
+    def key_info_bytes(self) -> memoryview:
+        return self._view[slice(*self.key_info_span)]
+
+    @property
+    def bid_signed_data_bytes(self) -> memoryview:
+        return self._view[slice(*self.signed_data_span)]
+
+    @property
+    def signed_data_digest(self) -> ET.Element:
         return self.root[0][2][2]
 
     @property
-    def key_data_digest(self):
+    def key_data_digest(self) -> ET.Element:
         return self.root[0][3][2]
 
     @property
-    def signature_value(self):
+    def signature_value(self) -> ET.Element:
         return self.root[1]
 
     @property
-    def signed_data_raw(self):
+    def signed_data_raw(self) -> ET.Element:
         return self.root[3][0]
 
     @property
-    def certificates(self):
-        return [e for e in self.root[2][0]]
+    def certificates(self) -> List[ET.Element]:
+        if self._certificates is None:
+            self._certificates = [e for e in self.root[2][0]]
+        return self._certificates
 
     @property
-    def bid_signed_data_raw(self):
-        raw_xml_string = self.raw.decode.decode()
-        start = raw_xml_string.find("<Object>") + len("<Object>")
-        stop = raw_xml_string.find("</Object>")
-        return raw_xml_string[start:stop]
+    def bid_signed_data_raw(self) -> str:
+        return str(self.bid_signed_data_bytes, "utf-8")
+
+    def _signed_data_text(self, tag: bytes, start: Union[int, None] = None) -> Tuple[Union[str, None], int]:
+        start = self.signed_data_span[0] if start is None else start
+        return _element_text(self.xml, tag, start, self.signed_data_span[1])
+
+    @property
+    def user_visible_data(self) -> Union[str, None]:
+        return self._signed_data_text(b"usrVisibleData")[0]
 
     @property
-    def user_non_visible_data(self):
-        return self.root[3][0][1].text
+    def user_non_visible_data(self) -> Union[str, None]:
+        return self._signed_data_text(b"usrNonVisibleData")[0]
 
     @property
-    def signed_info(self):
-        raw_xml_string = self.raw.decode.decode()
-        start = raw_xml_string.find("<SignedInfo")
-        stop = raw_xml_string.find("</SignedInfo>")
-        return raw_xml_string[start:stop] + "</SignedInfo>"
+    def signed_info(self) -> str:
+        return str(self.signed_info_bytes, "utf-8")
 
     @property
-    def key_info_raw(self):
-        raw_xml_string = self.raw.decode.decode()
-        start = raw_xml_string.find("<KeyInfo")
-        stop = raw_xml_string.find("</KeyInfo>")
-        return raw_xml_string[start:stop] + "</KeyInfo>"
+    def key_info_raw(self) -> str:
+        return str(self.key_info_bytes, "utf-8")
 
     @property
-    def server_info(self):
+    def server_info(self) -> Dict[str, bytes]:
+        start, stop = self.signed_data_span
+        start = self.xml.find(b"<srvInfo>", start, stop)
+        stop = self.xml.find(b"</srvInfo>", start, stop)
+        if start < 0 or stop < 0:
+            raise ValueError("Signature has no srvInfo element")
+        # The fields are read in one pass over the srvInfo element.
+        name, position = _element_text(self.xml, b"name", start, stop)
+        display_name, _ = _element_text(self.xml, b"displayName", position, stop)
+        if name is None or display_name is None:
+            raise ValueError("Signature has no srvInfo name and displayName")
         return {
-            "name": B64Value(self.root[3][0][2][0].text).decode,
-            "displayName": B64Value(self.root[3][0][2][2].text).decode,
+            "name": B64Value(name).decode,
+            "displayName": B64Value(display_name).decode,
         }
 
 
 class CompletionDataContainer:
-    def __init__(self, completion_data):
-        self.completion_data = completion_data
+    __slots__ = ("_completion_data", "_load", "_signature", "_signature_container")
+
+    def __init__(self, completion_data: Union[Dict[str, Any], None]):
+        self._completion_data = completion_data
+        self._load: Union[Callable[[], Dict[str, Any]], None] = None
+        self._signature: Union[B64Value, None] = None
+        self._signature_container: Union[BankIdSignatureContainer, None] = None
+
+    @classmethod
+    def from_archive(cls, archive: "ArchiveReader", order_ref: str) -> "CompletionDataContainer":
+        """The completion data of ``order_ref`` in a :py:class:`bankid.archive.ArchiveReader`, read on first access."""
+        container = cls(None)
+        container._load = lambda: archive.get(order_ref)["completionData"]
+        return container
+
+    @property
+    def completion_data(self) -> Dict[str, Any]:
+        if self._completion_data is None and self._load is not None:
+            self._completion_data = self._load()
+            self._load = None
+        if self._completion_data is None:
+            raise ValueError("No completion data")
+        return self._completion_data
 
     @property
-    def order_ref(self):
-        return self.completion_data["orderRef"]
+    def order_ref(self) -> str:
+        return self.completion_data["orderRef"]  # type: ignore[no-any-return]
 
     @property
-    def ocsp_response(self):
-        return self.completion_data["ocspResponse"]
+    def ocsp_response(self) -> str:
+        return self.completion_data["ocspResponse"]  # type: ignore[no-any-return]
 
     @property
-    def device(self):
-        return self.completion_data["device"]
+    def device(self) -> Dict[str, Any]:
+        return self.completion_data["device"]  # type: ignore[no-any-return]
 
     @property
-    def user(self):
-        return self.completion_data["user"]
+    def user(self) -> Dict[str, Any]:
+        return self.completion_data["user"]  # type: ignore[no-any-return]
 
     @property
-    def signature(self):
-        return B64Value(self.completion_data["signature"])
+    def signature(self) -> B64Value:
+        if self._signature is None:
+            self._signature = B64Value(self.completion_data["signature"])
+        return self._signature
 
     @property
-    def signature_container(self):
-        return BankIdSignatureContainer(self.signature)
+    def signature_container(self) -> BankIdSignatureContainer:
+        if self._signature_container is None:
+            self._signature_container = BankIdSignatureContainer(self.signature)
+        return self._signature_container
 
 
 class NonceParse:
-    def __init__(self, bytes):
+    def __init__(self, bytes: Any):
         self.bytes = bytes
 
     @property
-    def type(self):
+    def type(self) -> str:
         return ".".join(str(e) for e in list(self.bytes.contents[2:11]))
 
     @property
-    def critical(self):
-        return self.bytes.contents[13] == 255
+    def critical(self) -> bool:
+        return bool(self.bytes.contents[13] == 255)
 
     @property
-    def value(self):
+    def value(self) -> Any:
         return self.bytes[16:]
@@ -1,218 +1,660 @@
+import argparse
+import asyncio
 import base64
+import calendar
+import collections
 import datetime
+import functools
 import hashlib
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
 from io import BytesIO
 from logging import getLogger
+from typing import TYPE_CHECKING, Any, Callable, Deque, Dict, Iterable, Iterator, List, NamedTuple, Tuple, Type, Union
 
-import OpenSSL.crypto
-import asn1crypto.ocsp
-import pytz
-from OpenSSL import crypto
-from OpenSSL.crypto import X509StoreContextError
-from asn1crypto import pem
-
+from bankid.experimental.cache import VerificationCache, default_cache, fingerprint
 from bankid.experimental.helper import CompletionDataContainer, make_cert, NonceParse
 
+if TYPE_CHECKING:
+    from OpenSSL import crypto
+
 _LOG = getLogger(__name__)
 
+# The store of the CA certificates and the root, its cache key and the certificates in it.
+_ChainStore = Tuple["crypto.X509Store", Tuple[Any, ...], List["crypto.X509"]]
+
+
+def _not_after(certificate: "crypto.X509") -> int:
+    return calendar.timegm(time.strptime((certificate.get_notAfter() or b"").decode("ascii"), "%Y%m%d%H%M%SZ"))
+
+
+def _tomorrow() -> bytes:
+    return (datetime.datetime.now() + datetime.timedelta(days=1)).strftime("%Y%m%d%H%M%SZ").encode()
+
+
+def _cached_certificate(
+    cache: VerificationCache, data: bytes, ensure_certificates_still_valid: bool, filetype: str = "ASN1"
+) -> "crypto.X509":
+    """The parsed certificate of the DER or PEM ``data``, shared by all responses with the same certificate."""
+    from OpenSSL import crypto
+
+    def load() -> crypto.X509:
+        certificate = crypto.load_certificate(getattr(crypto, "FILETYPE_" + filetype), data)
+        if not ensure_certificates_still_valid:
+            certificate.set_notAfter(_tomorrow())
+        return certificate
+
+    certificate: crypto.X509 = cache.get(
+        ("certificate", fingerprint(data), ensure_certificates_still_valid), load, _not_after
+    )
+    return certificate
+
+
+def data_errors() -> Tuple[Type[BaseException], ...]:
+    """The exceptions verification raises for a response whose content is malformed or does not verify.
+
+    Besides the :py:exc:`AssertionError` of a failed check, malformed base64, XML, certificates
+    or OCSP responses raise errors of the parsers, e.g. :py:exc:`ValueError`,
+    :py:exc:`binascii.Error`, :py:exc:`xml.etree.ElementTree.ParseError` or
+    :py:exc:`OpenSSL.crypto.Error`. Other errors, e.g. of an executor, are not about the response.
+
+    """
+    from OpenSSL import crypto
+
+    return (AssertionError, ValueError, TypeError, KeyError, IndexError, AttributeError, SyntaxError, crypto.Error)
+
+
+def _root_cert(BANK_ID_ROOT_CERT: Union[str, None]) -> str:
+    if BANK_ID_ROOT_CERT is None:
+        raise ValueError("BANK_ID_ROOT_CERT, the BankID root certificate in PEM, is required")
+    return BANK_ID_ROOT_CERT
 
-def verify_bankid_response(bank_id_response, ensure_certificates_still_valid=True, BANK_ID_ROOT_CERT=None):
 
+def _completion_data_container(bank_id_response: Dict[str, Any]) -> CompletionDataContainer:
     if not isinstance(bank_id_response, dict):
         raise TypeError("Response not a dictionary")
 
     if "completionData" not in bank_id_response:
         raise AttributeError("Completion data missing in dictionary")
 
-    try:
-        cdc = CompletionDataContainer(bank_id_response["completionData"])
+    return CompletionDataContainer(bank_id_response["completionData"])
 
-        # First step is to hash the data and verify the digest matches
 
-        _LOG.info("1. Message Digest Verification\n")
-        bid_signed_data_raw_bytes = cdc.signature_container.bid_signed_data_raw.encode()
+def _chain_store(
+    cache: VerificationCache, container: Any, root_pem: bytes, ensure_certificates_still_valid: bool
+) -> _ChainStore:
+    """The store of the CA certificates and the root, shared by all responses with the same chain, and its cache key."""
+    from OpenSSL import crypto
 
-        # TODO - Parse out of the XML which hashing algorithm should be sued
+    # The CA certificates repeat across responses, so they are parsed and put in a store once.
+    chain_data = [base64.b64decode(element.text) for element in container.certificates[1:3]]
+    chain = [_cached_certificate(cache, data, ensure_certificates_still_valid) for data in chain_data]
+    chain.append(_cached_certificate(cache, root_pem, ensure_certificates_still_valid, "PEM"))
+    store_key: Tuple[Any, ...] = ("store", ensure_certificates_still_valid, fingerprint(root_pem))
+    store_key += tuple(fingerprint(data) for data in chain_data)
 
-        bid_signed_data_hash = hashlib.sha256(bid_signed_data_raw_bytes).digest().hex()
-        key_info_hash = hashlib.sha256(cdc.signature_container.key_info_raw.encode()).digest().hex()
+    def build_store() -> crypto.X509Store:
+        store = crypto.X509Store()
+        for certificate in chain:
+            store.add_cert(certificate)
+        return store
 
-        signed_data_hash_from_signature = base64.b64decode(cdc.signature_container.signed_data_digest.text).hex()
-        key_info_hash_from_signature = base64.b64decode(cdc.signature_container.key_data_digest.text).hex()
+    return cache.get(store_key, build_store, lambda _: min(_not_after(c) for c in chain)), store_key, chain
 
-        if bid_signed_data_hash != signed_data_hash_from_signature:
-            raise AssertionError("Signed Data hash does not match!")
 
-        if key_info_hash != key_info_hash_from_signature:
-            raise AssertionError("Key Info hash does not match!")
+def _verify_signature(bank_id_response: Dict[str, Any], container: Any = None) -> None:
+    """Steps 1 and 2, the digests in ``SignedInfo`` and its signature by the user's certificate."""
+    from OpenSSL import crypto
 
-        _LOG.info("\n2. Signature verification\n")
+    if container is None:
+        container = _completion_data_container(bank_id_response).signature_container
 
-        # Helper function for the certificates
-        user_certificate_string = make_cert(cdc.signature_container.certificates[0].text)
+    # First step is to hash the data and verify the digest matches
 
-        # Making a certificate object out of it
-        user_certificate = crypto.load_certificate(
-            crypto.FILETYPE_PEM, BytesIO(user_certificate_string.encode()).read()
-        )
+    _LOG.info("1. Message Digest Verification\n")
+    # TODO - Parse out of the XML which hashing algorithm should be sued
 
-        signature_bytes = base64.b64decode(cdc.signature_container.signature_value.text)
-        signed_info = cdc.signature_container.signed_info.encode()
+    bid_signed_data_hash = hashlib.sha256(container.bid_signed_data_bytes).digest().hex()
+    key_info_hash = hashlib.sha256(container.key_info_bytes).digest().hex()
 
-        try:
-            _LOG.debug("Certificate:", user_certificate.get_subject())
-            _LOG.debug("Signature Bytes:", signature_bytes)
-            _LOG.debug("Signature Data Raw:", signed_info)
+    signed_data_hash_from_signature = base64.b64decode(container.signed_data_digest.text).hex()
+    key_info_hash_from_signature = base64.b64decode(container.key_data_digest.text).hex()
 
-            OpenSSL.crypto.verify(user_certificate, signature_bytes, signed_info, "sha256")
-        except OpenSSL.crypto.Error as e:
-            raise AssertionError("The BankID signature is not valid!")
+    if bid_signed_data_hash != signed_data_hash_from_signature:
+        raise AssertionError("Signed Data hash does not match!")
 
-        _LOG.info("\n3. OCSP Response Verification\n")
+    if key_info_hash != key_info_hash_from_signature:
+        raise AssertionError("Key Info hash does not match!")
 
-        ocsp = base64.b64decode(bank_id_response["completionData"]["ocspResponse"])
-        ocsp_response = asn1crypto.ocsp.OCSPResponse.load(ocsp)
+    _LOG.info("\n2. Signature verification\n")
 
-        basic_ocsp_response = ocsp_response["response_bytes"]["response"].parsed
+    # Helper function for the certificates
+    user_certificate_string = make_cert(container.certificates[0].text)
 
-        # Some help by listing all the different parts of the OCSP response
-        _LOG.debug("TBS Response Data", basic_ocsp_response["tbs_response_data"])
-        _LOG.debug("SignatureAlgorithm", basic_ocsp_response["signature_algorithm"].signature_algo)
-        _LOG.debug("SignatureAlgorithm Hash Function", basic_ocsp_response["signature_algorithm"].hash_algo)
-        _LOG.debug("Signature", basic_ocsp_response["signature"].__bytes__())
-        _LOG.debug("Cert", basic_ocsp_response["certs"])
+    # Making a certificate object out of it
+    user_certificate = crypto.load_certificate(crypto.FILETYPE_PEM, BytesIO(user_certificate_string.encode()).read())
 
-        # Response content
-        _LOG.debug("version", basic_ocsp_response["tbs_response_data"]["version"])
-        _LOG.debug("responderID", basic_ocsp_response["tbs_response_data"]["responder_id"])  # has native
-        _LOG.info("producedAt", basic_ocsp_response["tbs_response_data"]["produced_at"])
+    signature_bytes = base64.b64decode(container.signature_value.text)
+    signed_info = container.signed_info_bytes.tobytes()
 
-        cest = pytz.timezone("Europe/Stockholm")
-        ocsp_produced_at = basic_ocsp_response["tbs_response_data"]["produced_at"].native
+    try:
+        _LOG.debug("Certificate:", user_certificate.get_subject())
+        _LOG.debug("Signature Bytes:", signature_bytes)
+        _LOG.debug("Signature Data Raw:", signed_info)
 
-        if not isinstance(ocsp_produced_at, datetime.datetime):
-            raise AssertionError("OCSP produced at is not a datetime!")
+        crypto.verify(user_certificate, signature_bytes, signed_info, "sha256")
+    except crypto.Error as e:
+        raise AssertionError("The BankID signature is not valid!")
 
-        ocsp_produced_at = ocsp_produced_at.astimezone(cest).strftime("%Y-%m-%d %H:%M:%S")
 
-        _LOG.debug("responses", basic_ocsp_response["tbs_response_data"]["responses"])
-        _LOG.debug("response Extentions", basic_ocsp_response["tbs_response_data"]["response_extensions"])
+def _verify_ocsp_response(
+    bank_id_response: Dict[str, Any],
+    ensure_certificates_still_valid: bool,
+    cache: Union[VerificationCache, None] = None,
+) -> Tuple[str, bytes, "crypto.X509"]:
+    """Step 3, the OCSP response's status, signature and nonce.
 
-        _LOG.debug("Extentions")
-        extention = basic_ocsp_response["tbs_response_data"]["response_extensions"][0]
+    :return: The time the OCSP response was produced in Swedish time, and the DER and the
+        parsed certificate of the OCSP responder.
 
-        _LOG.debug("extn_id", extention["extn_id"])
-        _LOG.debug("critical", extention["critical"])
+    """
+    import asn1crypto.ocsp
+    import pytz
+    from OpenSSL import crypto
 
-        # Cannot _LOG.debug the value without an exception being raised - need to parse that ourself later
-        # print ('extn_value', extention['extn_value'])
+    if cache is None:
+        cache = default_cache
 
-        single_response = basic_ocsp_response["tbs_response_data"]["responses"][0]
+    _LOG.info("\n3. OCSP Response Verification\n")
 
-        _LOG.debug("CertID", single_response["cert_id"])
-        _LOG.debug("certStatus", single_response["cert_status"])
-        _LOG.debug("thisUpdate", single_response["this_update"])
-        _LOG.debug("nextUpdate", single_response["next_update"])
-        _LOG.debug("singleExtensions", single_response["single_extensions"])
+    ocsp = base64.b64decode(bank_id_response["completionData"]["ocspResponse"])
+    ocsp_response = asn1crypto.ocsp.OCSPResponse.load(ocsp)
 
-        _LOG.info("3.1. OCSP Response - Verify success ")
+    basic_ocsp_response = ocsp_response["response_bytes"]["response"].parsed
 
-        if ocsp_response["response_status"].native != "successful":
-            raise AssertionError("OCSP response status was not successful")
+    # Some help by listing all the different parts of the OCSP response
+    _LOG.debug("TBS Response Data", basic_ocsp_response["tbs_response_data"])
+    _LOG.debug("SignatureAlgorithm", basic_ocsp_response["signature_algorithm"].signature_algo)
+    _LOG.debug("SignatureAlgorithm Hash Function", basic_ocsp_response["signature_algorithm"].hash_algo)
+    _LOG.debug("Signature", basic_ocsp_response["signature"].__bytes__())
+    _LOG.debug("Cert", basic_ocsp_response["certs"])
 
-        _LOG.info("3.2. OCSP Response - Verify signature ")
+    # Response content
+    _LOG.debug("version", basic_ocsp_response["tbs_response_data"]["version"])
+    _LOG.debug("responderID", basic_ocsp_response["tbs_response_data"]["responder_id"])  # has native
+    _LOG.info("producedAt", basic_ocsp_response["tbs_response_data"]["produced_at"])
 
-        # Transform the asn1 certificate to an openssl certificate
-        der_bytes = basic_ocsp_response["certs"][0].dump()
-        pem_bytes = pem.armor("CERTIFICATE", der_bytes)
-        ocsp_certificate = crypto.load_certificate(crypto.FILETYPE_PEM, pem_bytes)
+    cest = pytz.timezone("Europe/Stockholm")
+    ocsp_produced_at = basic_ocsp_response["tbs_response_data"]["produced_at"].native
 
-        # Get the signature bytes
-        signature = basic_ocsp_response["signature"].__bytes__()
+    if not isinstance(ocsp_produced_at, datetime.datetime):
+        raise AssertionError("OCSP produced at is not a datetime!")
 
-        # Dump the TBS response data as DER bytes
-        signature_data = basic_ocsp_response["tbs_response_data"].dump()
+    ocsp_produced_at = ocsp_produced_at.astimezone(cest).strftime("%Y-%m-%d %H:%M:%S")
 
-        # Define the hashing algorithm to be used
-        digest_method = basic_ocsp_response["signature_algorithm"].hash_algo
+    _LOG.debug("responses", basic_ocsp_response["tbs_response_data"]["responses"])
+    _LOG.debug("response Extentions", basic_ocsp_response["tbs_response_data"]["response_extensions"])
 
-        _LOG.debug("Certificate", ocsp_certificate.get_subject())
-        _LOG.debug("Signature", signature)
-        _LOG.debug("Signature data", signature_data)
-        _LOG.debug("Digest Method", digest_method)
+    _LOG.debug("Extentions")
+    extention = basic_ocsp_response["tbs_response_data"]["response_extensions"][0]
 
-        try:
-            OpenSSL.crypto.verify(ocsp_certificate, signature, signature_data, digest_method)
-        except OpenSSL.crypto.Error as e:
-            raise AssertionError("The OCSP signature is not valid!")
+    _LOG.debug("extn_id", extention["extn_id"])
+    _LOG.debug("critical", extention["critical"])
 
-        _LOG.info("3.2. OCSP Response - Compare nonce")
+    # Cannot _LOG.debug the value without an exception being raised - need to parse that ourself later
+    # print ('extn_value', extention['extn_value'])
 
-        nonce_computed = hashlib.sha1(bank_id_response["completionData"]["signature"].encode("utf-8")).digest().hex()
+    single_response = basic_ocsp_response["tbs_response_data"]["responses"][0]
 
-        # A helper because the asn1 library seems to have a problem with the nonce parsing in some form or the other
-        nonce_parser = NonceParse(extention.contents)
+    _LOG.debug("CertID", single_response["cert_id"])
+    _LOG.debug("certStatus", single_response["cert_status"])
+    _LOG.debug("thisUpdate", single_response["this_update"])
+    _LOG.debug("nextUpdate", single_response["next_update"])
+    _LOG.debug("singleExtensions", single_response["single_extensions"])
 
-        # Verify that the computed nonce is part of the nonce value given in the oscp
-        # Note that it only partially matches as we use sha-1 to compute the hash
+    _LOG.info("3.1. OCSP Response - Verify success ")
 
-        _LOG.debug("Nonce value computed ", nonce_computed)
-        _LOG.debug("Nonce value presented", nonce_parser.value.hex())
+    if ocsp_response["response_status"].native != "successful":
+        raise AssertionError("OCSP response status was not successful")
 
-        if not nonce_parser.value.hex().startswith(nonce_computed):
-            raise AssertionError("Computed nonce not matching the OCSP nonce")
+    _LOG.info("3.2. OCSP Response - Verify signature ")
 
-        _LOG.info("\n4. Verify all the certificates by relying on the BankID root certificate as a trusted one \n")
+    # Transform the asn1 certificate to an openssl certificate
+    ocsp_certificate_der = basic_ocsp_response["certs"][0].dump()
+    ocsp_certificate = _cached_certificate(cache, ocsp_certificate_der, ensure_certificates_still_valid)
 
-        user_cert = crypto.load_certificate(
-            crypto.FILETYPE_PEM, make_cert(cdc.signature_container.certificates[0].text).encode()
-        )
+    # Get the signature bytes
+    signature = basic_ocsp_response["signature"].__bytes__()
 
-        bank_user_cert = crypto.load_certificate(
-            crypto.FILETYPE_PEM, make_cert(cdc.signature_container.certificates[1].text).encode()
-        )
+    # Dump the TBS response data as DER bytes
+    signature_data = basic_ocsp_response["tbs_response_data"].dump()
 
-        bank_bank_id_cert = crypto.load_certificate(
-            crypto.FILETYPE_PEM, make_cert(cdc.signature_container.certificates[2].text).encode()
-        )
+    # Define the hashing algorithm to be used
+    digest_method = basic_ocsp_response["signature_algorithm"].hash_algo
 
-        bank_id_root_cert = crypto.load_certificate(crypto.FILETYPE_PEM, BANK_ID_ROOT_CERT.encode())
+    _LOG.debug("Certificate", ocsp_certificate.get_subject())
+    _LOG.debug("Signature", signature)
+    _LOG.debug("Signature data", signature_data)
+    _LOG.debug("Digest Method", digest_method)
 
-        # 3. verify the certificate chain of the tbs certificate
+    try:
+        crypto.verify(ocsp_certificate, signature, signature_data, digest_method)
+    except crypto.Error as e:
+        raise AssertionError("The OCSP signature is not valid!")
 
-        # Make sure we respect or do not respect certificate expiration times
-        if not ensure_certificates_still_valid:
-            tomorrow = datetime.datetime.now() + datetime.timedelta(days=1)
+    _LOG.info("3.2. OCSP Response - Compare nonce")
 
-            bank_user_cert.set_notAfter(tomorrow.strftime("%Y%m%d%H%M%SZ").encode())
-            bank_bank_id_cert.set_notAfter(tomorrow.strftime("%Y%m%d%H%M%SZ").encode())
-            bank_id_root_cert.set_notAfter(tomorrow.strftime("%Y%m%d%H%M%SZ").encode())
+    nonce_computed = hashlib.sha1(bank_id_response["completionData"]["signature"].encode("utf-8")).digest().hex()
 
-            ocsp_certificate.set_notAfter(tomorrow.strftime("%Y%m%d%H%M%SZ").encode())
-            user_cert.set_notAfter(tomorrow.strftime("%Y%m%d%H%M%SZ").encode())
+    # A helper because the asn1 library seems to have a problem with the nonce parsing in some form or the other
+    nonce_parser = NonceParse(extention.contents)
 
-        store = crypto.X509Store()
-        store.add_cert(bank_user_cert)
-        store.add_cert(bank_bank_id_cert)
-        store.add_cert(bank_id_root_cert)
+    # Verify that the computed nonce is part of the nonce value given in the oscp
+    # Note that it only partially matches as we use sha-1 to compute the hash
 
-        try:
-            # Verify the user certificate up to the root certificate
-            store_ctx = crypto.X509StoreContext(store, user_cert)
-            store_ctx.verify_certificate()
-            _LOG.debug("User Certificate issued by the respective bank... OK")
-        except X509StoreContextError:
-            raise AssertionError("BankID user certificate chain could not be verified.")
+    _LOG.debug("Nonce value computed ", nonce_computed)
+    _LOG.debug("Nonce value presented", nonce_parser.value.hex())
+
+    if not nonce_parser.value.hex().startswith(nonce_computed):
+        raise AssertionError("Computed nonce not matching the OCSP nonce")
+
+    return ocsp_produced_at, ocsp_certificate_der, ocsp_certificate
 
+
+def _verify_ocsp_response_task(
+    bank_id_response: Dict[str, Any],
+    ensure_certificates_still_valid: bool,
+    cache: Union[VerificationCache, None] = None,
+) -> Tuple[str, bytes]:
+    # Parsed certificates cannot be sent back from a process executor.
+    return _verify_ocsp_response(bank_id_response, ensure_certificates_still_valid, cache)[:2]
+
+
+def _verify_user_certificate(
+    bank_id_response: Dict[str, Any],
+    ensure_certificates_still_valid: bool,
+    BANK_ID_ROOT_CERT: str,
+    cache: Union[VerificationCache, None] = None,
+    container: Any = None,
+    chain_store: Union[_ChainStore, None] = None,
+) -> None:
+    """Step 4 for the user's certificate, verified up to the BankID root certificate."""
+    from OpenSSL import crypto
+    from OpenSSL.crypto import X509StoreContextError
+
+    if cache is None:
+        cache = default_cache
+    if container is None:
+        container = _completion_data_container(bank_id_response).signature_container
+
+    _LOG.info("\n4. Verify all the certificates by relying on the BankID root certificate as a trusted one \n")
+
+    if chain_store is None:
+        chain_store = _chain_store(cache, container, BANK_ID_ROOT_CERT.encode(), ensure_certificates_still_valid)
+    store = chain_store[0]
+
+    # The user certificate is parsed for its own store context, as its expiry may be changed below.
+    user_cert = crypto.load_certificate(crypto.FILETYPE_PEM, make_cert(container.certificates[0].text).encode())
+
+    # Make sure we respect or do not respect certificate expiration times
+    if not ensure_certificates_still_valid:
+        user_cert.set_notAfter(_tomorrow())
+
+    try:
+        # Verify the user certificate up to the root certificate
+        store_ctx = crypto.X509StoreContext(store, user_cert)
+        store_ctx.verify_certificate()
+        _LOG.debug("User Certificate issued by the respective bank... OK")
+    except X509StoreContextError:
+        raise AssertionError("BankID user certificate chain could not be verified.")
+
+
+def _verify_ocsp_certificate(
+    bank_id_response: Dict[str, Any],
+    ocsp_certificate_der: bytes,
+    ensure_certificates_still_valid: bool,
+    BANK_ID_ROOT_CERT: str,
+    cache: Union[VerificationCache, None] = None,
+    chain_store: Union[_ChainStore, None] = None,
+    ocsp_certificate: Union["crypto.X509", None] = None,
+) -> None:
+    """Step 4 for the OCSP responder's certificate, verified up to the BankID root certificate once per cache entry."""
+    from OpenSSL import crypto
+    from OpenSSL.crypto import X509StoreContextError
+
+    if cache is None:
+        cache = default_cache
+    if chain_store is None:
+        container = _completion_data_container(bank_id_response).signature_container
+        chain_store = _chain_store(cache, container, BANK_ID_ROOT_CERT.encode(), ensure_certificates_still_valid)
+    if ocsp_certificate is None:
+        ocsp_certificate = _cached_certificate(cache, ocsp_certificate_der, ensure_certificates_still_valid)
+    store, store_key, chain = chain_store
+    verified_certificate = ocsp_certificate
+
+    def verify_ocsp_certificate() -> bool:
         try:
             # Verify the ocsp certificate up to the root certificate
-            store_ctx = crypto.X509StoreContext(store, ocsp_certificate)
+            store_ctx = crypto.X509StoreContext(store, verified_certificate)
             store_ctx.verify_certificate()
             _LOG.debug("OCSP Certificate issued by the respective bank... OK")
         except X509StoreContextError:
             raise AssertionError("OCSP certificate chain could not be verified.")
+        return True
+
+    cache.get(
+        ("verified", fingerprint(ocsp_certificate_der)) + store_key,
+        verify_ocsp_certificate,
+        lambda _: min(_not_after(c) for c in chain + [verified_certificate]),
+    )
+
+
+def verify_bankid_response(
+    bank_id_response: Dict[str, Any],
+    ensure_certificates_still_valid: bool = True,
+    BANK_ID_ROOT_CERT: Union[str, None] = None,
+    cache: Union[VerificationCache, None] = None,
+) -> str:
+    """Verify the signature, OCSP response and certificate chains of a complete collect response.
+
+    The CA and OCSP responder certificates, and the verification of the OCSP responder's
+    chain, are kept in ``cache``, by default
+    :py:data:`bankid.experimental.cache.default_cache`, between calls.
+
+    """
+    if cache is None:
+        cache = default_cache
+
+    container = _completion_data_container(bank_id_response).signature_container
+    root_cert = _root_cert(BANK_ID_ROOT_CERT)
+    _verify_signature(bank_id_response, container)
+    ocsp_produced_at, ocsp_certificate_der, ocsp_certificate = _verify_ocsp_response(
+        bank_id_response, ensure_certificates_still_valid, cache
+    )
+    chain_store = _chain_store(cache, container, root_cert.encode(), ensure_certificates_still_valid)
+    _verify_user_certificate(bank_id_response, ensure_certificates_still_valid, root_cert, cache, container, chain_store)
+    _verify_ocsp_certificate(
+        bank_id_response,
+        ocsp_certificate_der,
+        ensure_certificates_still_valid,
+        root_cert,
+        cache,
+        chain_store,
+        ocsp_certificate,
+    )
+    return ocsp_produced_at
 
-    except Exception as e:
-        raise e
 
-    return ocsp_produced_at
+async def verify_bankid_response_async(
+    bank_id_response: Dict[str, Any],
+    ensure_certificates_still_valid: bool = True,
+    BANK_ID_ROOT_CERT: Union[str, None] = None,
+    cache: Union[VerificationCache, None] = None,
+    executor: Union[Executor, None] = None,
+    engine: str = "pyopenssl",
+) -> str:
+    """Verify a complete collect response like :py:func:`verify_bankid_response`, without blocking the event loop.
+
+    The signature, the OCSP response and the user's certificate chain are verified
+    concurrently in ``executor``, since OpenSSL releases the GIL while verifying, and then
+    the OCSP responder's certificate chain, which is usually cached. The ``"cryptography"``
+    engine, :py:func:`bankid.experimental.engine.verify_bankid_response`, is run as one task.
+
+    .. code-block:: python
+
+        executor = concurrent.futures.ThreadPoolExecutor(4)
+        produced_at = await verify_bankid_response_async(response, BANK_ID_ROOT_CERT=root, executor=executor)
+
+    :param executor: The thread or process executor to verify in, by default the event loop's
+        default executor. Workers of a process executor keep their own
+        :py:data:`~bankid.experimental.cache.default_cache` and ``cache`` is not used.
+    :type executor: concurrent.futures.Executor
+    :param engine: ``"pyopenssl"`` or ``"cryptography"``, as for :py:func:`verify_many`.
+    :type engine: str
+    :return: The time the OCSP response was produced, in Swedish time.
+    :rtype: str
+
+    """
+    loop = asyncio.get_running_loop()
+    if isinstance(executor, ProcessPoolExecutor):
+        cache = None
+    elif cache is None:
+        cache = default_cache
+
+    def run(function: Callable[..., Any], *args: Any) -> "asyncio.Future[Any]":
+        return loop.run_in_executor(executor, functools.partial(function, *args))
+
+    if engine != "pyopenssl":
+        produced_at: str = await run(
+            _engine(engine), bank_id_response, ensure_certificates_still_valid, BANK_ID_ROOT_CERT, cache
+        )
+        return produced_at
+
+    # Raises TypeError or AttributeError on a malformed response before anything is submitted.
+    _completion_data_container(bank_id_response)
+    root_cert = _root_cert(BANK_ID_ROOT_CERT)
+    results: Tuple[Any, ...] = await asyncio.gather(
+        run(_verify_signature, bank_id_response),
+        run(_verify_ocsp_response_task, bank_id_response, ensure_certificates_still_valid, cache),
+        run(_verify_user_certificate, bank_id_response, ensure_certificates_still_valid, root_cert, cache),
+        return_exceptions=True,
+    )
+    # The errors are raised in the order verify_bankid_response checks in.
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    ocsp_produced_at, ocsp_certificate_der = results[1]
+    await run(
+        _verify_ocsp_certificate,
+        bank_id_response,
+        ocsp_certificate_der,
+        ensure_certificates_still_valid,
+        root_cert,
+        cache,
+    )
+    return ocsp_produced_at  # type: ignore[no-any-return]
+
+
+class VerificationResult(NamedTuple):
+    """The outcome of verifying the response number ``position`` (from 0) in :py:func:`verify_many`."""
+
+    position: int
+    order_ref: Union[str, None]
+    produced_at: Union[str, None]
+    error: Union[str, None]
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+# Set in each worker process by _init_worker, so that the options are not sent with every chunk.
+_WORKER_OPTIONS: Dict[str, Any] = {}
+
+
+#: The functions verifying a response, by the name of the package they verify it with.
+ENGINES = ("pyopenssl", "cryptography")
+
+
+def _engine(name: str) -> Any:
+    if name == "cryptography":
+        from bankid.experimental.engine import verify_bankid_response as verify
+
+        return verify
+    if name != "pyopenssl":
+        raise ValueError("Unknown verification engine {0!r}, expected one of {1}".format(name, ", ".join(ENGINES)))
+    return verify_bankid_response
+
+
+def _init_worker(root_cert: str, ensure_certificates_still_valid: bool, engine: str = "pyopenssl") -> None:
+    _WORKER_OPTIONS.update(
+        root_cert=root_cert, ensure_certificates_still_valid=ensure_certificates_still_valid, verify=_engine(engine)
+    )
+
+
+def _verify_one(position: int, item: Union[str, bytes, Dict[str, Any]]) -> VerificationResult:
+    order_ref = None
+    try:
+        response = json.loads(item) if isinstance(item, (str, bytes)) else item
+        order_ref = response.get("orderRef") if isinstance(response, dict) else None
+        produced_at = _WORKER_OPTIONS["verify"](
+            response,
+            ensure_certificates_still_valid=_WORKER_OPTIONS["ensure_certificates_still_valid"],
+            BANK_ID_ROOT_CERT=_WORKER_OPTIONS["root_cert"],
+        )
+    except Exception as e:
+        return VerificationResult(position, order_ref, None, "{0}: {1}".format(type(e).__name__, e))
+    return VerificationResult(position, order_ref, produced_at, None)
+
+
+def _verify_chunk(start: int, items: List[Any]) -> List[VerificationResult]:
+    return [_verify_one(start + i, item) for i, item in enumerate(items)]
+
+
+def _chunks(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    iterator = iter(items)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def verify_many(
+    responses: Iterable[Union[str, bytes, Dict[str, Any]]],
+    BANK_ID_ROOT_CERT: str,
+    ensure_certificates_still_valid: bool = True,
+    workers: Union[int, None] = None,
+    chunk_size: int = 64,
+    max_in_flight: Union[int, None] = None,
+    engine: str = "pyopenssl",
+) -> Iterator[VerificationResult]:
+    """Verify many complete collect responses with :py:func:`verify_bankid_response` in a process pool.
+
+    The responses are read lazily, sent to the workers in chunks and the results are yielded
+    in the order of the responses, with at most ``max_in_flight`` chunks read ahead, so that
+    arbitrarily many responses can be verified in bounded memory. Each worker keeps the trust
+    anchors it has parsed for all its chunks. A response failing verification gives a result
+    with its ``error`` instead of raising.
+
+    :param responses: Collect responses, as dicts or JSON, e.g. the lines of a JSONL file.
+    :param BANK_ID_ROOT_CERT: The BankID root certificate in PEM.
+    :param ensure_certificates_still_valid: Whether expired certificates fail verification.
+    :param workers: Number of worker processes, by default the number of CPUs. With 0 the
+        responses are verified in this process.
+    :param chunk_size: Number of responses per task sent to a worker.
+    :param max_in_flight: Maximum number of chunks submitted and not yet yielded, by default
+        twice the number of workers.
+    :param engine: ``"pyopenssl"`` for :py:func:`verify_bankid_response` or ``"cryptography"`` for
+        :py:func:`bankid.experimental.engine.verify_bankid_response`.
+    :return: Iterator of :py:class:`VerificationResult`, one per response.
+
+    """
+    if workers == 0:
+        _init_worker(BANK_ID_ROOT_CERT, ensure_certificates_still_valid, engine)
+        for position, item in enumerate(responses):
+            yield _verify_one(position, item)
+        return
+
+    _engine(engine)
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or 2 * workers
+    in_flight: Deque[Any] = collections.deque()
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(BANK_ID_ROOT_CERT, ensure_certificates_still_valid, engine)
+    ) as executor:
+        start = 0
+        for chunk in _chunks(responses, chunk_size):
+            if len(in_flight) >= max_in_flight:
+                for result in in_flight.popleft().result():
+                    yield result
+            in_flight.append(executor.submit(_verify_chunk, start, chunk))
+            start += len(chunk)
+        while in_flight:
+            for result in in_flight.popleft().result():
+                yield result
+
+
+def read_jsonl(paths: Iterable[str]) -> Iterator[Tuple[str, str]]:
+    """The non-blank lines of JSONL files, as ``("path:line number", line)`` pairs."""
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for number, line in enumerate(f, 1):
+                if line.strip():
+                    yield "{0}:{1}".format(path, number), line
+
+
+def _resume(output: str) -> Tuple[int, int]:
+    """The number of results and of failed results in ``output``, after dropping any partially written last line."""
+    if not os.path.exists(output):
+        return 0, 0
+    with open(output, "rb+") as f:
+        data = f.read()
+        complete = data.rfind(b"\n") + 1
+        if complete != len(data):
+            f.truncate(complete)
+    return data.count(b"\n", 0, complete), data.count(b'"ok": false', 0, complete)
+
+
+def main(argv: Union[List[str], None] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m bankid.experimental.verify",
+        description="Verify the signatures and OCSP responses of stored BankID collect responses.",
+    )
+    parser.add_argument("inputs", nargs="+", help="JSONL files with one complete collect response per line.")
+    parser.add_argument("--root-cert", required=True, help="PEM file with the BankID root certificate.")
+    parser.add_argument("--output", required=True, help="JSONL file of results, which is appended to and resumed from.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes, by default the number of CPUs.")
+    parser.add_argument("--chunk-size", type=int, default=64, help="Responses per task sent to a worker.")
+    parser.add_argument("--ignore-expiry", action="store_true", help="Accept certificates that have expired since.")
+    parser.add_argument("--engine", choices=ENGINES, default="pyopenssl", help="Package to verify the responses with.")
+    parser.add_argument("--checkpoint-every", type=int, default=1000, help="Results between syncs of the output to disk.")
+    args = parser.parse_args(argv)
+
+    with open(args.root_cert, encoding="ascii") as f:
+        root_cert = f.read()
+    done, failed = _resume(args.output)
+    if done:
+        _LOG.warning("Resuming after %d verified responses in %s", done, args.output)
+
+    sources: Deque[str] = collections.deque()
+
+    def lines() -> Iterator[str]:
+        for source, line in itertools.islice(read_jsonl(args.inputs), done, None):
+            sources.append(source)
+            yield line
+
+    verified = 0
+    with open(args.output, "a", encoding="utf-8") as out:
+        results = verify_many(
+            lines(),
+            root_cert,
+            ensure_certificates_still_valid=not args.ignore_expiry,
+            workers=args.workers,
+            chunk_size=args.chunk_size,
+            engine=args.engine,
+        )
+        for result in results:
+            verified += 1
+            failed += not result.ok
+            record = {
+                "source": sources.popleft(),
+                "orderRef": result.order_ref,
+                "ok": result.ok,
+                "producedAt": result.produced_at,
+                "error": result.error,
+            }
+            out.write(json.dumps(record) + "\n")
+            if verified % args.checkpoint_every == 0:
+                out.flush()
+                os.fsync(out.fileno())
+    print("Verified {0} responses, {1} in total of which {2} failed".format(verified, done + verified, failed))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+:mod:`bankid.loadtest` -- Load generator against the in-process fake server
+===========================================================================
+
+Drives simulated user journeys through :py:class:`~bankid.BankIDAsyncClient` backed by
+:py:class:`~bankid.testing.FakeBankIDTransport` and reports throughput and latency
+percentiles per endpoint. Run it with:
+
+.. code-block:: bash
+
+    $ python -m bankid.loadtest --journeys 5000 --concurrency 500 --latency-ms 40
+
+"""
+
+import argparse
+import asyncio
+import math
+import random
+import time
+from collections import defaultdict
+from typing import Awaitable, Dict, List, Sequence, Tuple, TypeVar, Union
+
+import httpx
+
+from bankid.asyncclient import BankIDAsyncClient
+from bankid.certs import get_test_cert_and_key
+from bankid.exceptions import BankIDError
+from bankid.testing import FakeBankIDServer, FakeBankIDTransport, lognormal_latency
+
+T = TypeVar("T")
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """Nearest-rank percentile of ``values``, with ``q`` in [0, 100]."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, int(math.ceil(q / 100.0 * len(ordered))))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class LoadTestReport:
+    """Latencies, error counts and outcomes recorded during a load test run."""
+
+    def __init__(self) -> None:
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.outcomes: Dict[str, int] = defaultdict(int)
+        self.duration = 0.0
+        self.journeys = 0
+
+    @property
+    def requests(self) -> int:
+        return sum(len(v) for v in self.latencies.values())
+
+    def record(self, endpoint: str, latency: float, error: Union[str, None] = None) -> None:
+        self.latencies[endpoint].append(latency)
+        if error is not None:
+            self.errors[endpoint][error] += 1
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Per endpoint request count, error count and p50/p95/p99 latency in milliseconds."""
+        out = {}
+        for endpoint, values in sorted(self.latencies.items()):
+            out[endpoint] = {
+                "requests": len(values),
+                "errors": sum(self.errors[endpoint].values()),
+                "p50_ms": percentile(values, 50) * 1000,
+                "p95_ms": percentile(values, 95) * 1000,
+                "p99_ms": percentile(values, 99) * 1000,
+            }
+        return out
+
+    def format(self) -> str:
+        duration = self.duration or float("inf")
+        lines = [
+            "Journeys: {0} in {1:.2f} s ({2:.1f} journeys/s)".format(self.journeys, self.duration, self.journeys / duration),
+            "Requests: {0} ({1:.1f} req/s)".format(self.requests, self.requests / duration),
+            "Outcomes: " + ", ".join("{0}={1}".format(k, v) for k, v in sorted(self.outcomes.items())),
+            "",
+            "{0:<12}{1:>10}{2:>8}{3:>10}{4:>10}{5:>10}".format("endpoint", "requests", "errors", "p50 ms", "p95 ms", "p99 ms"),
+        ]
+        for endpoint, s in self.summary().items():
+            lines.append(
+                "{0:<12}{1:>10}{2:>8}{3:>10.2f}{4:>10.2f}{5:>10.2f}".format(
+                    endpoint, int(s["requests"]), int(s["errors"]), s["p50_ms"], s["p95_ms"], s["p99_ms"]
+                )
+            )
+        return "\n".join(lines)
+
+
+async def _timed(report: LoadTestReport, endpoint: str, coro: Awaitable[T]) -> T:
+    t = time.perf_counter()
+    try:
+        result = await coro
+    except BankIDError as e:
+        report.record(endpoint, time.perf_counter() - t, e.json.get("errorCode", "unknown"))
+        raise
+    except httpx.HTTPError as e:
+        report.record(endpoint, time.perf_counter() - t, type(e).__name__)
+        raise
+    report.record(endpoint, time.perf_counter() - t)
+    return result
+
+
+async def _journey(
+    client: BankIDAsyncClient, report: LoadTestReport, rng: random.Random, poll_interval: float, phone_share: float
+) -> None:
+    try:
+        if rng.random() < phone_share:
+            personal_number = "19{0:010d}".format(rng.randrange(10**10))
+            order = await _timed(report, "phone/auth", client.phone_authenticate(personal_number, "RP"))
+        else:
+            order = await _timed(report, "auth", client.authenticate("127.0.0.1"))
+        while True:
+            await asyncio.sleep(poll_interval)
+            result = await _timed(report, "collect", client.collect(order["orderRef"]))
+            if result["status"] != "pending":
+                report.outcomes["{0}:{1}".format(result["status"], result.get("hintCode", ""))] += 1
+                return
+    except (BankIDError, httpx.HTTPError) as e:
+        report.outcomes["error:" + type(e).__name__] += 1
+
+
+async def run_load_test(
+    journeys: int = 1000,
+    concurrency: int = 100,
+    server: Union[FakeBankIDServer, None] = None,
+    poll_interval: float = 2.0,
+    phone_share: float = 0.0,
+    seed: Union[int, None] = None,
+) -> LoadTestReport:
+    """Run ``journeys`` simulated user journeys with at most ``concurrency`` in flight.
+
+    Each journey initiates an order and then collects it every ``poll_interval`` seconds
+    (scaled with the server's ``time_scale``) until it is no longer pending.
+
+    :return: The recorded :py:class:`LoadTestReport`.
+    :rtype: LoadTestReport
+
+    """
+    server = server or FakeBankIDServer(seed=seed)
+    client = BankIDAsyncClient(_test_cert_and_key(), test_server=True, transport=FakeBankIDTransport(server))
+    report = LoadTestReport()
+    rng = random.Random(seed)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _bounded() -> None:
+        async with semaphore:
+            await _journey(client, report, rng, poll_interval * server.time_scale, phone_share)
+
+    t = time.perf_counter()
+    await asyncio.gather(*(_bounded() for _ in range(journeys)))
+    report.duration = time.perf_counter() - t
+    report.journeys = journeys
+    await client.client.aclose()
+    return report
+
+
+def _test_cert_and_key() -> Tuple[str, str]:
+    cert, key = get_test_cert_and_key()
+    return str(cert), str(key)
+
+
+def _parse_error_rate(value: str) -> Tuple[str, float]:
+    code, _, rate = value.partition("=")
+    try:
+        return code, float(rate)
+    except ValueError:
+        raise argparse.ArgumentTypeError("Expected errorCode=rate, e.g. internalError=0.01")
+
+
+def main(argv: Union[Sequence[str], None] = None) -> LoadTestReport:
+    parser = argparse.ArgumentParser(
+        prog="python -m bankid.loadtest", description="Load test BankID flows against the fake server."
+    )
+    parser.add_argument("--journeys", type=int, default=1000, help="Number of user journeys to simulate.")
+    parser.add_argument("--concurrency", type=int, default=100, help="Maximum number of journeys in flight.")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Median fake server latency.")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Log-normal shape of the latency.")
+    parser.add_argument("--time-scale", type=float, default=0.01, help="Multiplier on journey durations and poll cadence.")
+    parser.add_argument("--phone-share", type=float, default=0.0, help="Share of journeys using phone/auth.")
+    parser.add_argument(
+        "--error-rate", type=_parse_error_rate, action="append", default=[], help="errorCode=rate, may be repeated."
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    server = FakeBankIDServer(
+        latency=lognormal_latency(args.latency_ms / 1000.0, args.latency_sigma, random.Random(args.seed)),
+        error_rates=dict(args.error_rate),
+        time_scale=args.time_scale,
+        seed=args.seed,
+    )
+    report = asyncio.run(
+        run_load_test(args.journeys, args.concurrency, server, phone_share=args.phone_share, seed=args.seed)
+    )
+    print(report.format())
+    return report
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
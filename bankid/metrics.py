@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+"""
+:mod:`bankid.metrics` -- Client call metrics in Prometheus format
+=================================================================
+
+A small, dependency free metrics registry and the :py:class:`BankIDMetrics` that the clients
+record their calls in when created with ``metrics=``. The metrics are rendered in the
+`Prometheus text format <https://prometheus.io/docs/instrumenting/exposition_formats/>`_,
+to be served from an endpoint of the application or by :py:func:`start_http_server`.
+
+.. code-block:: python
+
+    metrics = BankIDMetrics()
+    client = BankIDClient(certificates=(cert, key), metrics=metrics)
+
+    @app.route("/metrics")
+    def prometheus_metrics():
+        return metrics.render(), 200, {"Content-Type": CONTENT_TYPE}
+
+The following metrics are recorded, labelled by ``endpoint``, e.g. ``auth`` or ``collect``:
+
+- ``bankid_request_duration_seconds``: histogram of call latencies, including failed calls.
+- ``bankid_requests_in_flight``: gauge of calls waiting for a response.
+- ``bankid_errors_total``: counter of failed calls by ``error``, which is the BankID
+  ``errorCode``, e.g. ``maintenance``, or ``timeout``, ``tls`` or ``transport`` for calls
+  that got no response.
+- ``bankid_collect_responses_total``: counter of collect responses by ``status`` and ``hint_code``.
+- ``bankid_collect_calls_per_completed_order``: collect calls made per distinct order
+  collected as complete; collecting a completed order again counts as a call, not an order.
+
+"""
+
+import abc
+import ssl
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from types import TracebackType
+from typing import Any, Dict, Iterator, List, Mapping, Sequence, Tuple, Type, Union
+
+import httpx
+
+from bankid.exceptions import BankIDError
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# How many completed ``orderRef`` values are remembered to not count a re-collected order twice.
+_COMPLETED_ORDERS_KEPT = 10000
+
+_Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric(abc.ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Mapping[str, str]) -> _Labels:
+        if set(labels) != set(self.labelnames):
+            raise ValueError("{0} takes the labels {1}".format(self.name, self.labelnames))
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _format_labels(self, key: _Labels, extra: Sequence[Tuple[str, str]] = ()) -> str:
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join('{0}="{1}"'.format(name, _escape(value)) for name, value in pairs) + "}"
+
+    @abc.abstractmethod
+    def samples(self) -> Iterator[str]:
+        """The sample lines of the metric in the Prometheus text format."""
+
+    def render(self) -> List[str]:
+        lines = [
+            "# HELP {0} {1}".format(self.name, _escape(self.documentation)),
+            "# TYPE {0} {1}".format(self.name, self.kind),
+        ]
+        lines.extend(self.samples())
+        return lines
+
+
+class Counter(_Metric):
+    """A value that only increases."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[_Labels, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        key = self._key(labels)
+        with self._lock:
+            return self._values.get(key, 0.0)
+
+    def total(self) -> float:
+        """The sum over all label values."""
+        with self._lock:
+            return sum(self._values.values())
+
+    def samples(self) -> Iterator[str]:
+        # Copied under the lock, as calls recorded while rendering may add label values.
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield "{0}{1} {2}".format(self.name, self._format_labels(key), _format_value(value))
+
+
+class Gauge(Counter):
+    """A value that can go up and down."""
+
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """Counts of observed values in cumulative buckets, with their sum and count."""
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # Per label values: count per bucket (not cumulative), sum and count.
+        self._values: Dict[_Labels, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = next(i for i, bound in enumerate(self.buckets) if value <= bound)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * len(self.buckets), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    def count(self, **labels: str) -> int:
+        key = self._key(labels)
+        with self._lock:
+            values = self._values.get(key)
+            return sum(values[0]) if values else 0
+
+    def samples(self) -> Iterator[str]:
+        # Copied under the lock, as the counts are updated in place by observe.
+        with self._lock:
+            items = sorted((key, list(counts), total[0]) for key, (counts, total) in self._values.items())
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = self._format_labels(key, [("le", _format_value(bound))])
+                yield "{0}_bucket{1} {2}".format(self.name, labels, cumulative)
+            yield "{0}_sum{1} {2}".format(self.name, self._format_labels(key), _format_value(total))
+            yield "{0}_count{1} {2}".format(self.name, self._format_labels(key), cumulative)
+
+
+class MetricsRegistry:
+    """A collection of metrics rendered together."""
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> Any:
+        if metric.name in self._metrics:
+            raise ValueError("A metric named {0} is already registered".format(metric.name))
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))  # type: ignore[no-any-return]
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))  # type: ignore[no-any-return]
+
+    def histogram(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))  # type: ignore[no-any-return]
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text format."""
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def classify_error(error: BaseException) -> str:
+    """The ``error`` label value of a failed call: the BankID ``errorCode``, or the kind of transport failure."""
+    if isinstance(error, BankIDError):
+        return str(error.json.get("errorCode") or type(error).__name__)
+    if isinstance(error, httpx.TimeoutException):
+        return "timeout"
+    if isinstance(error, httpx.TransportError):
+        cause = error.__cause__ or error.__context__
+        return "tls" if isinstance(cause, ssl.SSLError) or "SSL" in str(error) else "transport"
+    return type(error).__name__
+
+
+class _TrackedCall:
+    """Records one call in :py:class:`BankIDMetrics`, used as a context manager around it."""
+
+    __slots__ = ("metrics", "endpoint", "started", "response")
+
+    def __init__(self, metrics: "BankIDMetrics", endpoint: str):
+        self.metrics = metrics
+        self.endpoint = endpoint
+        self.response: Union[httpx.Response, None] = None
+
+    def __enter__(self) -> "_TrackedCall":
+        self.metrics.in_flight.inc(endpoint=self.endpoint)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Union[Type[BaseException], None],
+        exc: Union[BaseException, None],
+        tb: Union[TracebackType, None],
+    ) -> None:
+        metrics = self.metrics
+        metrics.duration.observe(time.perf_counter() - self.started, endpoint=self.endpoint)
+        metrics.in_flight.dec(endpoint=self.endpoint)
+        if exc is not None:
+            metrics.errors.inc(endpoint=self.endpoint, error=classify_error(exc))
+        elif self.response is not None and self.response.status_code != 200:
+            try:
+                error_code = str(self.response.json().get("errorCode"))
+            except ValueError:
+                error_code = "http_{0}".format(self.response.status_code)
+            metrics.errors.inc(endpoint=self.endpoint, error=error_code)
+        else:
+            # Successful collect calls are counted in observe_collect, once the response is decoded.
+            return
+        if self.endpoint == "collect":
+            metrics._update_collect_calls_per_completed_order()
+
+
+class BankIDMetrics:
+    """The metrics of BankID client calls. One instance can be shared by several clients.
+
+    :param registry: The registry to add the metrics to, by default a new one.
+    :type registry: MetricsRegistry
+    :param buckets: Upper bounds in seconds of the latency histogram buckets.
+    :type buckets: tuple
+
+    """
+
+    def __init__(self, registry: Union[MetricsRegistry, None] = None, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.registry = registry if registry is not None else MetricsRegistry()
+        self.duration = self.registry.histogram(
+            "bankid_request_duration_seconds", "Latency of BankID API calls.", ["endpoint"], buckets
+        )
+        self.in_flight = self.registry.gauge("bankid_requests_in_flight", "BankID API calls in progress.", ["endpoint"])
+        self.errors = self.registry.counter(
+            "bankid_errors_total", "Failed BankID API calls by errorCode or transport failure.", ["endpoint", "error"]
+        )
+        self.collect_responses = self.registry.counter(
+            "bankid_collect_responses_total", "Collect responses by status and hintCode.", ["status", "hint_code"]
+        )
+        self.collect_calls_per_completed_order = self.registry.gauge(
+            "bankid_collect_calls_per_completed_order", "Collect calls made per distinct order collected as complete."
+        )
+        self._completed_orders: "OrderedDict[str, None]" = OrderedDict()
+        self._completed_count = 0
+        self._lock = threading.Lock()
+
+    def track(self, endpoint: str) -> _TrackedCall:
+        """Context manager recording a call to ``endpoint``. Set ``response`` on it when one is received."""
+        return _TrackedCall(self, endpoint)
+
+    def observe_collect(self, response: Mapping[str, Any]) -> None:
+        """Record a successful collect response."""
+        self.collect_responses.inc(status=str(response.get("status")), hint_code=str(response.get("hintCode") or ""))
+        if response.get("status") == "complete":
+            order_ref = str(response.get("orderRef"))
+            with self._lock:
+                if order_ref not in self._completed_orders:
+                    self._completed_orders[order_ref] = None
+                    self._completed_count += 1
+                    if len(self._completed_orders) > _COMPLETED_ORDERS_KEPT:
+                        self._completed_orders.popitem(last=False)
+        self._update_collect_calls_per_completed_order()
+
+    def _update_collect_calls_per_completed_order(self) -> None:
+        with self._lock:
+            completed = self._completed_count
+        if completed:
+            self.collect_calls_per_completed_order.set(self.duration.count(endpoint="collect") / completed)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text format."""
+        return self.registry.render()
+
+
+def start_http_server(
+    metrics: Union[BankIDMetrics, MetricsRegistry], port: int = 9464, address: str = "127.0.0.1"
+) -> HTTPServer:
+    """Serve the metrics on ``http://address:port/`` from a daemon thread.
+
+    :return: The server, which is stopped with its ``shutdown`` method.
+    :rtype: http.server.HTTPServer
+
+    """
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    server = HTTPServer((address, port), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""
+:mod:`bankid.orderstore` -- Storage of order state between requests
+===================================================================
+
+Showing animated QR codes requires the ``qrStartToken``, ``qrStartSecret`` and the time the
+order was started to be available in every request made for the order. An :py:class:`OrderStore`
+keeps this state, keyed on ``orderRef``, for a limited time.
+
+:py:class:`MemoryOrderStore` keeps orders in the running process, while :py:class:`SQLiteOrderStore`
+keeps them in a local SQLite database file, so that several worker processes on one host
+(e.g. gunicorn workers) can share them without an external cache service.
+
+.. code-block:: python
+
+    store = SQLiteOrderStore("/var/run/myapp/orders.sqlite3")
+
+    # When initiating an order:
+    store.add_order(client.authenticate(end_user_ip))
+
+    # When serving the QR code, possibly in another worker:
+    order = store.get(order_ref)
+    qr_content = generate_qr_code_content(order.qr_start_token, order.start_t, order.qr_start_secret)
+
+"""
+
+import abc
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Mapping, NamedTuple, TypeVar, Union
+
+_PathType = Union[str, "os.PathLike[str]"]
+_StoreType = TypeVar("_StoreType", bound="OrderStore")
+
+
+class StoredOrder(NamedTuple):
+    """The state of an order needed after it was initiated.
+
+    ``qr_start_token`` and ``qr_start_secret`` are ``None`` for phone orders.
+    """
+
+    order_ref: str
+    auto_start_token: Union[str, None]
+    qr_start_token: Union[str, None]
+    qr_start_secret: Union[str, None]
+    start_t: float
+    expires: float
+
+
+class OrderStore(abc.ABC):
+    """Interface for order state storage, with expiry of orders ``ttl`` seconds after they were added.
+
+    :param ttl: Seconds an order is kept.
+    :type ttl: float
+    :param clock: Time source, defaults to :py:func:`time.time`.
+
+    """
+
+    def __init__(self, ttl: float = 300.0, clock: Callable[[], float] = time.time):
+        self.ttl = ttl
+        self._clock = clock
+
+    def __contains__(self, order_ref: object) -> bool:
+        return isinstance(order_ref, str) and self.get(order_ref) is not None
+
+    def __enter__(self: _StoreType) -> _StoreType:
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def add_order(self, order_response: Mapping[str, Any], start_t: Union[float, datetime, None] = None) -> StoredOrder:
+        """Store an order from the response of an order initiating call, e.g. ``authenticate`` or ``sign``.
+
+        :param order_response: The response from the order initiating call.
+        :type order_response: dict
+        :param start_t: When the order response was received, as :py:func:`time.time` or UTC
+            datetime. Defaults to now.
+        :type start_t: float or datetime
+        :return: The stored order.
+        :rtype: StoredOrder
+
+        """
+        now = self._clock()
+        if start_t is None:
+            start_t = now
+        elif isinstance(start_t, datetime):
+            start_t = start_t.timestamp()
+        order = StoredOrder(
+            order_response["orderRef"],
+            order_response.get("autoStartToken"),
+            order_response.get("qrStartToken"),
+            order_response.get("qrStartSecret"),
+            start_t,
+            now + self.ttl,
+        )
+        self.put(order)
+        return order
+
+    @abc.abstractmethod
+    def put(self, order: StoredOrder) -> None:
+        """Store an order, replacing any stored order with the same ``order_ref``."""
+
+    @abc.abstractmethod
+    def get(self, order_ref: str) -> Union[StoredOrder, None]:
+        """Get a stored order, or ``None`` if it is not stored or has expired."""
+
+    @abc.abstractmethod
+    def delete(self, order_ref: str) -> None:
+        """Remove an order, e.g. when it is no longer pending."""
+
+    @abc.abstractmethod
+    def evict_expired(self) -> int:
+        """Remove all expired orders and return how many there were."""
+
+    def close(self) -> None:
+        """Release any resources held by the store."""
+
+
+class MemoryOrderStore(OrderStore):
+    """Order store keeping orders in a dictionary in the running process.
+
+    Expired orders are swept out at most once every ``ttl`` seconds when orders are added.
+    """
+
+    def __init__(self, ttl: float = 300.0, clock: Callable[[], float] = time.time):
+        super().__init__(ttl, clock)
+        self._orders: Dict[str, StoredOrder] = {}
+        self._lock = threading.Lock()
+        self._next_sweep = 0.0
+
+    def __len__(self) -> int:
+        return len(self._orders)
+
+    def put(self, order: StoredOrder) -> None:
+        if self._clock() >= self._next_sweep:
+            self.evict_expired()
+        with self._lock:
+            self._orders[order.order_ref] = order
+
+    def get(self, order_ref: str) -> Union[StoredOrder, None]:
+        order = self._orders.get(order_ref)
+        if order is None or order.expires <= self._clock():
+            return None
+        return order
+
+    def delete(self, order_ref: str) -> None:
+        with self._lock:
+            self._orders.pop(order_ref, None)
+
+    def evict_expired(self) -> int:
+        now = self._clock()
+        with self._lock:
+            expired = [o for o, order in self._orders.items() if order.expires <= now]
+            for order_ref in expired:
+                del self._orders[order_ref]
+            self._next_sweep = now + self.ttl
+        return len(expired)
+
+
+class SQLiteOrderStore(OrderStore):
+    """Order store keeping orders in an SQLite database file, shareable between processes on one host.
+
+    The database uses write-ahead logging, so that readers in other processes are not blocked
+    by writes. Writes are buffered and committed in one transaction when ``batch_size`` of them
+    have been made or ``flush_interval`` seconds after the first of them, whichever comes
+    first. Buffered orders are visible to :py:meth:`get` in the same process at once, and to other
+    processes after they are committed; set ``batch_size`` to 1 to commit every write directly.
+
+    :param path: Path to the database file, created if it does not exist.
+    :type path: str
+    :param ttl: Seconds an order is kept.
+    :type ttl: float
+    :param batch_size: Number of buffered writes that triggers a commit.
+    :type batch_size: int
+    :param flush_interval: Maximum number of seconds a write is buffered.
+    :type flush_interval: float
+    :param clock: Time source, defaults to :py:func:`time.time`.
+
+    """
+
+    def __init__(
+        self,
+        path: _PathType,
+        ttl: float = 300.0,
+        batch_size: int = 100,
+        flush_interval: float = 0.05,
+        clock: Callable[[], float] = time.time,
+    ):
+        super().__init__(ttl, clock)
+        self.path = os.fspath(path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._lock = threading.RLock()
+        # Buffered writes, an order to insert or None to delete.
+        self._pending: Dict[str, Union[StoredOrder, None]] = {}
+        self._timer: Union[threading.Timer, None] = None
+        self._next_sweep = clock() + ttl
+
+        self._conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS bankid_orders ("
+            "order_ref TEXT PRIMARY KEY, auto_start_token TEXT, qr_start_token TEXT, qr_start_secret TEXT, "
+            "start_t REAL NOT NULL, expires REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS bankid_orders_expires ON bankid_orders (expires)")
+
+    def __len__(self) -> int:
+        self.flush()
+        with self._lock:
+            row = self._conn.execute("SELECT COUNT(*) FROM bankid_orders WHERE expires > ?", (self._clock(),)).fetchone()
+        return int(row[0])
+
+    def put(self, order: StoredOrder) -> None:
+        self._buffer(order.order_ref, order)
+
+    def get(self, order_ref: str) -> Union[StoredOrder, None]:
+        with self._lock:
+            if order_ref in self._pending:
+                order = self._pending[order_ref]
+            else:
+                row = self._conn.execute(
+                    "SELECT order_ref, auto_start_token, qr_start_token, qr_start_secret, start_t, expires "
+                    "FROM bankid_orders WHERE order_ref = ?",
+                    (order_ref,),
+                ).fetchone()
+                order = None if row is None else StoredOrder(*row)
+        if order is None or order.expires <= self._clock():
+            return None
+        return order
+
+    def delete(self, order_ref: str) -> None:
+        self._buffer(order_ref, None)
+
+    def evict_expired(self) -> int:
+        self.flush()
+        now = self._clock()
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM bankid_orders WHERE expires <= ?", (now,))
+            self._next_sweep = now + self.ttl
+        return cursor.rowcount
+
+    def flush(self) -> None:
+        """Commit all buffered writes."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._pending:
+                return
+            inserts: List[StoredOrder] = [o for o in self._pending.values() if o is not None]
+            deletes = [(order_ref,) for order_ref, o in self._pending.items() if o is None]
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany("INSERT OR REPLACE INTO bankid_orders VALUES (?, ?, ?, ?, ?, ?)", inserts)
+                self._conn.executemany("DELETE FROM bankid_orders WHERE order_ref = ?", deletes)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            self._pending.clear()
+
+    def close(self) -> None:
+        """Commit buffered writes and close the database connection."""
+        with self._lock:
+            self.flush()
+            self._conn.close()
+
+    def _buffer(self, order_ref: str, order: Union[StoredOrder, None]) -> None:
+        with self._lock:
+            self._pending[order_ref] = order
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if self._clock() >= self._next_sweep:
+            self.evict_expired()
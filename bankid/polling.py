@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+:mod:`bankid.polling` -- Adaptive collect cadence
+=================================================
+
+The BankID integration guide says that ``collect`` should be called every two seconds and
+must not be called more often than once per second. An :py:class:`AdaptivePollingPolicy`
+chooses the interval within these bounds from the latest ``hintCode`` and the age of the order:
+faster while the user is signing, slower while the order waits for the user to start the app.
+
+It can be used by any loop calling ``collect``:
+
+.. code-block:: python
+
+    policy = AdaptivePollingPolicy()
+    started = time.monotonic()
+    while True:
+        response = client.collect(order_ref)
+        if response["status"] != "pending":
+            break
+        time.sleep(policy.next_interval(response.get("hintCode"), time.monotonic() - started))
+
+    print(policy.calls_saved)
+
+It is also accepted by :py:class:`bankid.watcher.OrderWatcher`.
+
+"""
+
+import threading
+from typing import Dict, Mapping, Union
+
+#: Seconds between collect calls per ``hintCode``, before any slowdown for the order's age.
+DEFAULT_INTERVALS: Dict[str, float] = {
+    # The user is in the app, about to finish: collect often to report completion quickly.
+    "userSign": 1.0,
+    "userMrtd": 1.5,
+    "userCallConfirm": 1.5,
+    "started": 1.5,
+    # Waiting for the user to start the app, which becomes less likely to happen soon as time goes by.
+    "outstandingTransaction": 2.0,
+    "noClient": 2.0,
+}
+
+#: The ``hintCode`` values whose interval grows with the age of the order.
+WAITING_HINT_CODES = frozenset(("outstandingTransaction", "noClient"))
+
+
+class AdaptivePollingPolicy:
+    """Chooses the time until the next ``collect`` call of a pending order.
+
+    The interval for a ``hintCode`` is looked up in ``intervals``, falling back to ``base_interval``.
+    For the hint codes in :py:data:`WAITING_HINT_CODES` it then grows linearly with the age of the
+    order once it is ``slowdown_after`` seconds old, being multiplied by ``age / slowdown_after``,
+    i.e. twice as long at twice ``slowdown_after``, three times at three times and so on. All
+    intervals are kept within ``min_interval`` and ``max_interval``.
+
+    The policy counts the calls it led to and the calls a fixed ``base_interval`` would have made
+    during the same time, see :py:attr:`calls_saved`. It is thread safe and can be shared by all
+    pollers.
+
+    :param base_interval: Seconds between calls for unknown hint codes, and the baseline to count
+        saved calls against.
+    :type base_interval: float
+    :param min_interval: Least number of seconds between calls, at least 1.
+    :type min_interval: float
+    :param max_interval: Greatest number of seconds between calls.
+    :type max_interval: float
+    :param intervals: Seconds between calls per ``hintCode``, by default :py:data:`DEFAULT_INTERVALS`.
+    :type intervals: dict
+    :param slowdown_after: Age in seconds after which waiting orders are collected less often.
+    :type slowdown_after: float
+
+    """
+
+    def __init__(
+        self,
+        base_interval: float = 2.0,
+        min_interval: float = 1.0,
+        max_interval: float = 5.0,
+        intervals: Union[Mapping[str, float], None] = None,
+        slowdown_after: float = 30.0,
+    ):
+        if min_interval < 1.0:
+            raise ValueError("BankID must not be collected more often than once per second")
+        if not min_interval <= base_interval <= max_interval:
+            raise ValueError("base_interval must be between min_interval and max_interval")
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.intervals = dict(DEFAULT_INTERVALS if intervals is None else intervals)
+        self.slowdown_after = slowdown_after
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._baseline_calls = 0.0
+
+    def interval(self, hint_code: Union[str, None], age: float) -> float:
+        """The seconds to wait before the next collect of an order ``age`` seconds old, pending with ``hint_code``."""
+        interval = self.intervals.get(hint_code or "", self.base_interval)
+        if hint_code in WAITING_HINT_CODES and self.slowdown_after > 0 and age > self.slowdown_after:
+            interval *= age / self.slowdown_after
+        return min(self.max_interval, max(self.min_interval, interval))
+
+    def next_interval(self, hint_code: Union[str, None], age: float) -> float:
+        """Same as :py:meth:`interval`, also counting the call that will be made after it."""
+        interval = self.interval(hint_code, age)
+        with self._lock:
+            self._calls += 1
+            self._baseline_calls += interval / self.base_interval
+        return interval
+
+    @property
+    def calls(self) -> int:
+        """Number of intervals handed out, i.e. collect calls scheduled."""
+        return self._calls
+
+    @property
+    def calls_saved(self) -> float:
+        """Collect calls avoided compared to calling every ``base_interval`` seconds. Negative if more were made."""
+        return self._baseline_calls - self._calls
+
+    def reset(self) -> None:
+        """Reset the call counts."""
+        with self._lock:
+            self._calls = 0
+            self._baseline_calls = 0.0
@@ -1,9 +1,14 @@
-from typing import Union
+from typing import Any, Callable, Dict, List, Sequence, Tuple, Union
 
 import hashlib
 import hmac
+import re
+import struct
+import threading
 import time
+import zlib
 from datetime import datetime
+from functools import lru_cache
 from math import floor
 
 
@@ -20,3 +25,551 @@ def generate_qr_code_content(qr_start_token: str, start_t: Union[float, datetime
         digestmod=hashlib.sha256,
     ).hexdigest()
     return f"bankid.{qr_start_token}.{elapsed_seconds_since_call}.{qr_auth_code}"
+
+
+class _QRFrame:
+    """The QR state of one order: a prepared HMAC and the content for the latest second."""
+
+    __slots__ = ("qr_start_secret", "start_t", "mac", "prefix", "second", "content", "expires")
+
+    def __init__(self, qr_start_token: str, start_t: float, qr_start_secret: str):
+        self.qr_start_secret = qr_start_secret
+        self.start_t = start_t
+        self.mac: Any = hmac.new(qr_start_secret.encode(), digestmod=hashlib.sha256)
+        self.prefix = f"bankid.{qr_start_token}."
+        self.second = -1
+        self.content = ""
+        self.expires = 0.0
+
+
+class QRCodeContentCache:
+    """Cache of QR code content per order, computing each second's content only once.
+
+    Repeated calls for the same order within the same second, e.g. from several browser tabs
+    polling the same order, return the cached content. The HMAC key is prepared once per order.
+    Orders not asked for during ``ttl`` seconds are evicted. The cache is thread safe, and
+    can be shared by the request handlers of a threaded server.
+
+    .. code-block:: python
+
+        qr_cache = QRCodeContentCache()
+        content = qr_cache.get(resp["qrStartToken"], start_t, resp["qrStartSecret"])
+
+    :param ttl: Seconds after the last lookup of an order that it is evicted.
+    :type ttl: float
+    :param clock: Time source, defaults to :py:func:`time.time`.
+
+    """
+
+    def __init__(self, ttl: float = 60.0, clock: Callable[[], float] = time.time):
+        self.ttl = ttl
+        self._clock = clock
+        self._frames: Dict[str, _QRFrame] = {}
+        self._next_sweep = 0.0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def __contains__(self, qr_start_token: object) -> bool:
+        return qr_start_token in self._frames
+
+    def get(self, qr_start_token: str, start_t: Union[float, datetime], qr_start_secret: str) -> str:
+        """Get the current QR code content, same as :py:func:`generate_qr_code_content`."""
+        now = self._clock()
+        with self._lock:
+            frame = self._frames.get(qr_start_token)
+            if frame is None or frame.qr_start_secret != qr_start_secret:
+                if now >= self._next_sweep:
+                    self._evict_expired(now)
+                if isinstance(start_t, datetime):
+                    start_t = start_t.timestamp()
+                frame = self._frames[qr_start_token] = _QRFrame(qr_start_token, start_t, qr_start_secret)
+
+            second = int(floor(now - frame.start_t))
+            if second != frame.second:
+                second_str = str(second)
+                mac = frame.mac.copy()
+                mac.update(second_str.encode())
+                frame.content = frame.prefix + second_str + "." + mac.hexdigest()
+                frame.second = second
+            frame.expires = now + self.ttl
+            return frame.content
+
+    def discard(self, qr_start_token: str) -> None:
+        """Remove an order, e.g. when it is no longer pending."""
+        with self._lock:
+            self._frames.pop(qr_start_token, None)
+
+    def evict_expired(self, now: Union[float, None] = None) -> None:
+        now = self._clock() if now is None else now
+        with self._lock:
+            self._evict_expired(now)
+
+    def _evict_expired(self, now: float) -> None:
+        for token in [t for t, f in self._frames.items() if f.expires <= now]:
+            del self._frames[token]
+        self._next_sweep = now + self.ttl
+
+
+# QR code rendering, following ISO/IEC 18004. Only byte mode is needed for BankID QR content.
+
+_ERROR_CORRECTION_LEVELS = {"L": 0, "M": 1, "Q": 2, "H": 3}
+_FORMAT_BITS = {"L": 1, "M": 0, "Q": 3, "H": 2}
+
+# Number of error correction codewords per block, indexed by level and then version (index 0 unused).
+_ECC_CODEWORDS_PER_BLOCK = (
+    (-1, 7, 10, 15, 20, 26, 18, 20, 24, 30, 18, 20, 24, 26, 30, 22, 24, 28, 30, 28, 28, 28, 28, 30, 30, 26, 28, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),  # noqa: E501
+    (-1, 10, 16, 26, 18, 24, 16, 18, 22, 22, 26, 30, 22, 22, 24, 24, 28, 28, 26, 26, 26, 26, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28),  # noqa: E501
+    (-1, 13, 22, 18, 26, 18, 24, 18, 22, 20, 24, 28, 26, 24, 20, 30, 24, 28, 28, 26, 30, 28, 30, 30, 30, 30, 28, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),  # noqa: E501
+    (-1, 17, 28, 22, 16, 22, 28, 26, 26, 24, 28, 24, 28, 22, 24, 24, 30, 28, 28, 26, 28, 30, 24, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),  # noqa: E501
+)
+# Number of error correction blocks, indexed by level and then version (index 0 unused).
+_NUM_ERROR_CORRECTION_BLOCKS = (
+    (-1, 1, 1, 1, 1, 1, 2, 2, 2, 2, 4, 4, 4, 4, 4, 6, 6, 6, 6, 7, 8, 8, 9, 9, 10, 12, 12, 12, 13, 14, 15, 16, 17, 18, 19, 19, 20, 21, 22, 24, 25),  # noqa: E501
+    (-1, 1, 1, 1, 2, 2, 4, 4, 4, 5, 5, 5, 8, 9, 9, 10, 10, 11, 13, 14, 16, 17, 17, 18, 20, 21, 23, 25, 26, 28, 29, 31, 33, 35, 37, 38, 40, 43, 45, 47, 49),  # noqa: E501
+    (-1, 1, 1, 2, 2, 4, 4, 6, 6, 8, 8, 8, 10, 12, 16, 12, 17, 16, 18, 21, 20, 23, 23, 25, 27, 29, 34, 34, 35, 38, 40, 43, 45, 48, 51, 53, 56, 59, 62, 65, 68),  # noqa: E501
+    (-1, 1, 1, 2, 4, 4, 4, 5, 6, 8, 8, 11, 11, 16, 16, 18, 16, 19, 21, 25, 25, 25, 34, 30, 32, 35, 37, 40, 42, 45, 48, 51, 54, 57, 60, 63, 66, 70, 74, 77, 81),  # noqa: E501
+)
+
+_MASKS: Tuple[Callable[[int, int], bool], ...] = (
+    lambda x, y: (x + y) % 2 == 0,
+    lambda x, y: y % 2 == 0,
+    lambda x, y: x % 3 == 0,
+    lambda x, y: (x + y) % 3 == 0,
+    lambda x, y: (x // 3 + y // 2) % 2 == 0,
+    lambda x, y: x * y % 2 + x * y % 3 == 0,
+    lambda x, y: (x * y % 2 + x * y % 3) % 2 == 0,
+    lambda x, y: ((x + y) % 2 + x * y % 3) % 2 == 0,
+)
+
+
+def _gf_tables() -> Tuple[List[int], List[int]]:
+    exp, log = [0] * 512, [0] * 256
+    x = 1
+    for i in range(255):
+        exp[i] = x
+        log[x] = i
+        x <<= 1
+        if x & 0x100:
+            x ^= 0x11D
+    for i in range(255, 512):
+        exp[i] = exp[i - 255]
+    return exp, log
+
+
+_GF_EXP, _GF_LOG = _gf_tables()
+
+
+def _gf_multiply(x: int, y: int) -> int:
+    if x == 0 or y == 0:
+        return 0
+    return _GF_EXP[_GF_LOG[x] + _GF_LOG[y]]
+
+
+@lru_cache(maxsize=None)
+def _reed_solomon_divisor(degree: int) -> Tuple[int, ...]:
+    result = [0] * (degree - 1) + [1]
+    root = 1
+    for _ in range(degree):
+        for j in range(degree):
+            result[j] = _gf_multiply(result[j], root)
+            if j + 1 < degree:
+                result[j] ^= result[j + 1]
+        root = _gf_multiply(root, 0x02)
+    return tuple(result)
+
+
+def _reed_solomon_remainder(data: Sequence[int], divisor: Sequence[int]) -> List[int]:
+    exp, log = _GF_EXP, _GF_LOG
+    log_divisor = [log[coef] if coef else -1 for coef in divisor]
+    result = [0] * len(divisor)
+    for b in data:
+        factor = b ^ result.pop(0)
+        result.append(0)
+        if factor:
+            log_factor = log[factor]
+            for i, log_coef in enumerate(log_divisor):
+                if log_coef >= 0:
+                    result[i] ^= exp[log_coef + log_factor]
+    return result
+
+
+def _num_raw_data_modules(version: int) -> int:
+    result = (16 * version + 128) * version + 64
+    if version >= 2:
+        num_align = version // 7 + 2
+        result -= (25 * num_align - 10) * num_align - 55
+        if version >= 7:
+            result -= 36
+    return result
+
+
+def _num_data_codewords(version: int, ecl: str) -> int:
+    level = _ERROR_CORRECTION_LEVELS[ecl]
+    return (
+        _num_raw_data_modules(version) // 8
+        - _ECC_CODEWORDS_PER_BLOCK[level][version] * _NUM_ERROR_CORRECTION_BLOCKS[level][version]
+    )
+
+
+def _byte_mode_capacity(version: int, ecl: str) -> int:
+    """The maximum number of bytes that fit in a byte mode segment of the given version."""
+    return (_num_data_codewords(version, ecl) * 8 - 4 - (8 if version < 10 else 16)) // 8
+
+
+class _QRLayout:
+    """Everything about a QR code symbol that does not depend on its content.
+
+    Built once per version and error correction level and then reused for every frame:
+    the function patterns, the order in which data bits are placed and the mask patterns
+    over the data modules.
+    """
+
+    def __init__(self, version: int, ecl: str):
+        self.version = version
+        self.ecl = ecl
+        self.size = size = version * 4 + 17
+        self.modules = [[False] * size for _ in range(size)]
+        self.is_function = [[False] * size for _ in range(size)]
+
+        for i in range(size):
+            self._set_function(6, i, i % 2 == 0)
+            self._set_function(i, 6, i % 2 == 0)
+        for x, y in ((3, 3), (size - 4, 3), (3, size - 4)):
+            for dy in range(-4, 5):
+                for dx in range(-4, 5):
+                    if 0 <= x + dx < size and 0 <= y + dy < size:
+                        self._set_function(x + dx, y + dy, max(abs(dx), abs(dy)) not in (2, 4))
+        positions = self._alignment_positions()
+        last = len(positions) - 1
+        for i, x in enumerate(positions):
+            for j, y in enumerate(positions):
+                if (i, j) in ((0, 0), (0, last), (last, 0)):
+                    continue
+                for dy in range(-2, 3):
+                    for dx in range(-2, 3):
+                        self._set_function(x + dx, y + dy, max(abs(dx), abs(dy)) != 1)
+        # Reserve the format information areas, drawn per mask in format_modules.
+        self.format_modules = [self._format_modules(mask) for mask in range(8)]
+        for x, y, dark in self.format_modules[0]:
+            self._set_function(x, y, dark)
+        self._draw_version()
+
+        self.data_modules = self._data_module_order()
+        self.mask_patterns = [[mask(x, y) for x, y in self.data_modules] for mask in _MASKS]
+
+    def _set_function(self, x: int, y: int, dark: bool) -> None:
+        self.modules[y][x] = dark
+        self.is_function[y][x] = True
+
+    def _alignment_positions(self) -> List[int]:
+        if self.version == 1:
+            return []
+        num_align = self.version // 7 + 2
+        step = (self.version * 8 + num_align * 3 + 5) // (num_align * 4 - 4) * 2
+        return [6] + sorted(self.size - 7 - i * step for i in range(num_align - 1))
+
+    def _format_modules(self, mask: int) -> List[Tuple[int, int, bool]]:
+        data = _FORMAT_BITS[self.ecl] << 3 | mask
+        rem = data
+        for _ in range(10):
+            rem = (rem << 1) ^ ((rem >> 9) * 0x537)
+        bits = (data << 10 | rem) ^ 0x5412
+        size = self.size
+        out = []
+        for i in range(15):
+            dark = (bits >> i) & 1 != 0
+            # First copy, around the top left finder pattern.
+            if i < 6:
+                out.append((8, i, dark))
+            elif i < 8:
+                out.append((8, i + 1, dark))
+            elif i == 8:
+                out.append((7, 8, dark))
+            else:
+                out.append((14 - i, 8, dark))
+            # Second copy, split between the top right and bottom left finder patterns.
+            if i < 8:
+                out.append((size - 1 - i, 8, dark))
+            else:
+                out.append((8, size - 15 + i, dark))
+        out.append((8, size - 8, True))
+        return out
+
+    def _draw_version(self) -> None:
+        if self.version < 7:
+            return
+        rem = self.version
+        for _ in range(12):
+            rem = (rem << 1) ^ ((rem >> 11) * 0x1F25)
+        bits = self.version << 12 | rem
+        for i in range(18):
+            dark = (bits >> i) & 1 != 0
+            a, b = self.size - 11 + i % 3, i // 3
+            self._set_function(a, b, dark)
+            self._set_function(b, a, dark)
+
+    def _data_module_order(self) -> List[Tuple[int, int]]:
+        order = []
+        right = self.size - 1
+        while right >= 1:
+            if right == 6:
+                right = 5
+            upward = (right + 1) & 2 == 0
+            for vert in range(self.size):
+                y = self.size - 1 - vert if upward else vert
+                for x in (right, right - 1):
+                    if not self.is_function[y][x]:
+                        order.append((x, y))
+            right -= 2
+        return order
+
+    def codewords(self, data: bytes) -> List[int]:
+        """Encode ``data`` in one byte mode segment and return the interleaved data and error correction codewords."""
+        version, level = self.version, _ERROR_CORRECTION_LEVELS[self.ecl]
+        capacity = _num_data_codewords(version, self.ecl)
+        count_bits = 8 if version < 10 else 16
+        # Mode indicator, character count and data, followed by up to four terminator bits.
+        buffer = (0b0100 << count_bits | len(data)) << (8 * len(data)) | int.from_bytes(data, "big")
+        nbits = 4 + count_bits + 8 * len(data)
+        if nbits > capacity * 8:
+            raise ValueError("Data too long for QR code version {0}-{1}".format(version, self.ecl))
+        terminator = min(4, capacity * 8 - nbits)
+        buffer <<= terminator
+        nbits += terminator
+        buffer <<= -nbits % 8
+        nbits += -nbits % 8
+        codewords = list(buffer.to_bytes(nbits // 8, "big"))
+        pad = 0xEC
+        while len(codewords) < capacity:
+            codewords.append(pad)
+            pad ^= 0xEC ^ 0x11
+
+        num_blocks = _NUM_ERROR_CORRECTION_BLOCKS[level][version]
+        block_ecc_len = _ECC_CODEWORDS_PER_BLOCK[level][version]
+        raw_codewords = _num_raw_data_modules(version) // 8
+        num_short_blocks = num_blocks - raw_codewords % num_blocks
+        short_block_len = raw_codewords // num_blocks
+        divisor = _reed_solomon_divisor(block_ecc_len)
+        blocks = []
+        k = 0
+        for i in range(num_blocks):
+            length = short_block_len - block_ecc_len + (0 if i < num_short_blocks else 1)
+            block = codewords[k:k + length]
+            k += length
+            ecc = _reed_solomon_remainder(block, divisor)
+            if i < num_short_blocks:
+                block.append(0)
+            blocks.append(block + ecc)
+
+        result = []
+        for i in range(len(blocks[0])):
+            for j, block in enumerate(blocks):
+                if i != short_block_len - block_ecc_len or j >= num_short_blocks:
+                    result.append(block[i])
+        return result
+
+    def matrix(self, data: bytes, mask: Union[int, None] = None) -> List[List[bool]]:
+        """Build the module matrix for ``data``, using the given mask or the one with the lowest penalty."""
+        codewords = self.codewords(data)
+        bits = [(codewords[i >> 3] >> (7 - (i & 7))) & 1 != 0 for i in range(len(codewords) * 8)]
+        bits.extend([False] * (len(self.data_modules) - len(bits)))
+        best: Union[List[List[bool]], None] = None
+        best_penalty = 0
+        for m in range(8) if mask is None else (mask,):
+            modules = [row[:] for row in self.modules]
+            for (x, y), bit, flip in zip(self.data_modules, bits, self.mask_patterns[m]):
+                modules[y][x] = bit != flip
+            for x, y, dark in self.format_modules[m]:
+                modules[y][x] = dark
+            if mask is not None:
+                return modules
+            penalty = _penalty_score(modules)
+            if best is None or penalty < best_penalty:
+                best, best_penalty = modules, penalty
+        assert best is not None
+        return best
+
+
+_RUN_OF_FIVE_OR_MORE = re.compile(r"0{5,}|1{5,}")
+
+
+def _penalty_score(modules: List[List[bool]]) -> int:
+    """Mask penalty score per ISO/IEC 18004 section 7.8.3, evaluated with string and integer operations."""
+    size = len(modules)
+    rows = ["".join("1" if dark else "0" for dark in row) for row in modules]
+    columns = ["".join(col) for col in zip(*rows)]
+    result = 0
+    for line in rows + columns:
+        for run in _RUN_OF_FIVE_OR_MORE.findall(line):
+            result += len(run) - 2
+        result += 40 * (_count_overlapping(line, "10111010000") + _count_overlapping(line, "00001011101"))
+
+    pairs = (1 << (size - 1)) - 1
+    as_ints = [int(row, 2) for row in rows]
+    for upper, lower in zip(as_ints, as_ints[1:]):
+        equal_horizontally = ~(upper ^ (upper >> 1)) & ~(lower ^ (lower >> 1)) & pairs
+        equal_vertically = ~(upper ^ lower) & pairs
+        result += 3 * bin(equal_horizontally & equal_vertically).count("1")
+
+    dark = sum(row.count("1") for row in rows)
+    total = size * size
+    result += ((abs(dark * 20 - total * 10) + total - 1) // total - 1) * 10
+    return result
+
+
+def _count_overlapping(line: str, pattern: str) -> int:
+    count = 0
+    i = line.find(pattern)
+    while i >= 0:
+        count += 1
+        i = line.find(pattern, i + 1)
+    return count
+
+
+@lru_cache(maxsize=None)
+def _layout(version: int, ecl: str) -> _QRLayout:
+    return _QRLayout(version, ecl)
+
+
+def qr_code_matrix(content: str, error_correction: str = "L", mask: Union[int, None] = None) -> List[List[bool]]:
+    """Encode ``content`` as a QR code and return its module matrix, without quiet zone.
+
+    ``matrix[y][x]`` is ``True`` for dark modules. The smallest version fitting the content is used.
+
+    :param content: The content to encode, e.g. from :py:func:`generate_qr_code_content`.
+    :type content: str
+    :param error_correction: Error correction level, one of ``"L"``, ``"M"``, ``"Q"`` and ``"H"``.
+    :type error_correction: str
+    :param mask: Mask pattern 0-7 to use. If not given, the mask with the lowest penalty score is used.
+    :type mask: int
+    :return: The module matrix.
+    :rtype: list
+
+    """
+    if error_correction not in _ERROR_CORRECTION_LEVELS:
+        raise ValueError("error_correction must be one of 'L', 'M', 'Q' and 'H'")
+    data = content.encode("utf-8")
+    for version in range(1, 41):
+        if len(data) <= _byte_mode_capacity(version, error_correction):
+            return _layout(version, error_correction).matrix(data, mask)
+    raise ValueError("Content too long for a QR code")
+
+
+def qr_code_svg(matrix: List[List[bool]], border: int = 4) -> str:
+    """Render a module matrix as an SVG image, one unit per module and with ``border`` modules of quiet zone."""
+    size = len(matrix) + 2 * border
+    path = "".join(
+        "M{0},{1}h1v1h-1z".format(x + border, y + border)
+        for y, row in enumerate(matrix)
+        for x, dark in enumerate(row)
+        if dark
+    )
+    return (
+        '<svg xmlns="http://www.w3.org/2000/svg" version="1.1" viewBox="0 0 {0} {0}" shape-rendering="crispEdges">'
+        '<rect width="100%" height="100%" fill="#FFFFFF"/><path d="{1}" fill="#000000"/></svg>'
+    ).format(size, path)
+
+
+def qr_code_png(matrix: List[List[bool]], scale: int = 8, border: int = 4) -> bytes:
+    """Render a module matrix as a grayscale PNG image with ``scale`` pixels per module."""
+    size = (len(matrix) + 2 * border) * scale
+    quiet = b"\xff" * (border * scale)
+    blank_row = b"\x00" + b"\xff" * size
+    rows = [blank_row] * (border * scale)
+    for row in matrix:
+        line = b"\x00" + quiet + b"".join(b"\x00" * scale if dark else b"\xff" * scale for dark in row) + quiet
+        rows.extend([line] * scale)
+    rows.extend([blank_row] * (border * scale))
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 0, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(b"".join(rows), 9))
+        + chunk(b"IEND", b"")
+    )
+
+
+class QRCodeRenderer:
+    """Renders QR code images for BankID orders, caching the latest rendered frame per order.
+
+    The QR content only changes once per second, so each order's image is rendered at most
+    once per second and format, however many browser polls ask for it. Orders not asked for
+    during ``ttl`` seconds are evicted. The renderer is thread safe.
+
+    .. code-block:: python
+
+        renderer = QRCodeRenderer()
+        svg = renderer.svg(resp["qrStartToken"], start_t, resp["qrStartSecret"])
+
+    :param error_correction: Error correction level, one of ``"L"``, ``"M"``, ``"Q"`` and ``"H"``.
+    :type error_correction: str
+    :param border: Width of the quiet zone in modules.
+    :type border: int
+    :param scale: Pixels per module in PNG images.
+    :type scale: int
+    :param mask: Fixed mask pattern 0-7, or ``None`` for the lowest penalty one.
+    :type mask: int
+    :param ttl: Seconds after the last lookup of an order that it is evicted.
+    :type ttl: float
+    :param clock: Time source, defaults to :py:func:`time.time`.
+
+    """
+
+    def __init__(
+        self,
+        error_correction: str = "L",
+        border: int = 4,
+        scale: int = 8,
+        mask: Union[int, None] = None,
+        ttl: float = 60.0,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.error_correction = error_correction
+        self.border = border
+        self.scale = scale
+        self.mask = mask
+        self.content_cache = QRCodeContentCache(ttl=ttl, clock=clock)
+        self._rendered: Dict[Tuple[str, str], Tuple[str, Any]] = {}
+        self._clock = clock
+        self._next_prune = 0.0
+        self._lock = threading.Lock()
+
+    def _render(self, kind: str, qr_start_token: str, start_t: Union[float, datetime], qr_start_secret: str) -> Any:
+        content = self.content_cache.get(qr_start_token, start_t, qr_start_secret)
+        with self._lock:
+            cached = self._rendered.get((qr_start_token, kind))
+            if cached is not None and cached[0] is content:
+                return cached[1]
+            now = self._clock()
+            if now >= self._next_prune:
+                # Drop the images of orders evicted from the content cache.
+                self._rendered = {k: v for k, v in self._rendered.items() if k[0] in self.content_cache}
+                self._next_prune = now + self.content_cache.ttl
+        # Rendered without the lock; two threads rendering the same frame both get a correct image.
+        matrix = qr_code_matrix(content, self.error_correction, self.mask)
+        if kind == "matrix":
+            out: Any = matrix
+        elif kind == "svg":
+            out = qr_code_svg(matrix, self.border)
+        else:
+            out = qr_code_png(matrix, self.scale, self.border)
+        with self._lock:
+            self._rendered[(qr_start_token, kind)] = (content, out)
+        return out
+
+    def matrix(self, qr_start_token: str, start_t: Union[float, datetime], qr_start_secret: str) -> List[List[bool]]:
+        """The current module matrix for the order. The returned lists must not be modified."""
+        return self._render("matrix", qr_start_token, start_t, qr_start_secret)  # type: ignore[no-any-return]
+
+    def svg(self, qr_start_token: str, start_t: Union[float, datetime], qr_start_secret: str) -> str:
+        """The current QR code for the order as an SVG image."""
+        return self._render("svg", qr_start_token, start_t, qr_start_secret)  # type: ignore[no-any-return]
+
+    def png(self, qr_start_token: str, start_t: Union[float, datetime], qr_start_secret: str) -> bytes:
+        """The current QR code for the order as a PNG image."""
+        return self._render("png", qr_start_token, start_t, qr_start_secret)  # type: ignore[no-any-return]
@@ -0,0 +1,406 @@
+# -*- coding: utf-8 -*-
+"""
+:mod:`bankid.resilience` -- Retries and circuit breaking
+========================================================
+
+Wrappers around the BankID clients that retry ``collect`` and ``cancel`` calls failing with
+errors that BankID may recover from, and stop sending requests for a while when BankID keeps
+failing, instead of letting requests stack up on a degraded or maintained service.
+
+.. code-block:: python
+
+    client = ResilientAsyncClient(BankIDAsyncClient(certificates=(cert, key)))
+    order = await client.authenticate(end_user_ip)
+    status = await client.collect(order["orderRef"])
+
+Order initiating calls, e.g. ``authenticate`` and ``sign``, are never retried, since the BankID
+integration guide does not allow RP to automatically try them again, but they are subject
+to the circuit breaker. :py:class:`~bankid.exceptions.InvalidParametersError`,
+:py:class:`~bankid.exceptions.AlreadyInProgressError` and other errors caused by the request
+itself are never retried.
+
+"""
+
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, Tuple, Type, Union
+
+import httpx
+
+from bankid.asyncclient import BankIDAsyncClient
+from bankid.exceptions import (
+    AlreadyInProgressError,
+    BankIDError,
+    CircuitOpenError,
+    InternalError,
+    InvalidParametersError,
+    MaintenanceError,
+    RequestTimeoutError,
+)
+from bankid.responses import CollectResponse
+from bankid.syncclient import BankIDClient
+
+_LOG = getLogger(__name__)
+
+#: Errors indicating that BankID, or the connection to it, is failing rather than the request.
+UPSTREAM_ERRORS: Tuple[Type[BaseException], ...] = (
+    InternalError,
+    MaintenanceError,
+    RequestTimeoutError,
+    httpx.TransportError,
+)
+
+
+class RetryPolicy:
+    """When and how long to wait before retrying a failed call.
+
+    The wait before retry ``n`` (from 0) is drawn uniformly between 0 and
+    ``min(max_delay, base_delay * 2 ** n)`` seconds, so that many clients failing at the same
+    time do not retry at the same time. :py:class:`~bankid.exceptions.InvalidParametersError` and
+    :py:class:`~bankid.exceptions.AlreadyInProgressError` are never retried, whatever ``retry_on`` is.
+
+    :param max_attempts: Maximum number of calls, including the first one.
+    :type max_attempts: int
+    :param base_delay: Upper bound of the first wait in seconds.
+    :type base_delay: float
+    :param max_delay: Upper bound of any wait in seconds.
+    :type max_delay: float
+    :param retry_on: Exception classes to retry, by default :py:data:`UPSTREAM_ERRORS`.
+    :type retry_on: tuple
+
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 0.25,
+        max_delay: float = 4.0,
+        retry_on: Tuple[Type[BaseException], ...] = UPSTREAM_ERRORS,
+        rng: Union[random.Random, None] = None,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_on = retry_on
+        self._rng = rng or random.Random()
+
+    def should_retry(self, error: BaseException, attempt: int) -> bool:
+        """Whether to retry after call number ``attempt`` (from 0) raised ``error``."""
+        if isinstance(error, (InvalidParametersError, AlreadyInProgressError)):
+            return False
+        return attempt + 1 < self.max_attempts and isinstance(error, self.retry_on)
+
+    def delay(self, attempt: int) -> float:
+        """Seconds to wait before retrying after call number ``attempt`` (from 0) failed."""
+        return self._rng.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+
+class CircuitBreaker:
+    """Stops calls to BankID while the rate of upstream errors is too high.
+
+    The breaker is *closed* while the share of calls during the last ``window`` seconds that
+    failed with one of :py:data:`UPSTREAM_ERRORS` is below ``failure_threshold``, or fewer than
+    ``min_calls`` calls were made. Otherwise it *opens*, and calls fail at once with
+    :py:class:`~bankid.exceptions.CircuitOpenError` during ``reset_timeout`` seconds. It is then
+    *half open* and lets one call through: the breaker closes if it succeeds and opens again
+    if it fails.
+
+    The breaker is thread safe and can be shared by several clients.
+
+    :param failure_threshold: Share of failed calls, between 0 and 1, that opens the breaker.
+    :type failure_threshold: float
+    :param min_calls: Minimum number of calls in the window before the breaker can open.
+    :type min_calls: int
+    :param window: Seconds of call history to compute the failure share from.
+    :type window: float
+    :param reset_timeout: Seconds the breaker stays open.
+    :type reset_timeout: float
+    :param clock: Time source, defaults to :py:func:`time.monotonic`.
+
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: float = 0.5,
+        min_calls: int = 20,
+        window: float = 10.0,
+        reset_timeout: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_threshold = failure_threshold
+        self.min_calls = min_calls
+        self.window = window
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._calls: Deque[Tuple[float, bool]] = deque()
+        self._failures = 0
+        self._opened_at: Union[float, None] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state(self._clock())
+
+    def _state(self, now: float) -> str:
+        if self._opened_at is None:
+            return self.CLOSED
+        if now - self._opened_at < self.reset_timeout:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def before_call(self) -> None:
+        """Raise :py:class:`~bankid.exceptions.CircuitOpenError` if a call may not be made now."""
+        with self._lock:
+            now = self._clock()
+            state = self._state(now)
+            if state == self.CLOSED:
+                return
+            if state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+            retry_after = max(0.0, (self._opened_at or now) + self.reset_timeout - now)
+        raise CircuitOpenError("BankID is failing, not calling it for {0:.1f} s".format(retry_after), retry_after=retry_after)
+
+    def record(self, error: Union[BaseException, None]) -> None:
+        """Record the outcome of a call that :py:meth:`before_call` allowed."""
+        failed = isinstance(error, UPSTREAM_ERRORS)
+        with self._lock:
+            now = self._clock()
+            if self._probing:
+                self._probing = False
+                if failed:
+                    self._open(now)
+                else:
+                    self._opened_at = None
+                    self._calls.clear()
+                    self._failures = 0
+                return
+
+            self._calls.append((now, failed))
+            self._failures += failed
+            while self._calls and self._calls[0][0] <= now - self.window:
+                self._failures -= self._calls.popleft()[1]
+            if (
+                self._opened_at is None
+                and len(self._calls) >= self.min_calls
+                and self._failures >= self.failure_threshold * len(self._calls)
+            ):
+                self._open(now)
+
+    def release(self) -> None:
+        """Forget a call that :py:meth:`before_call` allowed but whose outcome is unknown, e.g. as it was cancelled."""
+        with self._lock:
+            self._probing = False
+
+    def _open(self, now: float) -> None:
+        _LOG.warning("Opening BankID circuit breaker for %.1f s", self.reset_timeout)
+        self._opened_at = now
+        self._calls.clear()
+        self._failures = 0
+
+
+class _ResilientBase:
+    """The breaker and retry decisions shared by :py:class:`ResilientClient` and :py:class:`ResilientAsyncClient`.
+
+    Subclasses only make the call and wait before retrying, in their own way.
+    """
+
+    _retried = ("collect", "cancel")
+    _guarded = (
+        "authenticate",
+        "phone_authenticate",
+        "sign",
+        "phone_sign",
+        "authenticate_with_template",
+        "sign_with_template",
+    )
+
+    def __init__(
+        self,
+        client: Any,
+        retry: Union[RetryPolicy, None] = None,
+        breaker: Union[CircuitBreaker, None] = None,
+    ):
+        self.client = client
+        self.retry = retry if retry is not None else RetryPolicy()
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        for name in self._retried:
+            setattr(self, name, self._decorate(self._wrap(name, True), name))
+        for name in self._guarded:
+            setattr(self, name, self._decorate(self._wrap(name, False), name))
+
+    def __getattr__(self, name: str) -> Any:
+        # Everything else, e.g. generate_qr_code_content and payload_template, is used as is.
+        return getattr(self.client, name)
+
+    def _wrap(self, name: str, retry: bool) -> Callable[..., Any]:
+        raise NotImplementedError()
+
+    def _decorate(self, call: Callable[..., Any], name: str) -> Callable[..., Any]:
+        call.__name__ = name
+        call.__doc__ = getattr(type(self.client), name).__doc__
+        return call
+
+    def _retry_delay(self, name: str, error: Exception, attempt: int, retry: bool) -> Union[float, None]:
+        """Record the failed call number ``attempt`` and return the seconds to wait before retrying it, or ``None``."""
+        self.breaker.record(error)
+        if not retry or not self.retry.should_retry(error, attempt):
+            return None
+        delay = self.retry.delay(attempt)
+        _LOG.info("Retrying %s in %.2f s after %r", name, delay, error)
+        return delay
+
+
+class ResilientClient(_ResilientBase):
+    """A :py:class:`~bankid.BankIDClient` with retries of ``collect`` and ``cancel`` and a circuit breaker.
+
+    All client methods and attributes are available on the wrapper. :py:meth:`collect_many`
+    collects each order with the wrapper's ``collect``, so that every collect call is retried
+    and guarded by the breaker on its own.
+
+    :param client: The client to wrap.
+    :type client: BankIDClient
+    :param retry: The retry policy, by default :py:class:`RetryPolicy` with its defaults.
+    :type retry: RetryPolicy
+    :param breaker: The circuit breaker, by default :py:class:`CircuitBreaker` with its defaults.
+    :type breaker: CircuitBreaker
+
+    """
+
+    client: BankIDClient
+
+    def __init__(
+        self,
+        client: BankIDClient,
+        retry: Union[RetryPolicy, None] = None,
+        breaker: Union[CircuitBreaker, None] = None,
+    ):
+        super().__init__(client, retry, breaker)
+
+    def _wrap(self, name: str, retry: bool) -> Callable[..., Any]:
+        def call(*args: Any, **kwargs: Any) -> Any:
+            attempt = 0
+            while True:
+                self.breaker.before_call()
+                try:
+                    result = getattr(self.client, name)(*args, **kwargs)
+                except Exception as e:
+                    delay = self._retry_delay(name, e, attempt, retry)
+                    if delay is None:
+                        raise
+                    time.sleep(delay)
+                    attempt += 1
+                except BaseException:
+                    self.breaker.release()
+                    raise
+                else:
+                    self.breaker.record(None)
+                    return result
+
+        return call
+
+    def collect_many(
+        self, order_refs: Iterable[str], concurrency: int = 10
+    ) -> Dict[str, Union[CollectResponse, BankIDError, httpx.HTTPError]]:
+        """Collects several orders concurrently like :py:meth:`bankid.BankIDClient.collect_many`, retrying each one.
+
+        A :py:class:`~bankid.exceptions.CircuitOpenError` is returned for the orders
+        that were not collected since the breaker was open.
+        """
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+
+        def _collect(order_ref: str) -> Union[CollectResponse, BankIDError, httpx.HTTPError]:
+            try:
+                return self.collect(order_ref)  # type: ignore[no-any-return]
+            except (BankIDError, httpx.HTTPError) as e:
+                return e
+
+        refs = list(dict.fromkeys(order_refs))
+        if not refs:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(refs))) as executor:
+            return dict(zip(refs, executor.map(_collect, refs)))
+
+
+class ResilientAsyncClient(_ResilientBase):
+    """A :py:class:`~bankid.BankIDAsyncClient` with retries of ``collect`` and ``cancel`` and a circuit breaker.
+
+    All client methods and attributes are available on the wrapper. :py:meth:`collect_many`
+    collects each order with the wrapper's ``collect``, so that every collect call is retried
+    and guarded by the breaker on its own.
+
+    :param client: The client to wrap.
+    :type client: BankIDAsyncClient
+    :param retry: The retry policy, by default :py:class:`RetryPolicy` with its defaults.
+    :type retry: RetryPolicy
+    :param breaker: The circuit breaker, by default :py:class:`CircuitBreaker` with its defaults.
+    :type breaker: CircuitBreaker
+
+    """
+
+    client: BankIDAsyncClient
+
+    def __init__(
+        self,
+        client: BankIDAsyncClient,
+        retry: Union[RetryPolicy, None] = None,
+        breaker: Union[CircuitBreaker, None] = None,
+    ):
+        super().__init__(client, retry, breaker)
+
+    def _wrap(self, name: str, retry: bool) -> Callable[..., Awaitable[Any]]:
+        async def call(*args: Any, **kwargs: Any) -> Any:
+            attempt = 0
+            while True:
+                self.breaker.before_call()
+                try:
+                    result = await getattr(self.client, name)(*args, **kwargs)
+                except Exception as e:
+                    delay = self._retry_delay(name, e, attempt, retry)
+                    if delay is None:
+                        raise
+                    await asyncio.sleep(delay)
+                    attempt += 1
+                except BaseException:
+                    self.breaker.release()
+                    raise
+                else:
+                    self.breaker.record(None)
+                    return result
+
+        return call
+
+    async def collect_many(
+        self, order_refs: Iterable[str], concurrency: int = 10
+    ) -> Dict[str, Union[CollectResponse, BankIDError, httpx.HTTPError]]:
+        """Collects several orders concurrently like :py:meth:`bankid.BankIDAsyncClient.collect_many`, retrying each one.
+
+        A :py:class:`~bankid.exceptions.CircuitOpenError` is returned for the orders
+        that were not collected since the breaker was open.
+        """
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def _collect(order_ref: str) -> Union[CollectResponse, BankIDError, httpx.HTTPError]:
+            async with semaphore:
+                try:
+                    return await self.collect(order_ref)  # type: ignore[no-any-return]
+                except (BankIDError, httpx.HTTPError) as e:
+                    return e
+
+        refs = list(dict.fromkeys(order_refs))
+        results = await asyncio.gather(*(_collect(order_ref) for order_ref in refs))
+        return dict(zip(refs, results))
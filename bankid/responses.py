@@ -1,3 +1,5 @@
+from typing import Union
+
 from typing_extensions import Literal, NotRequired, TypedDict
 
 class SignResponse(TypedDict):
@@ -65,3 +67,6 @@ class CollectCompleteResponse(_CollectResponse):
 class CollectFailedResponse(_CollectResponse):
     status: Literal["failed"]
     hintCode: str
+
+
+CollectResponse = Union[CollectPendingResponse, CollectCompleteResponse, CollectFailedResponse]
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+:mod:`bankid.structs` -- Typed response objects
+===============================================
+
+Optional objects with ``__slots__`` that BankID responses are decoded into when a client is created
+with ``response_format="struct"``, for applications that prefer attribute access, e.g.
+``response.completionData.user.personalNumber``, over the dicts returned by default. They have the
+same fields as the dicts, described by the TypedDicts in :py:mod:`bankid.responses`.
+
+They are not faster: a response is first decoded into dicts and then copied into the objects,
+which takes about twice as long as decoding into dicts alone, see ``decode.collect_complete_struct``
+in ``benchmarks/baseline.json``. Each object takes less memory than the dict it replaces.
+
+Fields are read as attributes, but the objects also support the read-only parts of the dict
+interface, e.g. ``response["orderRef"]``, ``response.get("hintCode")`` and ``"risk" in response``,
+so that code written for the dict responses keeps working. :py:meth:`to_dict` gives a plain dict.
+The objects can be pickled.
+
+JSON is decoded with `orjson <https://github.com/ijl/orjson>`_ if it is installed.
+
+"""
+
+from typing import Any, ClassVar, Dict, Iterator, List, Mapping, Tuple, Type, TypeVar, Union
+
+try:
+    from orjson import loads as _loads
+except ImportError:  # pragma: no cover
+    from json import loads as _loads  # type: ignore[assignment]
+
+_StructType = TypeVar("_StructType", bound="_Struct")
+
+
+def loads(content: Union[bytes, str]) -> Any:
+    """Decode JSON, with orjson if it is installed."""
+    return _loads(content)
+
+
+class _Struct:
+    """Base class of response objects, with one slot per response field."""
+
+    __slots__: Tuple[str, ...] = ()
+    # The slots of the class and all its bases.
+    _fields: ClassVar[Tuple[str, ...]] = ()
+    # Classes of fields that hold nested objects.
+    _nested: ClassVar[Dict[str, Type["_Struct"]]] = {}
+    # The fields without and with nested objects, to build objects without checking each field.
+    _plain_fields: ClassVar[Tuple[str, ...]] = ()
+    _nested_fields: ClassVar[Tuple[Tuple[str, Type["_Struct"]], ...]] = ()
+
+    def __init_subclass__(cls, **kwargs: Any) -> None:
+        super().__init_subclass__(**kwargs)
+        cls._fields = tuple(name for klass in reversed(cls.__mro__) for name in klass.__dict__.get("__slots__", ()))
+        cls._plain_fields = tuple(name for name in cls._fields if name not in cls._nested)
+        cls._nested_fields = tuple((name, cls._nested[name]) for name in cls._fields if name in cls._nested)
+
+    def __init__(self, **fields: Any) -> None:
+        for name in self._fields:
+            setattr(self, name, fields.get(name))
+
+    @classmethod
+    def from_dict(cls: Type[_StructType], data: Mapping[str, Any]) -> _StructType:
+        obj = cls.__new__(cls)
+        get = data.get
+        for name in cls._plain_fields:
+            setattr(obj, name, get(name))
+        for name, nested in cls._nested_fields:
+            value = get(name)
+            setattr(obj, name, None if value is None else nested.from_dict(value))
+        return obj
+
+    @classmethod
+    def decode(cls: Type[_StructType], content: bytes) -> _StructType:
+        """Decode a JSON response body into an object of this class."""
+        return cls.from_dict(_loads(content))
+
+    def _keys(self) -> List[str]:
+        return [name for name in self._fields if getattr(self, name) is not None]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """The object as a plain dict, the same as the response decoded as a dict."""
+        out = {}
+        for name in self._keys():
+            value = getattr(self, name)
+            out[name] = value.to_dict() if isinstance(value, _Struct) else value
+        return out
+
+    def __getitem__(self, key: str) -> Any:
+        value = getattr(self, key, None) if key in self._fields else None
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, str) and self.get(key) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._keys())
+
+    def keys(self) -> List[str]:
+        return self._keys()
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, _Struct):
+            return type(self) is type(other) and self.to_dict() == other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return "{0}({1})".format(
+            type(self).__name__, ", ".join("{0}={1!r}".format(name, getattr(self, name)) for name in self._keys())
+        )
+
+
+class AuthenticateResponse(_Struct):
+    __slots__ = ("orderRef", "autoStartToken", "qrStartToken", "qrStartSecret")
+    orderRef: str
+    autoStartToken: str
+    qrStartToken: str
+    qrStartSecret: str
+
+
+class SignResponse(AuthenticateResponse):
+    __slots__ = ()
+
+
+class PhoneAuthenticateResponse(_Struct):
+    __slots__ = ("orderRef",)
+    orderRef: str
+
+
+class PhoneSignResponse(PhoneAuthenticateResponse):
+    __slots__ = ()
+
+
+class Device(_Struct):
+    __slots__ = ("ipAddress", "uhi")
+    ipAddress: str
+    uhi: str
+
+
+class StepUp(_Struct):
+    __slots__ = ("mrtd",)
+    mrtd: bool
+
+
+class User(_Struct):
+    __slots__ = ("personalNumber", "name", "givenName", "surname")
+    personalNumber: str
+    name: str
+    givenName: str
+    surname: str
+
+
+class CompletionData(_Struct):
+    __slots__ = ("user", "device", "stepUp", "bankIdIssueDate", "signature", "ocspResponse", "risk")
+    _nested = {"user": User, "device": Device, "stepUp": StepUp}
+    user: User
+    device: Device
+    stepUp: StepUp
+    bankIdIssueDate: str
+    signature: str
+    ocspResponse: str
+    risk: Union[str, None]
+
+    @property
+    def signature_bytes(self) -> Union[bytes, None]:
+        """The base64 encoded signature XML as bytes, e.g. for :py:func:`base64.b64decode`."""
+        return None if self.signature is None else self.signature.encode("ascii")
+
+    @property
+    def ocsp_response_bytes(self) -> Union[bytes, None]:
+        """The base64 encoded OCSP response as bytes."""
+        return None if self.ocspResponse is None else self.ocspResponse.encode("ascii")
+
+
+class _CollectResponse(_Struct):
+    __slots__ = ("orderRef", "status", "hintCode", "completionData")
+    _nested = {"completionData": CompletionData}
+    orderRef: str
+    status: str
+    hintCode: Union[str, None]
+    completionData: Union[CompletionData, None]
+
+
+class CollectPendingResponse(_CollectResponse):
+    __slots__ = ()
+
+
+class CollectCompleteResponse(_CollectResponse):
+    __slots__ = ()
+
+
+class CollectFailedResponse(_CollectResponse):
+    __slots__ = ()
+
+
+CollectResponse = Union[CollectPendingResponse, CollectCompleteResponse, CollectFailedResponse]
+
+_COLLECT_CLASSES: Dict[str, Type[_CollectResponse]] = {
+    "pending": CollectPendingResponse,
+    "complete": CollectCompleteResponse,
+    "failed": CollectFailedResponse,
+}
+
+
+def decode_collect(content: bytes) -> CollectResponse:
+    """Decode a collect response body into the class of its ``status``."""
+    data = _loads(content)
+    return _COLLECT_CLASSES.get(data.get("status"), _CollectResponse).from_dict(data)  # type: ignore[return-value]
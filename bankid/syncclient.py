@@ -1,18 +1,24 @@
-from typing import Any, Dict, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from typing import Any, Dict, Iterable, Tuple, Union
 
 import httpx
 
-from bankid.baseclient import BankIDClientBaseclass
-from bankid.exceptions import get_json_error_class
+from bankid import structs
+from bankid.baseclient import BankIDClientBaseclass, PayloadTemplate, _order_ref_body
+from bankid.exceptions import BankIDError, get_json_error_class
+from bankid.metrics import BankIDMetrics
 from bankid.responses import (
     AuthenticateResponse,
     CollectCompleteResponse,
     CollectFailedResponse,
     CollectPendingResponse,
+    CollectResponse,
     PhoneAuthenticateResponse,
     PhoneSignResponse,
     SignResponse,
 )
+from bankid.tracing import BankIDTracer
 
 
 class BankIDClient(BankIDClientBaseclass[httpx.Client]):
@@ -25,14 +31,44 @@ class BankIDClient(BankIDClientBaseclass[httpx.Client]):
     :type test_server: bool
     :param request_timeout: Timeout for BankID requests.
     :type request_timeout: int
+    :param transport: Optional ``httpx`` transport to send requests through, e.g.
+        :py:class:`bankid.testing.FakeBankIDTransport`.
+    :type transport: httpx.BaseTransport
+    :param response_format: ``"dict"`` to return responses as dicts, or ``"struct"`` to return the
+        typed objects of :py:mod:`bankid.structs`, which also support read-only dict access.
+    :type response_format: str
+    :param metrics: Optional metrics to record the calls in, see :py:mod:`bankid.metrics`.
+    :type metrics: BankIDMetrics
+    :param tracer: Optional tracer making spans of the calls, see :py:mod:`bankid.tracing`.
+    :type tracer: BankIDTracer
 
     """
 
-    def __init__(self, certificates: Tuple[str, str], test_server: bool = False, request_timeout: int = 5):
-        super().__init__(certificates, test_server, request_timeout)
+    def __init__(
+        self,
+        certificates: Tuple[str, str],
+        test_server: bool = False,
+        request_timeout: int = 5,
+        transport: Union[httpx.BaseTransport, None] = None,
+        response_format: str = "dict",
+        metrics: Union[BankIDMetrics, None] = None,
+        tracer: Union[BankIDTracer, None] = None,
+    ):
+        super().__init__(certificates, test_server, request_timeout, response_format, metrics, tracer)
 
         headers = {"Content-Type": "application/json"}
-        self.client = httpx.Client(cert=self.certs, headers=headers, verify=self.ctx, timeout=request_timeout)
+        self.client = httpx.Client(headers=headers, verify=self.ctx, timeout=request_timeout, transport=transport)
+
+    def _post(self, url: str, **kwargs: Any) -> httpx.Response:
+        """Send a request to a BankID endpoint, recording it in :py:attr:`metrics` and :py:attr:`tracer` if set."""
+        if self.metrics is None and self.tracer is None:
+            return self.client.post(url, **kwargs)
+        with ExitStack() as stack:
+            records = self._instrument(stack, url, kwargs, asynchronous=False)
+            response = self.client.post(url, **kwargs)
+            for record in records:
+                record.response = response
+        return response
 
     def authenticate(
         self,
@@ -85,10 +121,10 @@ class BankIDClient(BankIDClientBaseclass[httpx.Client]):
             user_visible_data_format=user_visible_data_format,
         )
 
-        response = self.client.post(self._auth_endpoint, json=data)
+        response = self._post(self._auth_endpoint, json=data)
 
         if response.status_code == 200:
-            return response.json()  # type: ignore[no-any-return]
+            return self._decode(response, structs.AuthenticateResponse.decode)  # type: ignore[no-any-return]
         else:
             raise get_json_error_class(response)
 
@@ -150,10 +186,10 @@ class BankIDClient(BankIDClientBaseclass[httpx.Client]):
         data["personalNumber"] = personal_number
         data["callInitiator"] = call_initiator
 
-        response = self.client.post(self._phone_auth_endpoint, json=data)
+        response = self._post(self._phone_auth_endpoint, json=data)
 
         if response.status_code == 200:
-            return response.json()  # type: ignore[no-any-return]
+            return self._decode(response, structs.PhoneAuthenticateResponse.decode)  # type: ignore[no-any-return]
         else:
             raise get_json_error_class(response)
 
@@ -205,10 +241,10 @@ class BankIDClient(BankIDClientBaseclass[httpx.Client]):
             user_non_visible_data=user_non_visible_data,
             user_visible_data_format=user_visible_data_format,
         )
-        response = self.client.post(self._sign_endpoint, json=data)
+        response = self._post(self._sign_endpoint, json=data)
 
         if response.status_code == 200:
-            return response.json()  # type: ignore[no-any-return]
+            return self._decode(response, structs.SignResponse.decode)  # type: ignore[no-any-return]
         else:
             raise get_json_error_class(response)
 
@@ -268,10 +304,58 @@ class BankIDClient(BankIDClientBaseclass[httpx.Client]):
         data["personalNumber"] = personal_number
         data["callInitiator"] = call_initiator
 
-        response = self.client.post(self._phone_sign_endpoint, json=data)
+        response = self._post(self._phone_sign_endpoint, json=data)
+
+        if response.status_code == 200:
+            return self._decode(response, structs.PhoneSignResponse.decode)  # type: ignore[no-any-return]
+        else:
+            raise get_json_error_class(response)
+
+    def authenticate_with_template(self, template: PayloadTemplate, end_user_ip: str) -> AuthenticateResponse:
+        """Request an authentication order with a body from :py:meth:`payload_template`.
+
+        This is the same as calling :py:meth:`authenticate` with the arguments the template was created with,
+        but the request body is encoded only once for all orders.
+
+        :param template: The encoded requirement and user data.
+        :type template: PayloadTemplate
+        :param end_user_ip: The user IP address as seen by RP. String. IPv4 and IPv6 is allowed.
+        :type end_user_ip: str
+        :return: The order response parsed as a dict.
+        :rtype: AuthenticateResponse
+        :raises BankIDError: raises a subclass of this error
+                             when error has been returned from server.
+
+        """
+        response = self._post(self._auth_endpoint, content=template.render(end_user_ip))
+
+        if response.status_code == 200:
+            return self._decode(response, structs.AuthenticateResponse.decode)  # type: ignore[no-any-return]
+        else:
+            raise get_json_error_class(response)
+
+    def sign_with_template(self, template: PayloadTemplate, end_user_ip: str) -> SignResponse:
+        """Request a signing order with a body from :py:meth:`payload_template`.
+
+        This is the same as calling :py:meth:`sign` with the arguments the template was created with,
+        but the request body is encoded only once for all orders.
+
+        :param template: The encoded requirement and user data, which must include ``user_visible_data``.
+        :type template: PayloadTemplate
+        :param end_user_ip: The user IP address as seen by RP. String. IPv4 and IPv6 is allowed.
+        :type end_user_ip: str
+        :return: The order response parsed as a dict.
+        :rtype: SignResponse
+        :raises BankIDError: raises a subclass of this error
+                             when error has been returned from server.
+
+        """
+        if "userVisibleData" not in template.payload:
+            raise ValueError("Sign templates must have user_visible_data")
+        response = self._post(self._sign_endpoint, content=template.render(end_user_ip))
 
         if response.status_code == 200:
-            return response.json()  # type: ignore[no-any-return]
+            return self._decode(response, structs.SignResponse.decode)  # type: ignore[no-any-return]
         else:
             raise get_json_error_class(response)
 
@@ -281,7 +365,8 @@ class BankIDClient(BankIDClientBaseclass[httpx.Client]):
 
         RP should keep on calling collect every two seconds if status is pending.
         RP must abort if status indicates failed. The user identity is returned
-        when complete.
+        when complete. :py:class:`bankid.polling.AdaptivePollingPolicy` can choose
+        the interval between calls from the ``hintCode`` and age of the order instead.
 
         Example collect results returned while authentication or signing is
         still pending:
@@ -340,13 +425,52 @@ class BankIDClient(BankIDClientBaseclass[httpx.Client]):
                              when error has been returned from server.
 
         """
-        response = self.client.post(self._collect_endpoint, json={"orderRef": order_ref})
+        response = self._post(self._collect_endpoint, content=_order_ref_body(order_ref))
 
         if response.status_code == 200:
-            return response.json()  # type: ignore[no-any-return]
+            result = self._decode(response, structs.decode_collect)
+            if self.metrics is not None:
+                self.metrics.observe_collect(result)
+            return result  # type: ignore[no-any-return]
         else:
             raise get_json_error_class(response)
 
+    def collect_many(
+        self, order_refs: Iterable[str], concurrency: int = 10
+    ) -> Dict[str, Union[CollectResponse, BankIDError, httpx.HTTPError]]:
+        """Collects the results of several orders concurrently, using a pool of
+        ``concurrency`` threads sharing this client's connection pool.
+
+        An error for one order does not abort the batch; the raised
+        :py:class:`~bankid.exceptions.BankIDError` or :py:class:`httpx.HTTPError`
+        is returned in place of its response.
+
+        :param order_refs: The ``orderRef`` UUIDs returned from auth or sign.
+        :type order_refs: iterable
+        :param concurrency: Maximum number of collect calls in flight.
+        :type concurrency: int
+        :return: Mapping of each ``orderRef`` to its collect response, or to the
+            :py:class:`~bankid.exceptions.BankIDError` or :py:class:`httpx.HTTPError`
+            raised when collecting it.
+        :rtype: Dict[str, Union[CollectResponse, BankIDError, httpx.HTTPError]]
+        :raises ValueError: If ``concurrency`` is less than 1.
+
+        """
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+
+        def _collect(order_ref: str) -> Union[CollectResponse, BankIDError, httpx.HTTPError]:
+            try:
+                return self.collect(order_ref)
+            except (BankIDError, httpx.HTTPError) as e:
+                return e
+
+        refs = list(dict.fromkeys(order_refs))
+        if not refs:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(refs))) as executor:
+            return dict(zip(refs, executor.map(_collect, refs)))
+
     def cancel(self, order_ref: str) -> bool:
         """Cancels an ongoing sign or auth order.
 
@@ -361,7 +485,7 @@ class BankIDClient(BankIDClientBaseclass[httpx.Client]):
                              when error has been returned from server.
 
         """
-        response = self.client.post(self._cancel_endpoint, json={"orderRef": order_ref})
+        response = self._post(self._cancel_endpoint, content=_order_ref_body(order_ref))
 
         if response.status_code == 200:
             return response.json() == {}  # type: ignore[no-any-return]
@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+"""
+:mod:`bankid.testing` -- In-process BankID v6 stand-in server
+=============================================================
+
+A local fake of the BankID Relying Party v6 API that plugs into
+:py:class:`~bankid.BankIDClient` and :py:class:`~bankid.BankIDAsyncClient` through
+an ``httpx`` transport, so that flows can be tested and load tested without network access.
+
+.. code-block:: python
+
+    from bankid import BankIDClient
+    from bankid.certs import get_test_cert_and_key
+    from bankid.testing import FakeBankIDTransport
+
+    client = BankIDClient(get_test_cert_and_key(), test_server=True, transport=FakeBankIDTransport())
+
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Sequence, Tuple, Union
+
+import httpx
+
+from bankid.exceptions import _JSON_ERROR_CODE_TO_CLASS
+
+#: HTTP status codes used by the BankID servers for each ``errorCode``.
+ERROR_CODE_TO_HTTP_STATUS: Dict[str, int] = {
+    "invalidParameters": 400,
+    "alreadyInProgress": 400,
+    "unauthorized": 401,
+    "notFound": 404,
+    "requestTimeout": 408,
+    "internalError": 500,
+    "maintenance": 503,
+}
+
+ENDPOINTS = ("auth", "phone/auth", "sign", "phone/sign", "collect", "cancel")
+
+LatencySpec = Union[float, Callable[[str], float], None]
+
+
+class Journey:
+    """A scripted user journey for an order on the fake server.
+
+    The order reports each pending ``hintCode`` in ``steps`` for the given number of seconds
+    and then ends with ``status``, which is either ``"complete"`` or ``"failed"``. A failed
+    journey reports ``hint_code`` as its final ``hintCode``.
+
+    :param steps: Sequence of ``(hintCode, duration in seconds)`` tuples.
+    :type steps: sequence
+    :param status: Final status of the order, ``"complete"`` or ``"failed"``.
+    :type status: str
+    :param hint_code: The final ``hintCode`` for failed journeys.
+    :type hint_code: str
+    :param weight: Relative probability of the journey being picked for a new order.
+    :type weight: float
+
+    """
+
+    def __init__(
+        self,
+        steps: Sequence[Tuple[str, float]],
+        status: str = "complete",
+        hint_code: Union[str, None] = None,
+        weight: float = 1.0,
+    ):
+        if status not in ("complete", "failed"):
+            raise ValueError("status must be either 'complete' or 'failed'")
+        if status == "failed" and hint_code is None:
+            raise ValueError("Failed journeys must have a final hint_code")
+        self.steps = list(steps)
+        self.status = status
+        self.hint_code = hint_code
+        self.weight = weight
+
+    @property
+    def duration(self) -> float:
+        return sum(d for _, d in self.steps)
+
+
+DEFAULT_JOURNEYS: List[Journey] = [
+    Journey([("outstandingTransaction", 4.0), ("started", 2.0), ("userSign", 6.0)], weight=0.75),
+    Journey([("noClient", 6.0), ("started", 2.0), ("userSign", 6.0)], weight=0.1),
+    Journey([("outstandingTransaction", 4.0), ("userSign", 4.0)], "failed", "userCancel", weight=0.08),
+    Journey([("outstandingTransaction", 4.0), ("started", 4.0)], "failed", "startFailed", weight=0.02),
+    Journey([("outstandingTransaction", 30.0)], "failed", "expiredTransaction", weight=0.05),
+]
+
+
+def lognormal_latency(median: float, sigma: float = 0.5, rng: Union[random.Random, None] = None) -> Callable[[str], float]:
+    """Latency distribution with a log-normal shape, which is a fair model of network round-trips.
+
+    :param median: The median latency in seconds.
+    :type median: float
+    :param sigma: Shape parameter; larger values give longer tails.
+    :type sigma: float
+    :return: A callable taking the endpoint name and returning a latency in seconds.
+    :rtype: callable
+
+    """
+    _rng = rng or random.Random()
+    mu = math.log(median) if median > 0 else 0.0
+
+    def _latency(endpoint: str) -> float:
+        return 0.0 if median <= 0 else _rng.lognormvariate(mu, sigma)
+
+    return _latency
+
+
+class _FakeOrder:
+    __slots__ = ("order_ref", "journey", "created", "personal_number", "end_user_ip", "aborted")
+
+    def __init__(self, order_ref: str, journey: Journey, created: float, personal_number: str, end_user_ip: str):
+        self.order_ref = order_ref
+        self.journey = journey
+        self.created = created
+        self.personal_number = personal_number
+        self.end_user_ip = end_user_ip
+        self.aborted = False
+
+
+class FakeBankIDServer:
+    """State machine emulating the BankID RP v6 API.
+
+    Orders follow a :py:class:`Journey` picked at random (by weight) when they are created,
+    and their ``hintCode`` progresses with the time elapsed since creation.
+
+    :param journeys: The journeys to pick from. Defaults to :py:data:`DEFAULT_JOURNEYS`.
+    :type journeys: sequence
+    :param latency: Latency added to each request by the transport, either a constant
+        number of seconds or a callable taking the endpoint name, e.g. :py:func:`lognormal_latency`.
+    :param error_rates: Mapping of ``errorCode`` to the probability of a request failing
+        with that error, for error codes known in :py:mod:`bankid.exceptions`.
+    :type error_rates: dict
+    :param time_scale: Multiplier applied to all journey step durations.
+    :type time_scale: float
+    :param clock: Monotonic time source.
+    :param seed: Seed for the random number generator.
+
+    """
+
+    def __init__(
+        self,
+        journeys: Union[Sequence[Journey], None] = None,
+        latency: LatencySpec = None,
+        error_rates: Union[Dict[str, float], None] = None,
+        time_scale: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+        seed: Union[int, None] = None,
+    ):
+        self.journeys = list(journeys or DEFAULT_JOURNEYS)
+        self.error_rates = dict(error_rates or {})
+        for code in self.error_rates:
+            if code not in _JSON_ERROR_CODE_TO_CLASS:
+                raise ValueError("Unknown errorCode: {0}".format(code))
+        self.time_scale = time_scale
+        self.clock = clock
+        self.rng = random.Random(seed)
+        if latency is None or isinstance(latency, (int, float)):
+            constant = float(latency or 0.0)
+            self._latency: Callable[[str], float] = lambda endpoint: constant
+        else:
+            self._latency = latency
+
+        self.orders: Dict[str, _FakeOrder] = {}
+        self._in_progress: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def latency(self, endpoint: str) -> float:
+        return max(0.0, self._latency(endpoint))
+
+    def handle(self, endpoint: str, data: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        """Handle one API call and return the HTTP status code and JSON body."""
+        if endpoint not in ENDPOINTS:
+            return _error("notFound", "No such endpoint")
+
+        for code, rate in self.error_rates.items():
+            if rate and self.rng.random() < rate:
+                return _error(code, "Injected error")
+
+        with self._lock:
+            if endpoint in ("auth", "sign"):
+                return self._order(endpoint, data)
+            elif endpoint in ("phone/auth", "phone/sign"):
+                return self._phone_order(endpoint, data)
+            elif endpoint == "collect":
+                return self._collect(data)
+            else:
+                return self._cancel(data)
+
+    def _pick_journey(self) -> Journey:
+        return self.rng.choices(self.journeys, weights=[j.weight for j in self.journeys])[0]
+
+    def _new_order(self, personal_number: Union[str, None], end_user_ip: str) -> Union[_FakeOrder, None]:
+        now = self.clock()
+        if personal_number:
+            ongoing = self.orders.get(self._in_progress.get(personal_number, ""))
+            if ongoing is not None and not self._is_done(ongoing, now):
+                # The ongoing order is aborted as well, just as on the real servers.
+                ongoing.aborted = True
+                return None
+        order = _FakeOrder(
+            str(uuid.UUID(int=self.rng.getrandbits(128), version=4)),
+            self._pick_journey(),
+            now,
+            personal_number or _random_personal_number(self.rng),
+            end_user_ip,
+        )
+        self.orders[order.order_ref] = order
+        self._in_progress[order.personal_number] = order.order_ref
+        return order
+
+    def _order(self, endpoint: str, data: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        if not data.get("endUserIp"):
+            return _error("invalidParameters", "Missing endUserIp")
+        if endpoint == "sign" and not data.get("userVisibleData"):
+            return _error("invalidParameters", "Missing userVisibleData")
+        requirement = data.get("requirement") or {}
+        order = self._new_order(requirement.get("personalNumber"), data["endUserIp"])
+        if order is None:
+            return _error("alreadyInProgress", "Order already in progress for pno")
+        return 200, {
+            "orderRef": order.order_ref,
+            "autoStartToken": str(uuid.UUID(int=self.rng.getrandbits(128), version=4)),
+            "qrStartToken": str(uuid.UUID(int=self.rng.getrandbits(128), version=4)),
+            "qrStartSecret": str(uuid.UUID(int=self.rng.getrandbits(128), version=4)),
+        }
+
+    def _phone_order(self, endpoint: str, data: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        if not data.get("personalNumber"):
+            return _error("invalidParameters", "Missing personalNumber")
+        if data.get("callInitiator") not in ("user", "RP"):
+            return _error("invalidParameters", "Invalid callInitiator")
+        if endpoint == "phone/sign" and not data.get("userVisibleData"):
+            return _error("invalidParameters", "Missing userVisibleData")
+        order = self._new_order(data["personalNumber"], "")
+        if order is None:
+            return _error("alreadyInProgress", "Order already in progress for pno")
+        return 200, {"orderRef": order.order_ref}
+
+    def _is_done(self, order: _FakeOrder, now: float) -> bool:
+        return order.aborted or (now - order.created) >= order.journey.duration * self.time_scale
+
+    def _collect(self, data: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        order = self.orders.get(data.get("orderRef", ""))
+        if order is None:
+            return _error("invalidParameters", "No such order")
+
+        if order.aborted:
+            return 200, {"orderRef": order.order_ref, "status": "failed", "hintCode": "cancelled"}
+
+        elapsed = (self.clock() - order.created) / (self.time_scale or 1.0)
+        for hint_code, duration in order.journey.steps:
+            if elapsed < duration:
+                return 200, {"orderRef": order.order_ref, "status": "pending", "hintCode": hint_code}
+            elapsed -= duration
+
+        if order.journey.status == "failed":
+            return 200, {"orderRef": order.order_ref, "status": "failed", "hintCode": order.journey.hint_code}
+        return 200, {
+            "orderRef": order.order_ref,
+            "status": "complete",
+            "completionData": self._completion_data(order),
+        }
+
+    def _cancel(self, data: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        order = self.orders.pop(data.get("orderRef", ""), None)
+        if order is None:
+            return _error("invalidParameters", "No such order")
+        if self._in_progress.get(order.personal_number) == order.order_ref:
+            del self._in_progress[order.personal_number]
+        return 200, {}
+
+    def _completion_data(self, order: _FakeOrder) -> Dict[str, Any]:
+        signature = (
+            '<?xml version="1.0" encoding="UTF-8" standalone="no"?>'
+            '<Signature xmlns="http://www.w3.org/2000/09/xmldsig#"><Object>'
+            '<bankIdSignedData xmlns="http://www.bankid.com/signature/v1.0.0/types" Id="bidSignedData">'
+            "<srvInfo><nonce>{0}</nonce></srvInfo></bankIdSignedData></Object></Signature>"
+        ).format(base64.b64encode(hashlib.sha256(order.order_ref.encode()).digest()).decode())
+        return {
+            "user": {
+                "personalNumber": order.personal_number,
+                "name": "Karl Karlsson",
+                "givenName": "Karl",
+                "surname": "Karlsson",
+            },
+            "device": {"ipAddress": order.end_user_ip or "192.168.0.1", "uhi": "OZvYM9VvyiAmG7NA5jU5zqGcVpo="},
+            "stepUp": {"mrtd": False},
+            "bankIdIssueDate": "2020-02-01",
+            "signature": base64.b64encode(signature.encode()).decode(),
+            "ocspResponse": base64.b64encode(hashlib.sha512(order.order_ref.encode()).digest() * 24).decode(),
+        }
+
+
+class FakeBankIDTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """An ``httpx`` transport answering requests from a :py:class:`FakeBankIDServer`.
+
+    The same transport instance can be used by both the synchronous and the asynchronous client.
+
+    :param server: The fake server to dispatch to. A default one is created if not given.
+    :type server: FakeBankIDServer
+
+    """
+
+    def __init__(self, server: Union[FakeBankIDServer, None] = None):
+        self.server = server or FakeBankIDServer()
+
+    def _dispatch(self, request: httpx.Request) -> httpx.Response:
+        endpoint = _endpoint_name(request.url.path)
+        if request.method != "POST":
+            return httpx.Response(405, json={"errorCode": "methodNotAllowed", "details": "Use POST"})
+        try:
+            data = json.loads(request.content or b"{}")
+        except ValueError:
+            status_code, body = _error("invalidParameters", "Invalid JSON in request body")
+        else:
+            status_code, body = self.server.handle(endpoint, data)
+        return httpx.Response(status_code, json=body, request=request)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.read()
+        delay = self.server.latency(_endpoint_name(request.url.path))
+        if delay:
+            time.sleep(delay)
+        return self._dispatch(request)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        delay = self.server.latency(_endpoint_name(request.url.path))
+        if delay:
+            await asyncio.sleep(delay)
+        return self._dispatch(request)
+
+
+def _endpoint_name(path: str) -> str:
+    _, _, endpoint = path.partition("/rp/v6.0/")
+    return endpoint.strip("/")
+
+
+def _error(error_code: str, details: str) -> Tuple[int, Dict[str, Any]]:
+    return ERROR_CODE_TO_HTTP_STATUS.get(error_code, 400), {"errorCode": error_code, "details": details}
+
+
+def _random_personal_number(rng: random.Random) -> str:
+    return "{0:04d}{1:02d}{2:02d}{3:04d}".format(
+        rng.randint(1930, 2005), rng.randint(1, 12), rng.randint(1, 28), rng.randint(0, 9999)
+    )
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+:mod:`bankid.tracing` -- Spans with network timings of client calls
+===================================================================
+
+A :py:class:`BankIDTracer` given to a client as ``tracer=`` makes a span of every call to BankID.
+Each span has the endpoint and ``orderRef`` of the call, its outcome, and how long was spent
+connecting, in the TLS handshake, writing the request and waiting for the first byte of the
+response, taken from the ``trace`` extension of ``httpx``. It also tells whether the call
+reused a pooled connection, so that slow calls can be told apart as slow BankID responses,
+slow egress or new handshakes.
+
+.. code-block:: python
+
+    def log_slow_calls(span):
+        if span.duration > 1.0:
+            print(span.name, span.attributes)
+
+    client = BankIDClient(certificates=(cert, key), tracer=BankIDTracer(on_span=log_slow_calls))
+
+The spans are also sent to `OpenTelemetry <https://opentelemetry.io/docs/languages/python/>`_,
+as children of the current span, if the ``opentelemetry-api`` package is installed or an
+OpenTelemetry tracer is given. It is not required otherwise.
+
+The following span attributes are set, where available:
+
+- ``bankid.endpoint``: the API endpoint, e.g. ``auth`` or ``collect``.
+- ``bankid.order_ref``: the ``orderRef`` of the call.
+- ``bankid.error_code``: the BankID ``errorCode`` of failed calls.
+- ``bankid.connection_reused``: whether a pooled connection was used.
+- ``bankid.timing.connect``, ``bankid.timing.tls``, ``bankid.timing.write`` and
+  ``bankid.timing.ttfb``: seconds spent connecting, in the TLS handshake, sending the request
+  and from having sent it to receiving the response headers.
+- ``http.request.method``, ``url.full``, ``server.address``, ``http.response.status_code``
+  and ``error.type`` as in the OpenTelemetry HTTP semantic conventions.
+
+"""
+
+import importlib
+import re
+import time
+from logging import getLogger
+from types import TracebackType
+from typing import Any, Callable, Dict, List, Mapping, Tuple, Type, Union
+
+import httpx
+
+_LOG = getLogger(__name__)
+
+try:
+    _otel: Any = importlib.import_module("opentelemetry.trace")
+except ImportError:
+    _otel = None
+
+_ORDER_REF = re.compile(rb'"orderRef"\s*:\s*"([^"]*)"')
+
+# Span attribute name and the httpcore trace events its duration is measured between.
+_PHASES: Tuple[Tuple[str, str, str], ...] = (
+    ("bankid.timing.connect", "connect_tcp.started", "connect_tcp.complete"),
+    ("bankid.timing.tls", "start_tls.started", "start_tls.complete"),
+    ("bankid.timing.write", "send_request_headers.started", "send_request_body.complete"),
+    ("bankid.timing.ttfb", "send_request_body.complete", "receive_response_headers.complete"),
+)
+
+
+class Span:
+    """The record of one call to BankID.
+
+    :py:attr:`start_time` and :py:attr:`end_time` are in nanoseconds since the epoch, as in
+    OpenTelemetry. :py:attr:`events` maps the ``httpx`` trace events seen during the call, e.g.
+    ``connect_tcp.started``, to :py:func:`time.perf_counter` values.
+
+    """
+
+    __slots__ = ("name", "attributes", "start_time", "end_time", "error", "response", "events", "_started")
+
+    def __init__(self, name: str, attributes: Dict[str, Any]):
+        self.name = name
+        self.attributes = attributes
+        self.start_time = 0
+        self.end_time = 0
+        self.error: Union[BaseException, None] = None
+        self.response: Union[httpx.Response, None] = None
+        self.events: Dict[str, float] = {}
+        self._started = 0.0
+
+    @property
+    def duration(self) -> float:
+        """Seconds from start to end of the call."""
+        return (self.end_time - self.start_time) / 1e9
+
+    def trace(self, name: str, info: Mapping[str, Any]) -> None:
+        """The ``httpx`` trace extension callback of synchronous clients."""
+        # Names are e.g. "connection.connect_tcp.started" or "http11.send_request_headers.complete".
+        self.events.setdefault(name.split(".", 1)[-1], time.perf_counter())
+
+    async def atrace(self, name: str, info: Mapping[str, Any]) -> None:
+        """The ``httpx`` trace extension callback of asynchronous clients."""
+        self.trace(name, info)
+
+    def _finish(self) -> None:
+        self.end_time = self.start_time + int((time.perf_counter() - self._started) * 1e9)
+        attributes = self.attributes
+        events = self.events
+        if events:
+            attributes["bankid.connection_reused"] = "connect_tcp.started" not in events
+        for attribute, start, end in _PHASES:
+            if start in events and end in events:
+                attributes[attribute] = events[end] - events[start]
+        response = self.response
+        if response is not None:
+            attributes["http.response.status_code"] = response.status_code
+            match = None if "bankid.order_ref" in attributes else _ORDER_REF.search(response.content)
+            if match is not None:
+                attributes["bankid.order_ref"] = match.group(1).decode("utf-8")
+            if response.status_code != 200:
+                try:
+                    attributes["bankid.error_code"] = str(response.json().get("errorCode"))
+                except ValueError:
+                    pass
+                attributes["error.type"] = str(response.status_code)
+        if self.error is not None:
+            attributes["error.type"] = type(self.error).__name__
+
+    def __enter__(self) -> "Span":
+        self.start_time = time.time_ns()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Union[Type[BaseException], None],
+        exc: Union[BaseException, None],
+        tb: Union[TracebackType, None],
+    ) -> None:
+        self.error = exc
+        self._finish()
+
+    def __repr__(self) -> str:
+        return "<Span {0} {1:.3f} s {2!r}>".format(self.name, self.duration, self.attributes)
+
+
+class _TracedCall(Span):
+    __slots__ = ("tracer",)
+
+    tracer: "BankIDTracer"
+
+    def __exit__(
+        self,
+        exc_type: Union[Type[BaseException], None],
+        exc: Union[BaseException, None],
+        tb: Union[TracebackType, None],
+    ) -> None:
+        super().__exit__(exc_type, exc, tb)
+        self.tracer.export(self)
+
+
+class BankIDTracer:
+    """Makes a :py:class:`Span` of every call of the clients it is given to.
+
+    :param on_span: Functions called with each finished span.
+    :type on_span: callable or list
+    :param tracer: OpenTelemetry tracer to send the spans to. By default the ``bankid.tracing``
+        tracer of the global tracer provider, if ``opentelemetry-api`` is installed.
+    :type tracer: opentelemetry.trace.Tracer
+
+    """
+
+    def __init__(
+        self,
+        on_span: Union[Callable[[Span], Any], List[Callable[[Span], Any]], None] = None,
+        tracer: Any = None,
+    ):
+        if on_span is None:
+            on_span = []
+        self.on_span = on_span if isinstance(on_span, list) else [on_span]
+        if tracer is None and _otel is not None:
+            tracer = _otel.get_tracer(__name__)
+        self.tracer = tracer
+
+    def span(self, method: str, url: str, endpoint: str, content: Union[bytes, None] = None) -> Span:
+        """The span of a call, to be used as a context manager around it.
+
+        :param method: The HTTP method.
+        :type method: str
+        :param url: The URL called.
+        :type url: str
+        :param endpoint: The BankID API endpoint, e.g. ``collect``.
+        :type endpoint: str
+        :param content: The request body, which the ``orderRef`` is read from, if it has one.
+        :type content: bytes
+        :return: The span, whose ``response`` should be set once the call has returned one.
+        :rtype: Span
+
+        """
+        attributes: Dict[str, Any] = {
+            "bankid.endpoint": endpoint,
+            "http.request.method": method,
+            "url.full": url,
+            "server.address": httpx.URL(url).host,
+        }
+        match = _ORDER_REF.search(content) if content else None
+        if match is not None:
+            attributes["bankid.order_ref"] = match.group(1).decode("utf-8")
+        span = _TracedCall("bankid.{0}".format(endpoint), attributes)
+        span.tracer = self
+        return span
+
+    def export(self, span: Span) -> None:
+        """Send a finished span to the OpenTelemetry tracer and the ``on_span`` functions."""
+        if self.tracer is not None:
+            self._export_otel(span)
+        for callback in self.on_span:
+            try:
+                callback(span)
+            except Exception:
+                _LOG.exception("Span callback %r failed", callback)
+
+    def _export_otel(self, span: Span) -> None:
+        kwargs: Dict[str, Any] = {"attributes": span.attributes, "start_time": span.start_time}
+        if _otel is not None:
+            kwargs["kind"] = _otel.SpanKind.CLIENT
+        otel_span = self.tracer.start_span(span.name, **kwargs)
+        if span.error is not None:
+            otel_span.record_exception(span.error)
+        if _otel is not None and "error.type" in span.attributes:
+            otel_span.set_status(_otel.Status(_otel.StatusCode.ERROR))
+        otel_span.end(end_time=span.end_time)
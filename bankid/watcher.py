@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""
+:mod:`bankid.watcher` -- Multiplexed collect polling
+====================================================
+
+An :py:class:`OrderWatcher` polls many in-flight orders from one event loop, so that
+every browser or service waiting for an order shares one upstream ``collect`` cadence.
+
+.. code-block:: python
+
+    watcher = OrderWatcher(client)
+    async with watcher:
+        order = await client.authenticate(end_user_ip)
+        result = await watcher.wait_for(order["orderRef"], timeout=180)
+
+"""
+
+import asyncio
+import heapq
+import random
+from logging import getLogger
+from typing import Any, Dict, List, NamedTuple, Set, Tuple, Union
+
+import httpx
+
+from bankid.asyncclient import BankIDAsyncClient
+from bankid.exceptions import BankIDError
+from bankid.polling import AdaptivePollingPolicy
+
+_LOG = getLogger(__name__)
+
+
+class OrderUpdate(NamedTuple):
+    """A change in status or ``hintCode`` of a watched order.
+
+    Exactly one of ``response`` and ``error`` is set.
+    """
+
+    order_ref: str
+    response: Union[Dict[str, Any], None]
+    error: Union[BankIDError, None] = None
+
+    @property
+    def is_final(self) -> bool:
+        return self.error is not None or (self.response or {}).get("status") != "pending"
+
+
+class OrderWatcher:
+    """Polls ``collect`` for a set of orders and publishes their status changes.
+
+    Each order is collected every ``interval`` seconds, with a random jitter of up to
+    ``jitter * interval`` seconds in either direction so that orders started at the same time
+    do not keep polling on the same tick. An order stops being polled when it is no longer
+    pending, when ``collect`` raises a :py:class:`~bankid.exceptions.BankIDError` or when
+    it is :py:meth:`unwatch`-ed. Transport errors and other unexpected errors, e.g. a response
+    that is not JSON, are logged and the order is polled again.
+
+    :param client: The client to collect with.
+    :type client: BankIDAsyncClient
+    :param interval: Seconds between collect calls for one order.
+    :type interval: float
+    :param jitter: Fraction of ``interval`` to randomly offset each poll with.
+    :type jitter: float
+    :param max_concurrency: Maximum number of collect calls in flight.
+    :type max_concurrency: int
+    :param policy: Chooses the interval per order from its ``hintCode`` and age instead of using
+        ``interval``. The jitter is then applied to the chosen interval, but never below the policy's
+        ``min_interval``.
+    :type policy: AdaptivePollingPolicy
+
+    """
+
+    def __init__(
+        self,
+        client: BankIDAsyncClient,
+        interval: float = 2.0,
+        jitter: float = 0.1,
+        max_concurrency: int = 100,
+        rng: Union[random.Random, None] = None,
+        policy: Union[AdaptivePollingPolicy, None] = None,
+    ):
+        self.client = client
+        self.interval = interval
+        self.jitter = jitter
+        self.max_concurrency = max_concurrency
+        self.policy = policy
+        self._rng = rng or random.Random()
+
+        # Entries are (due time, sequence number, orderRef, generation of the watch that scheduled it).
+        self._schedule: List[Tuple[float, int, str, int]] = []
+        self._seq = 0
+        self._orders: Dict[str, Union[Dict[str, Any], None]] = {}
+        # The sequence number of the watch() call of each watched order, so that collects
+        # scheduled before the order was unwatched and watched again are dropped.
+        self._generations: Dict[str, int] = {}
+        self._watched_at: Dict[str, float] = {}
+        self._futures: Dict[str, "asyncio.Future[Dict[str, Any]]"] = {}
+        self._subscribers: Set["asyncio.Queue[OrderUpdate]"] = set()
+        self._order_subscribers: Dict[str, Set["asyncio.Queue[OrderUpdate]"]] = {}
+        self._in_flight: Set["asyncio.Task[None]"] = set()
+        self._wakeup: Union[asyncio.Event, None] = None
+        self._semaphore: Union[asyncio.Semaphore, None] = None
+        self._task: Union["asyncio.Task[None]", None] = None
+
+    def __len__(self) -> int:
+        return len(self._orders)
+
+    def __contains__(self, order_ref: object) -> bool:
+        return order_ref in self._orders
+
+    async def __aenter__(self) -> "OrderWatcher":
+        self.start()
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        await self.stop()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        """Start the polling loop on the running event loop."""
+        if self.running:
+            return
+        self._wakeup = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        """Stop polling. Orders that are still being watched are kept and resumed by :py:meth:`start`."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._in_flight):
+            task.cancel()
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+
+    def watch(self, order_ref: str) -> None:
+        """Start polling ``order_ref``. Watching an already watched order has no effect."""
+        if order_ref in self._orders:
+            return
+        self._orders[order_ref] = None
+        self._seq += 1
+        self._generations[order_ref] = self._seq
+        self._watched_at[order_ref] = asyncio.get_running_loop().time()
+        # The first collect is spread out over the jitter window instead of the full interval.
+        self._push(order_ref, self._seq, self._rng.uniform(0, self.jitter * self.interval))
+
+    def unwatch(self, order_ref: str) -> None:
+        """Stop polling ``order_ref``. Pending :py:meth:`wait_for` calls for it are cancelled."""
+        self._orders.pop(order_ref, None)
+        self._generations.pop(order_ref, None)
+        self._watched_at.pop(order_ref, None)
+        future = self._futures.pop(order_ref, None)
+        if future is not None and not future.done():
+            future.cancel()
+
+    def last_response(self, order_ref: str) -> Union[Dict[str, Any], None]:
+        """The latest collect response for a watched order, or ``None`` if not yet collected."""
+        return self._orders.get(order_ref)
+
+    def subscribe(self, maxsize: int = 0, order_ref: Union[str, None] = None) -> "asyncio.Queue[OrderUpdate]":
+        """Return a queue receiving an :py:class:`OrderUpdate` for every status change.
+
+        If ``order_ref`` is given, only updates for that order are received, otherwise updates for all watched orders.
+        """
+        queue: "asyncio.Queue[OrderUpdate]" = asyncio.Queue(maxsize)
+        if order_ref is None:
+            self._subscribers.add(queue)
+        else:
+            self._order_subscribers.setdefault(order_ref, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, queue: "asyncio.Queue[OrderUpdate]") -> None:
+        self._subscribers.discard(queue)
+        for order_ref, queues in list(self._order_subscribers.items()):
+            queues.discard(queue)
+            if not queues:
+                del self._order_subscribers[order_ref]
+
+    async def wait_for(self, order_ref: str, timeout: Union[float, None] = None) -> Dict[str, Any]:
+        """Wait until ``order_ref`` is no longer pending and return its final collect response.
+
+        The order is watched if it is not already.
+
+        :raises BankIDError: if collect raised an error for the order.
+        :raises asyncio.TimeoutError: if ``timeout`` seconds passed first.
+
+        """
+        future = self._futures.get(order_ref)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._futures[order_ref] = future
+        self.watch(order_ref)
+        return await asyncio.wait_for(asyncio.shield(future), timeout)
+
+    def _watching(self, order_ref: str, generation: int) -> bool:
+        """Whether ``order_ref`` is still watched by the same :py:meth:`watch` call as ``generation``."""
+        return self._generations.get(order_ref) == generation
+
+    def _push(self, order_ref: str, generation: int, delay: float) -> None:
+        self._seq += 1
+        heapq.heappush(self._schedule, (asyncio.get_running_loop().time() + delay, self._seq, order_ref, generation))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _next_delay(self, order_ref: str) -> float:
+        if self.policy is None:
+            return max(0.0, self.interval + self._rng.uniform(-self.jitter, self.jitter) * self.interval)
+        response = self._orders.get(order_ref) or {}
+        age = asyncio.get_running_loop().time() - self._watched_at.get(order_ref, 0.0)
+        interval = self.policy.next_interval(response.get("hintCode"), age)
+        return max(self.policy.min_interval, interval + self._rng.uniform(-self.jitter, self.jitter) * interval)
+
+    async def _run(self) -> None:
+        assert self._wakeup is not None and self._semaphore is not None
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            now = loop.time()
+            while self._schedule and self._schedule[0][0] <= now:
+                _, _, order_ref, generation = heapq.heappop(self._schedule)
+                if not self._watching(order_ref, generation):
+                    continue
+                await self._semaphore.acquire()
+                task = asyncio.ensure_future(self._collect(order_ref, generation))
+                self._in_flight.add(task)
+                task.add_done_callback(self._in_flight.discard)
+            timeout = self._schedule[0][0] - loop.time() if self._schedule else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _collect(self, order_ref: str, generation: int) -> None:
+        assert self._semaphore is not None
+        try:
+            response: Dict[str, Any] = await self.client.collect(order_ref)  # type: ignore[assignment]
+        except BankIDError as e:
+            if self._watching(order_ref, generation):
+                self._finish(order_ref, OrderUpdate(order_ref, None, e))
+            return
+        except httpx.HTTPError as e:
+            _LOG.warning("Transport error when collecting %s: %r", order_ref, e)
+            if self._watching(order_ref, generation):
+                self._push(order_ref, generation, self._next_delay(order_ref))
+            return
+        except asyncio.CancelledError:
+            # Stopped while collecting; the order is collected first when started again.
+            if self._watching(order_ref, generation):
+                self._push(order_ref, generation, 0.0)
+            raise
+        except Exception:
+            _LOG.exception("Unexpected error when collecting %s", order_ref)
+            if self._watching(order_ref, generation):
+                self._push(order_ref, generation, self._next_delay(order_ref))
+            return
+        finally:
+            self._semaphore.release()
+
+        # The order may have been unwatched, and maybe watched again, while collecting.
+        if not self._watching(order_ref, generation):
+            return
+        previous = self._orders[order_ref]
+        self._orders[order_ref] = response
+        update = OrderUpdate(order_ref, response)
+        if previous is None or (previous.get("status"), previous.get("hintCode")) != (
+            response.get("status"),
+            response.get("hintCode"),
+        ):
+            if update.is_final:
+                self._finish(order_ref, update)
+                return
+            self._publish(update)
+        self._push(order_ref, generation, self._next_delay(order_ref))
+
+    def _finish(self, order_ref: str, update: OrderUpdate) -> None:
+        if self._orders.pop(order_ref, False) is False:
+            return
+        self._generations.pop(order_ref, None)
+        self._watched_at.pop(order_ref, None)
+        self._publish(update)
+        future = self._futures.pop(order_ref, None)
+        if future is not None and not future.done():
+            if update.error is not None:
+                future.set_exception(update.error)
+            else:
+                future.set_result(update.response or {})
+
+    def _publish(self, update: OrderUpdate) -> None:
+        for queue in list(self._subscribers) + list(self._order_subscribers.get(update.order_ref, ())):
+            try:
+                queue.put_nowait(update)
+            except asyncio.QueueFull:
+                _LOG.warning("Dropping update for %s, subscriber queue is full", update.order_ref)
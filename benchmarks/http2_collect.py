@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+HTTP/1.1 vs HTTP/2 collect throughput
+=====================================
+
+Creates a number of authentication orders on the BankID test server and then
+collects all of them concurrently, once with HTTP/1.1 and once with HTTP/2, reporting
+throughput, latency percentiles and the number of TLS handshakes performed. The clients are
+created with their ``http2`` and ``max_connections`` options, and the handshakes of their
+connection pools are counted from the ``httpx`` trace events of the calls' spans.
+
+Requires network access to ``appapi2.test.bankid.com`` and the ``h2`` package:
+
+.. code-block:: bash
+
+    $ pip install pybankid[http2]
+    $ python -m benchmarks.http2_collect --orders 1000
+
+"""
+
+import argparse
+import asyncio
+import time
+from typing import List, Tuple
+
+from bankid import BankIDAsyncClient
+from bankid.certs import get_test_cert_and_key
+from bankid.loadtest import percentile
+from bankid.tracing import BankIDTracer, Span
+
+
+class _HandshakeCounter:
+    """Counts the TLS handshakes of a client's own connection pool from the spans of its calls."""
+
+    def __init__(self) -> None:
+        self.handshakes = 0
+
+    def __call__(self, span: Span) -> None:
+        if "start_tls.complete" in span.events:
+            self.handshakes += 1
+
+
+def _make_client(http2: bool, max_connections: int) -> Tuple[BankIDAsyncClient, _HandshakeCounter]:
+    cert, key = get_test_cert_and_key()
+    counter = _HandshakeCounter()
+    client = BankIDAsyncClient(
+        (str(cert), str(key)),
+        test_server=True,
+        http2=http2,
+        max_connections=max_connections,
+        tracer=BankIDTracer(on_span=counter),
+    )
+    return client, counter
+
+
+async def _run(order_refs: List[str], http2: bool, max_connections: int) -> None:
+    client, counter = _make_client(http2, max_connections)
+    latencies: List[float] = []
+
+    async def _collect(order_ref: str) -> None:
+        t = time.perf_counter()
+        await client.collect(order_ref)
+        latencies.append(time.perf_counter() - t)
+
+    t = time.perf_counter()
+    await asyncio.gather(*(_collect(o) for o in order_refs))
+    elapsed = time.perf_counter() - t
+    await client.client.aclose()
+    print(
+        "{0:<9} {1:>8.1f} req/s  p50 {2:>7.1f} ms  p95 {3:>7.1f} ms  p99 {4:>7.1f} ms  TLS handshakes {5}".format(
+            "HTTP/2" if http2 else "HTTP/1.1",
+            len(order_refs) / elapsed,
+            percentile(latencies, 50) * 1000,
+            percentile(latencies, 95) * 1000,
+            percentile(latencies, 99) * 1000,
+            counter.handshakes,
+        )
+    )
+
+
+async def main(orders: int, max_connections: int) -> None:
+    cert, key = get_test_cert_and_key()
+    client = BankIDAsyncClient((str(cert), str(key)), test_server=True, max_connections=max_connections)
+    order_refs = [r["orderRef"] for r in await asyncio.gather(*(client.authenticate("127.0.0.1") for _ in range(orders)))]
+    try:
+        await _run(order_refs, http2=False, max_connections=max_connections)
+        await _run(order_refs, http2=True, max_connections=max_connections)
+    finally:
+        await asyncio.gather(*(client.cancel(o) for o in order_refs), return_exceptions=True)
+        await client.client.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare HTTP/1.1 and HTTP/2 collect throughput.")
+    parser.add_argument("--orders", type=int, default=1000, help="Number of concurrent orders to collect.")
+    parser.add_argument("--max-connections", type=int, default=100, help="Connection pool size.")
+    args = parser.parse_args()
+    asyncio.run(main(args.orders, args.max_connections))
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Import time of the bankid package
+=================================
+
+Runs ``python -X importtime`` in fresh interpreters for a few typical ways of using
+PyBankID and reports the median cumulative import time of the ``bankid`` modules, together
+with the heaviest third party packages that got imported.
+
+.. code-block:: bash
+
+    $ python -m benchmarks.import_time --repeat 7
+    $ python -m benchmarks.import_time --max-ms 10 --statement "import bankid"
+
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Set, Tuple
+
+STATEMENTS = [
+    "import bankid",
+    "from bankid import generate_qr_code_content",
+    "from bankid import BankIDClient",
+    "from bankid import BankIDAsyncClient",
+    "import bankid.experimental.verify",
+]
+
+
+def _parse(stderr: str) -> List[Tuple[int, str, float]]:
+    """Parse ``-X importtime`` output into ``(depth, module, cumulative ms)`` tuples."""
+    out = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, module = line.split("|")
+        depth = (len(module) - len(module.lstrip()) - 1) // 2
+        out.append((depth, module.strip(), float(cumulative_us) / 1000))
+    return out
+
+
+def _run(statement: str) -> List[Tuple[int, str, float]]:
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement], stderr=subprocess.PIPE, universal_newlines=True, check=True
+    )
+    return _parse(proc.stderr)
+
+
+def import_times(statement: str, startup: Set[str]) -> Tuple[float, Dict[str, float]]:
+    """Return the import time in ms caused by ``statement`` and the cumulative time of each top level package it imported.
+
+    Modules in ``startup``, i.e. those imported by the interpreter itself, are not counted.
+
+    """
+    entries = [e for e in _run(statement) if e[1] not in startup]
+    total = sum(ms for depth, _, ms in entries if depth == 0)
+    packages = {module: ms for _, module, ms in entries if "." not in module and not module.startswith("_")}
+    return total, packages
+
+
+def main(statements: List[str], repeat: int, max_ms: float) -> int:
+    startup = {module for _, module, _ in _run("pass")}
+    failed = False
+    for statement in statements:
+        runs = [import_times(statement, startup) for _ in range(repeat)]
+        total = statistics.median(r[0] for r in runs)
+        heavy = sorted(((name, ms) for name, ms in runs[-1][1].items() if name != "bankid"), key=lambda x: -x[1])[:3]
+        print(
+            "{0:<45} {1:>8.1f} ms   {2}".format(
+                statement, total, ", ".join("{0} {1:.1f} ms".format(name, ms) for name, ms in heavy)
+            )
+        )
+        if max_ms and total > max_ms:
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure import time of the bankid package.")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of fresh interpreters per statement.")
+    parser.add_argument("--statement", action="append", help="Statement to time; may be repeated.")
+    parser.add_argument("--max-ms", type=float, default=0.0, help="Exit with status 1 if any statement is slower.")
+    args = parser.parse_args()
+    sys.exit(main(args.statement or STATEMENTS, args.repeat, args.max_ms))
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmarks of the hot paths
+=================================
+
+Times QR code content generation, request payload creation, error mapping, response
+decoding, client round-trips over in-process transports, the extraction of the signed user
+data from synthetic completion data, with and without an element tree, and its signature
+verification with the pyOpenSSL and the ``cryptography`` engines, and compares the results
+with the baseline stored in ``benchmarks/baseline.json``. No network access is needed; the
+signature benchmarks require the ``signature-verification`` extra and ``cryptography``, and
+are skipped otherwise. Run it as a module from the root of the repository:
+
+.. code-block:: bash
+
+    $ python -m benchmarks.micro
+    $ python -m benchmarks.micro --filter decode --max-regression 0.25
+    $ python -m benchmarks.micro --save
+
+Timings depend on the machine, so the baseline should be updated with ``--save`` on the
+machine that compares against it, and a pull request changing a hot path should include
+the numbers before and after.
+
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+from typing import Any, Callable, Dict, List, Tuple, Union
+
+import httpx
+
+from bankid import BankIDAsyncClient, BankIDClient, structs
+from bankid.certs import get_test_cert_and_key
+from bankid.exceptions import get_json_error_class
+from bankid.qr import generate_qr_code_content
+from bankid.testing import FakeBankIDServer, FakeBankIDTransport, Journey
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+_Setup = Callable[[], Callable[[], Any]]
+BENCHMARKS: Dict[str, _Setup] = {}
+
+
+def benchmark(name: str) -> Callable[[_Setup], _Setup]:
+    """Register a setup function, which returns the function to time."""
+
+    def register(setup: _Setup) -> _Setup:
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+def _cert_and_key() -> Tuple[str, str]:
+    cert, key = get_test_cert_and_key()
+    return str(cert), str(key)
+
+
+_FIXTURES: List[Any] = []
+
+
+def _fixtures() -> Any:
+    """The synthetic signature fixtures, created once as the key generation is slow."""
+    if not _FIXTURES:
+        from bankid.experimental.fixtures import SignatureFixtures
+
+        _FIXTURES.append(SignatureFixtures())
+    return _FIXTURES[0]
+
+
+def _complete_body() -> bytes:
+    return json.dumps(_fixtures().collect_response(user_non_visible_data="Order 1234")).encode()
+
+
+@benchmark("qr.generate_qr_code_content")
+def _qr() -> Callable[[], Any]:
+    start_t = time.time() - 12.0
+    return lambda: generate_qr_code_content(
+        "67df3917-fa0d-44e5-b327-edcc928297f8", start_t, "d28db9a7-4cde-429e-a983-359be676944c"
+    )
+
+
+@benchmark("payload.create_payload")
+def _create_payload() -> Callable[[], Any]:
+    client = BankIDClient(_cert_and_key(), test_server=True)
+    return lambda: client._create_payload(
+        "194.168.2.25",
+        requirement={"pinCode": True, "personalNumber": "190000000000"},
+        user_visible_data="# Agreement\n\nI accept the *terms* of the agreement.",
+        user_non_visible_data="order-1234",
+        user_visible_data_format="simpleMarkdownV1",
+    )
+
+
+@benchmark("payload.encode_user_data_1k")
+def _encode_user_data() -> Callable[[], Any]:
+    text = "Jag godkänner villkoren för avtalet. " * 28
+    return lambda: BankIDClient._encode_user_data(text)
+
+
+@benchmark("payload.template_render")
+def _template_render() -> Callable[[], Any]:
+    client = BankIDClient(_cert_and_key(), test_server=True)
+    template = client.payload_template(requirement={"pinCode": True}, user_visible_data="Sign the agreement")
+    return lambda: template.render("194.168.2.25")
+
+
+@benchmark("errors.get_json_error_class")
+def _error_class() -> Callable[[], Any]:
+    response = httpx.Response(400, json={"errorCode": "alreadyInProgress", "details": "Order already in progress"})
+    return lambda: get_json_error_class(response)
+
+
+@benchmark("decode.collect_pending")
+def _decode_pending() -> Callable[[], Any]:
+    body = b'{"orderRef":"131daac9-16c6-4618-beb0-365768f37288","status":"pending","hintCode":"userSign"}'
+    return lambda: structs.loads(body)
+
+
+@benchmark("decode.collect_complete")
+def _decode_complete() -> Callable[[], Any]:
+    body = _complete_body()
+    return lambda: structs.loads(body)
+
+
+@benchmark("decode.collect_complete_struct")
+def _decode_complete_struct() -> Callable[[], Any]:
+    body = _complete_body()
+    return lambda: structs.decode_collect(body)
+
+
+@benchmark("roundtrip.sync_collect_pending")
+def _sync_collect() -> Callable[[], Any]:
+    server = FakeBankIDServer(journeys=[Journey([("outstandingTransaction", 1e9)])])
+    client = BankIDClient(_cert_and_key(), test_server=True, transport=FakeBankIDTransport(server))
+    order_ref = client.authenticate("194.168.2.25")["orderRef"]
+    return lambda: client.collect(order_ref)
+
+
+@benchmark("roundtrip.sync_collect_complete")
+def _sync_collect_complete() -> Callable[[], Any]:
+    body = _complete_body()
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, content=body))
+    client = BankIDClient(_cert_and_key(), test_server=True, transport=transport)
+    return lambda: client.collect("131daac9-16c6-4618-beb0-365768f37288")
+
+
+@benchmark("roundtrip.async_collect_pending")
+def _async_collect() -> Callable[[], Any]:
+    server = FakeBankIDServer(journeys=[Journey([("outstandingTransaction", 1e9)])])
+    client = BankIDAsyncClient(_cert_and_key(), test_server=True, transport=FakeBankIDTransport(server))
+    loop = asyncio.new_event_loop()
+    order_ref = loop.run_until_complete(client.authenticate("194.168.2.25"))["orderRef"]
+
+    async def collect_100() -> None:
+        for _ in range(100):
+            await client.collect(order_ref)
+
+    # Per collect call, with the cost of entering the event loop spread over 100 calls.
+    return lambda: loop.run_until_complete(collect_100())
+
+
+def _signature() -> str:
+    return str(_fixtures().completion_data(user_non_visible_data="Order 1234")["signature"])
+
+
+@benchmark("extract.user_non_visible_data_etree")
+def _extract_etree() -> Callable[[], Any]:
+    import base64
+    import xml.etree.ElementTree as ET
+
+    signature = _signature()
+    # The element tree and positional indexes the signature container used before.
+    return lambda: ET.fromstring(base64.b64decode(signature))[3][0][1].text
+
+
+@benchmark("extract.user_non_visible_data")
+def _extract() -> Callable[[], Any]:
+    from bankid.experimental.helper import B64Value, BankIdSignatureContainer
+
+    signature = _signature()
+    return lambda: BankIdSignatureContainer(B64Value(signature)).user_non_visible_data
+
+
+@benchmark("extract.server_info_etree")
+def _server_info_etree() -> Callable[[], Any]:
+    import base64
+    import xml.etree.ElementTree as ET
+
+    signature = _signature()
+
+    def server_info() -> Any:
+        srv_info = ET.fromstring(base64.b64decode(signature))[3][0][2]
+        return {"name": base64.b64decode(srv_info[0].text or ""), "displayName": base64.b64decode(srv_info[2].text or "")}
+
+    return server_info
+
+
+@benchmark("extract.server_info")
+def _server_info() -> Callable[[], Any]:
+    from bankid.experimental.helper import B64Value, BankIdSignatureContainer
+
+    signature = _signature()
+    return lambda: BankIdSignatureContainer(B64Value(signature)).server_info
+
+
+@benchmark("verify.verify_bankid_response")
+def _verify() -> Callable[[], Any]:
+    from bankid.experimental.verify import verify_bankid_response
+
+    fixtures = _fixtures()
+    response = fixtures.collect_response()
+    return lambda: verify_bankid_response(response, BANK_ID_ROOT_CERT=fixtures.root_cert_pem)
+
+
+@benchmark("verify.verify_bankid_response_cryptography")
+def _verify_cryptography() -> Callable[[], Any]:
+    from bankid.experimental.engine import verify_bankid_response
+
+    fixtures = _fixtures()
+    response = fixtures.collect_response()
+    return lambda: verify_bankid_response(response, BANK_ID_ROOT_CERT=fixtures.root_cert_pem)
+
+
+_PER_CALL = {"roundtrip.async_collect_pending": 100}
+
+
+def run(name: str, repeat: int) -> float:
+    """The best time in microseconds per call of benchmark ``name`` over ``repeat`` rounds."""
+    timer = timeit.Timer(BENCHMARKS[name]())
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+    return best * 1e6 / _PER_CALL.get(name, 1)
+
+
+def _environment() -> Dict[str, str]:
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+    }
+
+
+def main(filters: List[str], repeat: int, max_regression: float, save: bool, baseline_path: str) -> int:
+    baseline: Dict[str, Any] = {"results": {}}
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+    results: Dict[str, float] = {}
+    regressions: List[str] = []
+
+    print("{0:<40} {1:>12} {2:>12} {3:>8}".format("benchmark", "us/call", "baseline", "change"))
+    for name in BENCHMARKS:
+        if filters and not any(f in name for f in filters):
+            continue
+        try:
+            results[name] = us = run(name, repeat)
+        except ImportError as e:
+            print("{0:<40} skipped, {1}".format(name, e))
+            continue
+        base: Union[float, None] = baseline["results"].get(name)
+        change = "" if not base else "{0:+.1%}".format(us / base - 1)
+        print("{0:<40} {1:>12.2f} {2:>12} {3:>8}".format(name, us, "" if base is None else "{0:.2f}".format(base), change))
+        if base and max_regression and us > base * (1 + max_regression):
+            regressions.append(name)
+
+    if save:
+        rounded = {name: round(us, 2) for name, us in results.items()}
+        baseline = {"environment": _environment(), "results": dict(baseline["results"], **rounded)}
+        with open(baseline_path, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print("Saved baseline to {0}".format(baseline_path))
+    if regressions:
+        print("Slower than baseline by more than {0:.0%}: {1}".format(max_regression, ", ".join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of the bankid hot paths.")
+    parser.add_argument("--filter", action="append", default=[], help="Only run benchmarks whose name contains this.")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of timing rounds per benchmark.")
+    parser.add_argument(
+        "--max-regression", type=float, default=0.0, help="Exit with status 1 if slower than baseline by this fraction."
+    )
+    parser.add_argument("--save", action="store_true", help="Store the results as the new baseline.")
+    parser.add_argument("--baseline", default=BASELINE, help="Baseline file to compare with and save to.")
+    args = parser.parse_args()
+    sys.exit(main(args.filter, args.repeat, args.max_regression, args.save, args.baseline))
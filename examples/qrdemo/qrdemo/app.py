@@ -7,11 +7,18 @@ from flask_caching import Cache
 from bankid import BankIDClient
 from bankid.exceptions import BankIDError
 from bankid.certutils import resolve_cert_path
+from bankid.orderstore import SQLiteOrderStore
+from bankid.qr import QRCodeContentCache
 
 USE_TEST_SERVER = True
 
 app = Flask(__name__)
 cache = Cache(app, config={"CACHE_TYPE": "SimpleCache"})
+# The QR code data of initiated orders is kept in a local SQLite file, so that it is shared between
+# all worker processes when running the app with e.g. `gunicorn -w 4 qrdemo.app:app`.
+order_store = SQLiteOrderStore(pathlib.Path(__file__).parent / "orders.sqlite3", ttl=5 * 60)
+# Several tabs and retries polling the same order within one second get the same, once computed, QR content.
+qr_cache = QRCodeContentCache()
 
 # The client should be initialized in a better way, e.g. with Flask_BankID so that it is stored in the
 # Flask app. For this demo it is sufficient to let it reside globally in this file.
@@ -75,13 +82,11 @@ def initiate():
         end_user_ip=request.remote_addr,  # Get the IP of the device making the request.
         requirement={"personalNumber": pn} if pn else None,  # Set to True if PN is provided. Recommended.
     )
-    # Record when this response was received. This is needed for generating sequential, animated QR codes.
-    resp["start_t"] = time.time()
-    # Store these details for later use in some way. Here I use a very simple memory cache; not recommended for
-    # multi-instance apps. Using orderRef as key since it is unique and can be sent in a GET URL without problem.
-    cache.set(resp.get("orderRef"), resp, timeout=5 * 60)
+    # Store the QR code data and when this response was received, which is needed for generating sequential,
+    # animated QR codes. Using orderRef as key since it is unique and can be sent in a GET URL without problem.
+    order = order_store.add_order(resp, start_t=time.time())
     # Generate the first QR code to display to user.
-    qr_content_0 = client.generate_qr_code_content(resp["qrStartToken"], resp["start_t"], resp["qrStartSecret"])
+    qr_content_0 = qr_cache.get(order.qr_start_token, order.start_t, order.qr_start_secret)
     return render_template(
         "qr.html",
         order_ref=resp["orderRef"],
@@ -93,11 +98,11 @@ def initiate():
 @app.route("/get-qr-code/<order_ref>")
 def get_qr_code(order_ref: str):
     """Get the current QR code content to generate QR code from"""
-    x = cache.get(order_ref)
-    if x is None:
+    order = order_store.get(order_ref)
+    if order is None:
         qr_content = ""
     else:
-        qr_content = client.generate_qr_code_content(x["qrStartToken"], x["start_t"], x["qrStartSecret"])
+        qr_content = qr_cache.get(order.qr_start_token, order.start_t, order.qr_start_secret)
     response = make_response(qr_content, 200)
     response.mimetype = "text/plain"
     return response
@@ -131,14 +136,13 @@ def collect(order_ref: str):
 def cancel(order_ref: str):
     """Make a cancel call to the BankID servers"""
     cancel_response = client.cancel(order_ref)
+    order_store.delete(order_ref)
     if cancel_response:
-        cache.delete(order_ref)
         response = make_response(str(cancel_response), 200)
         response.mimetype = "text/plain"
         response.delete_cookie("QRDemo-Auth")
         return response
     else:
-        cache.delete(order_ref)
         response = make_response(str(cancel_response), 500)
         response.mimetype = "text/plain"
         return response
@@ -114,5 +114,8 @@ setup(
     cmdclass={"upload": UploadCommand},
     extras_require={
         "signature-verification": {"pyOpenSSL", "asn1crypto", "pytz"},
+        "http2": {"h2"},
+        "orjson": {"orjson"},
+        "pkcs12": {"cryptography"},
     },
 )
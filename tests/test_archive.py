@@ -0,0 +1,67 @@
+# mypy: allow-untyped-calls
+import json
+import os
+import pathlib
+from typing import Any, Dict, List
+
+import pytest
+
+from bankid.archive import ArchiveReader, ArchiveWriter
+
+pytest.importorskip("cryptography")
+pytest.importorskip("asn1crypto")
+
+from bankid.experimental.fixtures import SignatureFixtures  # noqa: E402
+from bankid.experimental.helper import CompletionDataContainer  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def responses() -> List[Dict[str, Any]]:
+    fixtures = SignatureFixtures()
+    return list(fixtures.collect_responses(12, ["190000000000", "190000000001", "199001011234"]))
+
+
+def test_append_and_look_up(responses: List[Dict[str, Any]], tmp_path: pathlib.Path) -> None:
+    with ArchiveWriter(tmp_path, segment_size=8000) as writer, ArchiveReader(tmp_path) as reader:
+        for i, response in enumerate(responses):
+            entry = writer.append(response, t=1000.0 + i)
+            # Visible to readers at once.
+            assert reader.find(response["orderRef"]) == entry
+        assert len(reader) == len(responses) and entry.segment > 1
+        assert all(reader.get(r["orderRef"]) == r for r in responses)
+
+        found = [e.order_ref for e in reader.entries(personal_number="190000000001")]
+        assert found == [r["orderRef"] for r in responses[1::3]]
+        assert [e.time for e in reader.entries(start=1003.0, end=1005.0)] == [1003.0, 1004.0]
+        assert "131daac9-16c6-4618-beb0-365768f37288" not in reader and "not-a-uuid" not in reader
+        with pytest.raises(KeyError):
+            reader.get("131daac9-16c6-4618-beb0-365768f37288")
+
+        container = CompletionDataContainer.from_archive(reader, responses[4]["orderRef"])
+        assert container.signature_container.certificates is not None
+        assert container.user == responses[4]["completionData"]["user"]
+
+    # Much smaller than the responses, as the signatures share most of their content.
+    size = sum(os.path.getsize(tmp_path / name) for name in os.listdir(tmp_path))
+    assert size * 4 < sum(len(json.dumps(r)) for r in responses)
+
+    with ArchiveWriter(tmp_path) as writer, pytest.raises(ValueError, match="completed"):
+        writer.append({"orderRef": responses[0]["orderRef"], "status": "pending", "hintCode": "userSign"})
+
+
+def test_recovers_from_interrupted_writes(responses: List[Dict[str, Any]], tmp_path: pathlib.Path) -> None:
+    with ArchiveWriter(tmp_path) as writer:
+        for response in responses[:3]:
+            writer.append(response)
+    segment, index = tmp_path / "00000001.seg", tmp_path / "00000001.idx"
+    # The last record was written without its index entry, and a following one only in part.
+    with open(index, "r+b") as f:
+        f.truncate(os.path.getsize(index) - 40)
+    with open(segment, "ab") as f:
+        f.write(b"\x00" * 10)
+
+    with ArchiveWriter(tmp_path) as writer, ArchiveReader(tmp_path) as reader:
+        assert [e.order_ref for e in reader.entries()] == [r["orderRef"] for r in responses[:3]]
+        writer.append(responses[3])
+        assert reader.get(responses[3]["orderRef"]) == responses[3]
+        assert reader.get(responses[2]["orderRef"]) == responses[2]
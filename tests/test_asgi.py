@@ -0,0 +1,89 @@
+import asyncio
+import json
+from typing import Any, Dict, List, MutableMapping, Tuple
+
+import httpx
+import pytest
+
+from bankid import BankIDAsyncClient
+from bankid.asgi import BankIDEventStream
+from bankid.testing import FakeBankIDServer, FakeBankIDTransport, Journey
+from bankid.watcher import OrderWatcher
+
+
+def _app(cert_and_key: Tuple[str, str], server: FakeBankIDServer, **kwargs: Any) -> BankIDEventStream:
+    client = BankIDAsyncClient(certificates=cert_and_key, test_server=True, transport=FakeBankIDTransport(server))
+    return BankIDEventStream(client, watcher=OrderWatcher(client, interval=0.01), **kwargs)
+
+
+def _events(body: str) -> List[Tuple[str, str]]:
+    events = []
+    for block in body.strip().split("\n\n"):
+        name, data = block.split("\n")
+        events.append((name[len("event: "):], data[len("data: "):]))
+    return events
+
+
+@pytest.mark.asyncio
+async def test_stream_until_complete(cert_and_key: Tuple[str, str], ip_address: str) -> None:
+    server = FakeBankIDServer(journeys=[Journey([("outstandingTransaction", 0.2), ("userSign", 0.2)])])
+    app = _app(cert_and_key, server)
+    order = await app.authenticate(ip_address)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app), base_url="http://testserver") as http:
+        response = await http.get("/{0}".format(order["orderRef"]))
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "text/event-stream"
+    events = _events(response.text)
+    assert events[0][0] == "qr" and events[0][1].startswith("bankid.{0}.0.".format(order["qrStartToken"]))
+    statuses = [json.loads(data) for name, data in events if name == "status"]
+    assert [s["hintCode"] for s in statuses[:-1]] == ["outstandingTransaction", "userSign"]
+    assert statuses[-1] == {"orderRef": order["orderRef"], "status": "complete", "hintCode": None}
+    assert len(app.watcher) == 0
+
+    # Connecting after the order is done gets the final status at once.
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app), base_url="http://testserver") as http:
+        response = await http.get("/{0}".format(order["orderRef"]))
+    assert _events(response.text) == [events[-1]]
+
+
+@pytest.mark.asyncio
+async def test_completion_data_and_errors(cert_and_key: Tuple[str, str], ip_address: str) -> None:
+    app = _app(cert_and_key, FakeBankIDServer(journeys=[Journey([])]), include_completion_data=True)
+    order = await app.authenticate(ip_address)
+    app.register({"orderRef": "not-an-order", "qrStartToken": "token", "qrStartSecret": "secret"})
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app), base_url="http://testserver") as http:
+        complete = _events((await http.get("/{0}".format(order["orderRef"]))).text)
+        error = _events((await http.get("/not-an-order")).text)
+        not_found = await http.get("/unknown")
+        not_allowed = await http.post("/{0}".format(order["orderRef"]))
+    assert "completionData" in json.loads(complete[-1][1])
+    # Later connections get the final status, but not the personal data in it.
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app), base_url="http://testserver") as http:
+        replayed = _events((await http.get("/{0}".format(order["orderRef"]))).text)
+    assert json.loads(replayed[-1][1]) == {"orderRef": order["orderRef"], "status": "complete", "hintCode": None}
+    assert error[-1][0] == "error" and json.loads(error[-1][1])["errorCode"] == "invalidParameters"
+    assert not_found.status_code == 404
+    assert not_allowed.status_code == 405
+
+
+@pytest.mark.asyncio
+async def test_disconnect_stops_collecting(cert_and_key: Tuple[str, str], ip_address: str) -> None:
+    app = _app(cert_and_key, FakeBankIDServer(journeys=[Journey([("outstandingTransaction", 60.0)])]))
+    order = await app.authenticate(ip_address)
+    disconnect = asyncio.Event()
+    messages: List[MutableMapping[str, Any]] = []
+
+    async def receive() -> Dict[str, Any]:
+        await disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: MutableMapping[str, Any]) -> None:
+        messages.append(message)
+        if b"event: status" in message.get("body", b""):
+            disconnect.set()
+
+    scope = {"type": "http", "method": "GET", "path": "/events/{0}".format(order["orderRef"]), "root_path": "/events"}
+    await asyncio.wait_for(app(scope, receive, send), 5)
+    await app.watcher.stop()
+    assert messages[0]["status"] == 200
+    assert order["orderRef"] not in app.watcher
@@ -12,12 +12,15 @@ Created on 2023-12-15
 
 """
 
+import json
 import uuid
 
+import httpx
 import pytest
 from typing import Tuple
 
 from bankid import BankIDAsyncClient, exceptions
+from bankid.testing import FakeBankIDTransport
 
 
 @pytest.mark.asyncio
@@ -137,3 +140,54 @@ async def test_cancel_with_invalid_uuid(cert_and_key: Tuple[str, str]) -> None:
     invalid_order_ref = uuid.uuid4()
     with pytest.raises(exceptions.InvalidParametersError):
         await c.cancel(str(invalid_order_ref))
+
+
+@pytest.mark.asyncio
+async def test_collect_many(cert_and_key: Tuple[str, str], ip_address: str) -> None:
+    c = BankIDAsyncClient(certificates=cert_and_key, test_server=True, transport=FakeBankIDTransport())
+    order_refs = [(await c.authenticate(ip_address))["orderRef"] for _ in range(20)]
+    results = await c.collect_many(order_refs + ["invalid-uuid"], concurrency=4)
+    assert list(results) == order_refs + ["invalid-uuid"]
+    assert all(not isinstance(results[o], exceptions.BankIDError) for o in order_refs)
+    assert isinstance(results["invalid-uuid"], exceptions.InvalidParametersError)
+    with pytest.raises(ValueError, match="concurrency"):
+        await c.collect_many(order_refs, concurrency=0)
+
+
+@pytest.mark.asyncio
+async def test_collect_many_returns_transport_errors(cert_and_key: Tuple[str, str]) -> None:
+    def handler(request: httpx.Request) -> httpx.Response:
+        order_ref = json.loads(request.content)["orderRef"]
+        if order_ref == "unreachable":
+            raise httpx.ConnectError("refused", request=request)
+        return httpx.Response(200, json={"orderRef": order_ref, "status": "pending", "hintCode": "userSign"})
+
+    c = BankIDAsyncClient(certificates=cert_and_key, test_server=True, transport=httpx.MockTransport(handler))
+    results = await c.collect_many(["reachable", "unreachable"])
+    assert not isinstance(results["reachable"], Exception) and results["reachable"]["status"] == "pending"
+    assert isinstance(results["unreachable"], httpx.ConnectError)
+
+
+def test_http2_and_pool_limits(cert_and_key: Tuple[str, str]) -> None:
+    pytest.importorskip("h2")
+    c = BankIDAsyncClient(
+        certificates=cert_and_key,
+        test_server=True,
+        http2=True,
+        max_connections=10,
+        max_keepalive_connections=5,
+        keepalive_expiry=30.0,
+    )
+    pool = c.client._transport._pool  # type: ignore[attr-defined]
+    assert pool._http2
+    assert (pool._max_connections, pool._max_keepalive_connections, pool._keepalive_expiry) == (10, 5, 30.0)
+
+
+@pytest.mark.asyncio
+async def test_authenticate_with_template(cert_and_key: Tuple[str, str], ip_address: str) -> None:
+    c = BankIDAsyncClient(certificates=cert_and_key, test_server=True, transport=FakeBankIDTransport())
+    template = c.payload_template(user_visible_data="Logga in", user_visible_data_format="simpleMarkdownV1")
+    order = await c.authenticate_with_template(template, ip_address)
+    collect_status = await c.collect(order["orderRef"])
+    assert collect_status["status"] == "pending"
+    assert await c.cancel(order["orderRef"])
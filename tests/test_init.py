@@ -0,0 +1,24 @@
+import subprocess
+import sys
+
+import pytest
+
+import bankid
+
+
+def test_qr_code_generation_does_not_import_clients() -> None:
+    statement = (
+        "import sys, bankid; bankid.generate_qr_code_content; import bankid.experimental.verify; "
+        "assert not {'httpx', 'bankid.syncclient', 'OpenSSL', 'asn1crypto', 'pytz'} & set(sys.modules)"
+    )
+    subprocess.run([sys.executable, "-c", statement], check=True)
+
+
+def test_lazy_attributes() -> None:
+    from bankid.syncclient import BankIDClient
+
+    assert bankid.BankIDClient is BankIDClient
+    assert bankid.exceptions.BankIDError.__name__ == "BankIDError"
+    assert set(bankid.__all__) <= set(dir(bankid))
+    with pytest.raises(AttributeError):
+        getattr(bankid, "no_such_attribute")
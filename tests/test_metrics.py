@@ -0,0 +1,122 @@
+import ssl
+import threading
+from typing import Tuple
+from urllib.request import urlopen
+
+import httpx
+import pytest
+
+from bankid import BankIDAsyncClient, BankIDClient, exceptions
+from bankid.metrics import CONTENT_TYPE, BankIDMetrics, MetricsRegistry, classify_error, start_http_server
+from bankid.testing import FakeBankIDServer, FakeBankIDTransport, Journey
+
+
+def test_registry_render() -> None:
+    registry = MetricsRegistry()
+    counter = registry.counter("requests_total", "Requests.", ["path"])
+    histogram = registry.histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+    counter.inc(path='a"b\\c\n')
+    counter.inc(2, path="x")
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+    assert registry.render().splitlines() == [
+        "# HELP requests_total Requests.",
+        "# TYPE requests_total counter",
+        'requests_total{path="a\\"b\\\\c\\n"} 1',
+        'requests_total{path="x"} 2',
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        "latency_seconds_sum 5.55",
+        "latency_seconds_count 3",
+    ]
+    with pytest.raises(ValueError):
+        counter.inc(method="GET")
+    with pytest.raises(ValueError):
+        registry.counter("requests_total", "Again.")
+
+
+def test_render_while_recording() -> None:
+    registry = MetricsRegistry()
+    counter = registry.counter("requests_total", "Requests.", ["path"])
+    histogram = registry.histogram("latency_seconds", "Latency.", ["path"])
+    done = threading.Event()
+
+    def record() -> None:
+        for i in range(5000):
+            counter.inc(path=str(i))
+            histogram.observe(0.1, path=str(i))
+        done.set()
+
+    thread = threading.Thread(target=record)
+    thread.start()
+    while not done.is_set():
+        registry.render()
+    thread.join()
+    assert counter.total() == 5000
+
+
+def test_classify_error() -> None:
+    assert classify_error(exceptions.MaintenanceError("down", raw_data={"errorCode": "maintenance"})) == "maintenance"
+    assert classify_error(httpx.ReadTimeout("timeout")) == "timeout"
+    try:
+        try:
+            raise ssl.SSLError("certificate verify failed")
+        except ssl.SSLError as e:
+            raise httpx.ConnectError("handshake") from e
+    except httpx.ConnectError as e:
+        assert classify_error(e) == "tls"
+    assert classify_error(httpx.ConnectError("refused")) == "transport"
+
+
+def test_client_calls_are_recorded(cert_and_key: Tuple[str, str], ip_address: str) -> None:
+    metrics = BankIDMetrics()
+    server = FakeBankIDServer(journeys=[Journey([("outstandingTransaction", 0.0)])])
+    client = BankIDClient(cert_and_key, test_server=True, transport=FakeBankIDTransport(server), metrics=metrics)
+    order = client.authenticate(ip_address)
+    assert client.collect(order["orderRef"])["status"] == "complete"
+    assert client.collect(order["orderRef"])["status"] == "complete"
+
+    server.error_rates["maintenance"] = 1.0
+    with pytest.raises(exceptions.MaintenanceError):
+        client.collect(order["orderRef"])
+
+    assert metrics.duration.count(endpoint="auth") == 1
+    assert metrics.duration.count(endpoint="collect") == 3
+    assert metrics.in_flight.value(endpoint="collect") == 0
+    assert metrics.errors.value(endpoint="collect", error="maintenance") == 1
+    assert metrics.collect_responses.value(status="complete", hint_code="") == 2
+    # Three collect calls, of which two were of the same completed order.
+    assert metrics.collect_calls_per_completed_order.value() == 3
+    text = metrics.render()
+    assert "bankid_collect_calls_per_completed_order 3" in text
+    assert 'bankid_errors_total{endpoint="collect",error="maintenance"} 1' in text
+
+
+def test_metrics_server(cert_and_key: Tuple[str, str], ip_address: str) -> None:
+    metrics = BankIDMetrics()
+    client = BankIDClient(cert_and_key, test_server=True, transport=FakeBankIDTransport(), metrics=metrics)
+    client.authenticate(ip_address)
+    server = start_http_server(metrics, port=0)
+    try:
+        with urlopen("http://127.0.0.1:{0}/metrics".format(server.server_port)) as response:
+            assert response.headers["Content-Type"] == CONTENT_TYPE
+            assert 'bankid_request_duration_seconds_count{endpoint="auth"} 1' in response.read().decode()
+    finally:
+        server.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_async_client_calls_are_recorded(cert_and_key: Tuple[str, str], ip_address: str) -> None:
+    metrics = BankIDMetrics()
+    server = FakeBankIDServer(journeys=[Journey([("outstandingTransaction", 10.0)])])
+    client = BankIDAsyncClient(cert_and_key, test_server=True, transport=FakeBankIDTransport(server), metrics=metrics)
+    order = await client.sign(ip_address, user_visible_data="Sign")
+    assert (await client.collect(order["orderRef"]))["status"] == "pending"
+    assert await client.cancel(order["orderRef"])
+    assert metrics.duration.count(endpoint="sign") == 1
+    assert metrics.duration.count(endpoint="cancel") == 1
+    assert metrics.collect_responses.value(status="pending", hint_code="outstandingTransaction") == 1
@@ -0,0 +1,56 @@
+import pathlib
+import time
+from typing import List
+
+import pytest
+
+from bankid.orderstore import MemoryOrderStore, OrderStore, SQLiteOrderStore
+
+ORDER = {
+    "orderRef": "131daac9-16c6-4618-beb0-365768f37288",
+    "autoStartToken": "7c40b5c9-fa74-49cf-b98c-bfe651f9a7c6",
+    "qrStartToken": "67df3917-fa0d-44e5-b327-edcc928297f8",
+    "qrStartSecret": "d28db9a7-4cde-429e-a983-359be676944c",
+}
+
+
+@pytest.mark.parametrize("kind", ["memory", "sqlite"])
+def test_add_get_delete_and_expiry(kind: str, tmp_path: pathlib.Path) -> None:
+    now: List[float] = [1000.0]
+    store: OrderStore
+    if kind == "memory":
+        store = MemoryOrderStore(ttl=10.0, clock=lambda: now[0])
+    else:
+        store = SQLiteOrderStore(tmp_path / "orders.sqlite3", ttl=10.0, clock=lambda: now[0])
+    with store:
+        order = store.add_order(ORDER, start_t=999.5)
+        assert store.get(ORDER["orderRef"]) == order
+        assert (order.qr_start_token, order.start_t, order.expires) == (ORDER["qrStartToken"], 999.5, 1010.0)
+        assert store.add_order({"orderRef": "phone-order"}).qr_start_token is None
+        store.delete("phone-order")
+        assert "phone-order" not in store
+        now[0] = 1010.0
+        assert ORDER["orderRef"] not in store
+        assert store.evict_expired() == 1
+
+
+def test_sqlite_store_is_shared_and_batched(tmp_path: pathlib.Path) -> None:
+    path = tmp_path / "orders.sqlite3"
+    with SQLiteOrderStore(path, batch_size=3, flush_interval=60.0) as writer, SQLiteOrderStore(path) as reader:
+        writer.add_order(ORDER)
+        assert ORDER["orderRef"] in writer
+        assert ORDER["orderRef"] not in reader
+        writer.add_order(dict(ORDER, orderRef="second"))
+        writer.add_order(dict(ORDER, orderRef="third"))
+        assert reader.get(ORDER["orderRef"]) == writer.get(ORDER["orderRef"])
+        assert len(reader) == 3
+
+
+def test_sqlite_store_flushes_after_interval(tmp_path: pathlib.Path) -> None:
+    path = tmp_path / "orders.sqlite3"
+    with SQLiteOrderStore(path, flush_interval=0.01) as writer, SQLiteOrderStore(path) as reader:
+        writer.add_order(ORDER)
+        deadline = time.monotonic() + 5
+        while ORDER["orderRef"] not in reader and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert ORDER["orderRef"] in reader
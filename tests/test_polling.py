@@ -0,0 +1,50 @@
+from typing import Tuple
+
+import pytest
+
+from bankid import BankIDAsyncClient
+from bankid.polling import AdaptivePollingPolicy
+from bankid.testing import FakeBankIDServer, FakeBankIDTransport, Journey
+from bankid.watcher import OrderWatcher
+
+
+def test_interval_by_hint_code_and_age() -> None:
+    policy = AdaptivePollingPolicy()
+    assert policy.interval("userSign", 100.0) == 1.0
+    assert policy.interval("started", 5.0) == 1.5
+    assert policy.interval("outstandingTransaction", 10.0) == 2.0
+    assert policy.interval("outstandingTransaction", 45.0) == 3.0
+    assert policy.interval("noClient", 600.0) == 5.0
+    assert policy.interval("someNewHintCode", 600.0) == 2.0
+    assert AdaptivePollingPolicy(intervals={"userSign": 0.1}).interval("userSign", 0.0) == 1.0
+
+
+def test_bounds_are_enforced() -> None:
+    with pytest.raises(ValueError):
+        AdaptivePollingPolicy(min_interval=0.5)
+    with pytest.raises(ValueError):
+        AdaptivePollingPolicy(base_interval=10.0, max_interval=5.0)
+
+
+def test_calls_saved() -> None:
+    policy = AdaptivePollingPolicy()
+    for age in range(0, 90, 3):
+        policy.next_interval("outstandingTransaction", float(age))
+    assert policy.calls == 30
+    assert policy.calls_saved > 10
+    policy.next_interval("userSign", 90.0)
+    assert policy.calls_saved == pytest.approx(policy._baseline_calls - 31)
+    policy.reset()
+    assert policy.calls == 0 and policy.calls_saved == 0
+
+
+@pytest.mark.asyncio
+async def test_watcher_uses_policy(cert_and_key: Tuple[str, str], ip_address: str) -> None:
+    server = FakeBankIDServer(journeys=[Journey([("userSign", 0.3)])])
+    client = BankIDAsyncClient(cert_and_key, test_server=True, transport=FakeBankIDTransport(server))
+    policy = AdaptivePollingPolicy()
+    async with OrderWatcher(client, policy=policy) as watcher:
+        order = await client.authenticate(ip_address)
+        result = await watcher.wait_for(order["orderRef"], timeout=5)
+    assert result["status"] == "complete"
+    assert policy.calls == 1
@@ -0,0 +1,115 @@
+import hashlib
+import hmac
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from unittest import mock
+
+import pytest
+
+from bankid.qr import (
+    QRCodeContentCache,
+    QRCodeRenderer,
+    generate_qr_code_content,
+    qr_code_matrix,
+    qr_code_png,
+    qr_code_svg,
+)
+
+TOKEN = "67df3917-fa0d-44e5-b327-edcc928297f8"
+SECRET = "d28db9a7-4cde-429e-a983-359be676944c"
+
+
+def test_cache_matches_generate_qr_code_content() -> None:
+    start_t = time.time() - 12.3
+    cache = QRCodeContentCache()
+    with mock.patch("time.time", return_value=start_t + 12.3):
+        assert cache.get(TOKEN, start_t, SECRET) == generate_qr_code_content(TOKEN, start_t, SECRET)
+    assert cache.get(TOKEN, start_t, SECRET).startswith("bankid.{0}.12.".format(TOKEN))
+
+
+def test_cache_computes_each_second_once() -> None:
+    now: List[float] = [100.0]
+    cache = QRCodeContentCache(clock=lambda: now[0])
+    with mock.patch("bankid.qr.hmac.new", wraps=hmac.new) as hmac_new:
+        first = cache.get(TOKEN, 100.0, SECRET)
+        assert cache.get(TOKEN, 100.0, SECRET) is first
+        now[0] = 101.5
+        second = cache.get(TOKEN, 100.0, SECRET)
+    assert hmac_new.call_count == 1
+    assert first.split(".")[2] == "0"
+    assert second.split(".")[2] == "1"
+
+
+def test_cache_ttl_eviction() -> None:
+    now: List[float] = [0.0]
+    cache = QRCodeContentCache(ttl=10.0, clock=lambda: now[0])
+    cache.get(TOKEN, 0.0, SECRET)
+    now[0] = 11.0
+    cache.get("other-token", 11.0, SECRET)
+    assert TOKEN not in cache
+    assert len(cache) == 1
+    cache.discard("other-token")
+    assert len(cache) == 0
+
+
+CONTENT = "bankid.{0}.0.dc69358e712458a66a7525beef148ae8526b1c71610eff2c16cdffb4cdac9bf8".format(TOKEN)
+
+
+def test_qr_code_matrix() -> None:
+    matrix = qr_code_matrix(CONTENT, "L", mask=3)
+    assert len(matrix) == 41
+    # Reference matrix produced by an independent QR code encoder with the same version, level and mask.
+    bits = "".join("1" if dark else "0" for row in matrix for dark in row)
+    assert hashlib.sha256(bits.encode()).hexdigest() == "b0d927ea84adc35e4e15ab6c338dc32f8bd02de84779e8adc3efb9bff8eea736"
+    assert len(qr_code_matrix(CONTENT, "M")) == 45
+    with pytest.raises(ValueError):
+        qr_code_matrix(CONTENT, "X")
+
+
+def test_qr_code_svg_and_png() -> None:
+    matrix = qr_code_matrix(CONTENT)
+    svg = qr_code_svg(matrix, border=2)
+    assert svg.startswith("<svg") and 'viewBox="0 0 45 45"' in svg
+    assert svg.count("h1v1h-1z") == sum(sum(row) for row in matrix)
+    png = qr_code_png(matrix, scale=2, border=4)
+    assert png.startswith(b"\x89PNG\r\n\x1a\n")
+    assert struct.unpack(">II", png[16:24]) == (98, 98)
+
+
+def test_renderer_caches_per_order_and_second() -> None:
+    now: List[float] = [100.0]
+    renderer = QRCodeRenderer(clock=lambda: now[0])
+    with mock.patch("bankid.qr.qr_code_matrix", wraps=qr_code_matrix) as encode:
+        svg = renderer.svg(TOKEN, 100.0, SECRET)
+        assert renderer.svg(TOKEN, 100.0, SECRET) is svg
+        renderer.png(TOKEN, 100.0, SECRET)
+        now[0] = 101.0
+        assert renderer.svg(TOKEN, 100.0, SECRET) != svg
+    assert encode.call_count == 3
+
+
+def test_renderer_prunes_evicted_orders() -> None:
+    now: List[float] = [0.0]
+    renderer = QRCodeRenderer(ttl=10.0, clock=lambda: now[0])
+    renderer.svg(TOKEN, 0.0, SECRET)
+    renderer.png(TOKEN, 0.0, SECRET)
+    now[0] = 11.0
+    renderer.svg("other-token", 11.0, SECRET)
+    assert list(renderer._rendered) == [("other-token", "svg")]
+
+
+def test_cache_shared_between_threads() -> None:
+    cache = QRCodeContentCache(ttl=0.0)
+
+    def poll(i: int) -> str:
+        token = "token-{0}".format(i % 50)
+        content = cache.get(token, time.time(), SECRET)
+        if i % 7 == 0:
+            cache.discard(token)
+        return content
+
+    with ThreadPoolExecutor(8) as executor:
+        contents = list(executor.map(poll, range(5000)))
+    assert all(content.startswith("bankid.token-") for content in contents)
@@ -0,0 +1,132 @@
+from typing import Any, List, Set, Tuple
+from unittest import mock
+
+import httpx
+import pytest
+
+from bankid import BankIDAsyncClient, BankIDClient, exceptions
+from bankid.resilience import CircuitBreaker, ResilientAsyncClient, ResilientClient, RetryPolicy
+from bankid.testing import FakeBankIDServer, FakeBankIDTransport
+
+
+def _error(cls: Any) -> exceptions.BankIDError:
+    return cls("error", raw_data={})  # type: ignore[no-any-return]
+
+
+def test_collect_is_retried(cert_and_key: Tuple[str, str], ip_address: str) -> None:
+    client = BankIDClient(cert_and_key, test_server=True, transport=FakeBankIDTransport())
+    resilient = ResilientClient(client, retry=RetryPolicy(max_attempts=3, base_delay=0))
+    order = resilient.authenticate(ip_address)
+    side_effect = [_error(exceptions.MaintenanceError), httpx.ConnectError("refused"), client.collect(order["orderRef"])]
+    with mock.patch.object(client, "collect", side_effect=side_effect) as m:
+        assert resilient.collect(order["orderRef"])["status"] == "pending"
+    assert m.call_count == 3
+
+    with mock.patch.object(client, "collect", side_effect=[_error(exceptions.InternalError)] * 3) as m:
+        resilient = ResilientClient(client, retry=RetryPolicy(max_attempts=3, base_delay=0))
+        with pytest.raises(exceptions.InternalError):
+            resilient.collect(order["orderRef"])
+    assert m.call_count == 3
+
+
+@pytest.mark.parametrize("error", [exceptions.InvalidParametersError, exceptions.AlreadyInProgressError])
+def test_client_errors_are_not_retried(cert_and_key: Tuple[str, str], error: Any) -> None:
+    client = BankIDClient(cert_and_key, test_server=True, transport=FakeBankIDTransport())
+    resilient = ResilientClient(client, retry=RetryPolicy(base_delay=0, retry_on=(exceptions.BankIDError,)))
+    with mock.patch.object(client, "cancel", side_effect=_error(error)) as m:
+        with pytest.raises(error):
+            resilient.cancel("order-ref")
+    assert m.call_count == 1
+
+
+def test_order_calls_are_not_retried(cert_and_key: Tuple[str, str], ip_address: str) -> None:
+    client = BankIDClient(cert_and_key, test_server=True, transport=FakeBankIDTransport())
+    resilient = ResilientClient(client, retry=RetryPolicy(base_delay=0))
+    with mock.patch.object(client, "sign", side_effect=_error(exceptions.InternalError)) as m:
+        with pytest.raises(exceptions.InternalError):
+            resilient.sign(ip_address, user_visible_data="Sign")
+    assert m.call_count == 1
+
+
+def test_circuit_breaker_states() -> None:
+    now: List[float] = [0.0]
+    breaker = CircuitBreaker(failure_threshold=0.5, min_calls=4, window=10.0, reset_timeout=5.0, clock=lambda: now[0])
+    for error in [None, _error(exceptions.InvalidParametersError), _error(exceptions.MaintenanceError)]:
+        breaker.before_call()
+        breaker.record(error)
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.before_call()
+    breaker.record(httpx.ReadTimeout("timeout"))
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(exceptions.CircuitOpenError) as e:
+        breaker.before_call()
+    assert e.value.retry_after == 5.0 and e.value.rfa == 5
+
+    now[0] = 5.0
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.before_call()
+    with pytest.raises(exceptions.CircuitOpenError):
+        breaker.before_call()
+    breaker.record(_error(exceptions.InternalError))
+    assert breaker.state == CircuitBreaker.OPEN
+
+    now[0] = 10.0
+    breaker.before_call()
+    breaker.record(None)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_async_client_opens_circuit(cert_and_key: Tuple[str, str], ip_address: str) -> None:
+    server = FakeBankIDServer()
+    client = BankIDAsyncClient(cert_and_key, test_server=True, transport=FakeBankIDTransport(server))
+    breaker = CircuitBreaker(min_calls=6, reset_timeout=60)
+    resilient = ResilientAsyncClient(client, retry=RetryPolicy(max_attempts=2, base_delay=0), breaker=breaker)
+    order = await resilient.authenticate(ip_address)
+    assert (await resilient.collect(order["orderRef"]))["status"] == "pending"
+
+    server.error_rates["maintenance"] = 1.0
+    for _ in range(2):
+        with pytest.raises(exceptions.MaintenanceError):
+            await resilient.collect(order["orderRef"])
+    with pytest.raises(exceptions.CircuitOpenError):
+        await resilient.collect(order["orderRef"])
+    assert breaker.state == CircuitBreaker.OPEN
+    assert resilient.api_url == client.api_url
+
+
+def test_collect_many_retries_each_order(cert_and_key: Tuple[str, str], ip_address: str) -> None:
+    client = BankIDClient(cert_and_key, test_server=True, transport=FakeBankIDTransport())
+    resilient = ResilientClient(client, retry=RetryPolicy(max_attempts=2, base_delay=0))
+    order_refs = [resilient.authenticate(ip_address)["orderRef"] for _ in range(3)]
+    responses = {order_ref: client.collect(order_ref) for order_ref in order_refs}
+    failed: Set[str] = set()
+
+    def collect(order_ref: str) -> Any:
+        # Every order fails once before it is collected.
+        if order_ref in failed:
+            return responses[order_ref]
+        failed.add(order_ref)
+        raise _error(exceptions.MaintenanceError)
+
+    with mock.patch.object(client, "collect", side_effect=collect) as m:
+        assert resilient.collect_many(order_refs, concurrency=2) == responses
+    assert m.call_count == 6
+
+    breaker = CircuitBreaker(min_calls=1, reset_timeout=60)
+    breaker.record(httpx.ReadTimeout("timeout"))
+    resilient = ResilientClient(client, breaker=breaker)
+    results = resilient.collect_many(order_refs)
+    assert all(isinstance(r, exceptions.CircuitOpenError) for r in results.values())
+
+
+@pytest.mark.asyncio
+async def test_async_collect_many_retries_each_order(cert_and_key: Tuple[str, str], ip_address: str) -> None:
+    client = BankIDAsyncClient(cert_and_key, test_server=True, transport=FakeBankIDTransport())
+    resilient = ResilientAsyncClient(client, retry=RetryPolicy(max_attempts=2, base_delay=0))
+    order_refs = [(await resilient.authenticate(ip_address))["orderRef"] for _ in range(3)]
+    side_effect = [_error(exceptions.InternalError)] * 3 + [await client.collect(o) for o in order_refs]
+    with mock.patch.object(client, "collect", side_effect=side_effect) as m:
+        results = await resilient.collect_many(order_refs)
+    assert m.call_count == 6
+    assert all(not isinstance(r, Exception) and r["status"] == "pending" for r in results.values())
@@ -0,0 +1,90 @@
+import json
+import pickle
+import tracemalloc
+from typing import Any, List, Tuple
+
+import pytest
+
+from bankid import BankIDAsyncClient, BankIDClient, structs
+from bankid.testing import FakeBankIDServer, FakeBankIDTransport, Journey
+
+
+def _complete_body() -> bytes:
+    server = FakeBankIDServer(journeys=[Journey([])])
+    _, order = server.handle("auth", {"endUserIp": "127.0.0.1"})
+    _, response = server.handle("collect", {"orderRef": order["orderRef"]})
+    return json.dumps(response).encode()
+
+
+def test_decode_collect_complete() -> None:
+    body = _complete_body()
+    expected = json.loads(body)
+    response = structs.decode_collect(body)
+    assert isinstance(response, structs.CollectCompleteResponse)
+    assert response == expected and response.to_dict() == expected
+    assert response.hintCode is None and "hintCode" not in response
+    assert response.get("hintCode", "none") == "none"
+
+    completion_data = response.completionData
+    assert completion_data is not None
+    assert completion_data.signature_bytes == expected["completionData"]["signature"].encode()
+    assert completion_data.signature == expected["completionData"]["signature"]
+    assert completion_data["ocspResponse"] == expected["completionData"]["ocspResponse"]
+    assert completion_data.user.givenName == response["completionData"]["user"]["givenName"] == "Karl"
+    assert "risk" not in completion_data
+    with pytest.raises(KeyError):
+        completion_data["risk"]
+
+
+def test_decode_escaped_and_pending() -> None:
+    body = b'{"orderRef":"a","status":"complete","completionData":{"signature":"ab\\/cd","ocspResponse":"ef"}}'
+    completion_data = structs.decode_collect(body).completionData
+    assert completion_data is not None
+    assert completion_data.signature == "ab/cd" and completion_data.ocspResponse == "ef"
+    assert completion_data.ocsp_response_bytes == b"ef"
+    pending = structs.decode_collect(b'{"orderRef":"a","status":"pending","hintCode":"userSign"}')
+    assert isinstance(pending, structs.CollectPendingResponse)
+    assert dict(pending.to_dict()) == {"orderRef": "a", "status": "pending", "hintCode": "userSign"}
+
+
+def test_structs_can_be_pickled() -> None:
+    response = structs.decode_collect(_complete_body())
+    unpickled = pickle.loads(pickle.dumps(response))
+    assert isinstance(unpickled, structs.CollectCompleteResponse)
+    assert unpickled == response
+    assert unpickled.completionData is not None and unpickled.completionData.user.name == "Karl Karlsson"
+
+
+def test_structs_use_less_memory() -> None:
+    body = _complete_body()
+
+    def allocated(decode: Any) -> int:
+        tracemalloc.start()
+        kept: List[Any] = [decode(bytes(body)) for _ in range(200)]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        assert len(kept) == 200
+        return size
+
+    assert allocated(structs.decode_collect) < allocated(json.loads) * 0.75
+
+
+def test_clients_return_structs(cert_and_key: Tuple[str, str], ip_address: str) -> None:
+    transport = FakeBankIDTransport(FakeBankIDServer(journeys=[Journey([])]))
+    c = BankIDClient(cert_and_key, test_server=True, transport=transport, response_format="struct")
+    order: Any = c.authenticate(ip_address)
+    assert isinstance(order, structs.AuthenticateResponse)
+    collected: Any = c.collect(order["orderRef"])
+    assert isinstance(collected, structs.CollectCompleteResponse)
+    with pytest.raises(ValueError):
+        BankIDClient(cert_and_key, test_server=True, response_format="xml")
+
+
+@pytest.mark.asyncio
+async def test_async_client_returns_structs(cert_and_key: Tuple[str, str], ip_address: str) -> None:
+    transport = FakeBankIDTransport(FakeBankIDServer(journeys=[Journey([])]))
+    c = BankIDAsyncClient(cert_and_key, test_server=True, transport=transport, response_format="struct")
+    order: Any = await c.phone_sign("200101011234", "RP", "Sign this")
+    assert isinstance(order, structs.PhoneSignResponse)
+    collected: Any = await c.collect(order["orderRef"])
+    assert collected.status == "complete"
@@ -13,10 +13,12 @@
 Created on 2024-01-18
 
 """
+import json
 import uuid
 
+import httpx
 import pytest
-from typing import Tuple
+from typing import List, Tuple
 
 try:
     from unittest import mock
@@ -24,6 +26,7 @@ except:
     import mock  # type: ignore[no-redef]
 
 from bankid import BankIDClient, exceptions
+from bankid.testing import FakeBankIDTransport
 
 
 def test_authentication_and_collect(cert_and_key: Tuple[str, str], ip_address: str, random_personal_number: str) -> None:
@@ -141,3 +144,47 @@ def test_correct_prod_server_urls(cert_and_key: Tuple[str, str], test_server: bo
     c = BankIDClient(certificates=cert_and_key, test_server=test_server)
     assert c.api_url == "https://{0}/rp/v6.0/".format(endpoint)
     assert "{0}.pem".format(endpoint) in str(c.verify_cert)
+
+
+def test_collect_many(cert_and_key: Tuple[str, str], ip_address: str) -> None:
+    c = BankIDClient(certificates=cert_and_key, test_server=True, transport=FakeBankIDTransport())
+    order_refs = [c.authenticate(ip_address)["orderRef"] for _ in range(20)]
+    results = c.collect_many(order_refs + ["invalid-uuid"], concurrency=4)
+    assert list(results) == order_refs + ["invalid-uuid"]
+    assert all(not isinstance(results[o], exceptions.BankIDError) for o in order_refs)
+    assert isinstance(results["invalid-uuid"], exceptions.InvalidParametersError)
+    with pytest.raises(ValueError, match="concurrency"):
+        c.collect_many(order_refs, concurrency=0)
+
+
+def test_collect_many_returns_transport_errors(cert_and_key: Tuple[str, str]) -> None:
+    def handler(request: httpx.Request) -> httpx.Response:
+        order_ref = json.loads(request.content)["orderRef"]
+        if order_ref == "unreachable":
+            raise httpx.ConnectError("refused", request=request)
+        return httpx.Response(200, json={"orderRef": order_ref, "status": "pending", "hintCode": "userSign"})
+
+    c = BankIDClient(certificates=cert_and_key, test_server=True, transport=httpx.MockTransport(handler))
+    results = c.collect_many(["reachable", "unreachable"])
+    assert not isinstance(results["reachable"], Exception) and results["reachable"]["status"] == "pending"
+    assert isinstance(results["unreachable"], httpx.ConnectError)
+
+
+def test_payload_template(cert_and_key: Tuple[str, str], ip_address: str) -> None:
+    c = BankIDClient(certificates=cert_and_key, test_server=True, transport=FakeBankIDTransport())
+    bodies: List[bytes] = []
+
+    def record(request: httpx.Request) -> None:
+        bodies.append(request.content)
+
+    c.client.event_hooks["request"] = [record]
+    template = c.payload_template(requirement={"pinCode": True}, user_visible_data="Signera avtal nr 1")
+    order = c.sign_with_template(template, ip_address)
+    assert c.cancel(order["orderRef"])
+    assert json.loads(bodies[0]) == c._create_payload(
+        ip_address, requirement={"pinCode": True}, user_visible_data="Signera avtal nr 1"
+    )
+    assert bodies[1] == '{{"orderRef":"{0}"}}'.format(order["orderRef"]).encode()
+    assert json.loads(c.payload_template().render('"quoted"')) == {"endUserIp": '"quoted"'}
+    with pytest.raises(ValueError):
+        c.sign_with_template(c.payload_template(), ip_address)
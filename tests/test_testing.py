@@ -0,0 +1,99 @@
+import uuid
+from typing import List, Tuple
+
+import pytest
+
+from bankid import BankIDAsyncClient, BankIDClient, exceptions
+from bankid.loadtest import percentile, run_load_test
+from bankid.testing import FakeBankIDServer, FakeBankIDTransport, Journey
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.t = 0.0
+
+    def __call__(self) -> float:
+        return self.t
+
+
+def _hint_codes(client: BankIDClient, clock: _Clock, order_ref: str, times: List[float]) -> List[str]:
+    out = []
+    for t in times:
+        clock.t = t
+        response = client.collect(order_ref)
+        out.append(str(response.get("hintCode", response["status"])))
+    return out
+
+
+def test_hint_code_progression(cert_and_key: Tuple[str, str], ip_address: str) -> None:
+    clock = _Clock()
+    server = FakeBankIDServer(journeys=[Journey([("outstandingTransaction", 2.0), ("userSign", 2.0)])], clock=clock)
+    c = BankIDClient(certificates=cert_and_key, test_server=True, transport=FakeBankIDTransport(server))
+    out = c.authenticate(ip_address)
+    order_ref = str(uuid.UUID(out["orderRef"]))
+    assert _hint_codes(c, clock, order_ref, [0.0, 2.5, 5.0]) == ["outstandingTransaction", "userSign", "complete"]
+    complete = c.collect(order_ref)
+    assert complete["status"] == "complete"
+    assert complete["completionData"]["device"]["ipAddress"] == ip_address
+
+
+def test_failed_journey(cert_and_key: Tuple[str, str], ip_address: str) -> None:
+    clock = _Clock()
+    server = FakeBankIDServer(journeys=[Journey([("outstandingTransaction", 1.0)], "failed", "userCancel")], clock=clock)
+    c = BankIDClient(certificates=cert_and_key, test_server=True, transport=FakeBankIDTransport(server))
+    out = c.sign(ip_address, user_visible_data="The data to be signed")
+    clock.t = 2.0
+    assert c.collect(out["orderRef"]) == {"orderRef": out["orderRef"], "status": "failed", "hintCode": "userCancel"}
+
+
+def test_already_in_progress_and_cancel(
+    cert_and_key: Tuple[str, str], ip_address: str, random_personal_number: str
+) -> None:
+    c = BankIDClient(certificates=cert_and_key, test_server=True, transport=FakeBankIDTransport())
+    out = c.authenticate(ip_address, requirement={"personalNumber": random_personal_number})
+    with pytest.raises(exceptions.AlreadyInProgressError):
+        c.authenticate(ip_address, requirement={"personalNumber": random_personal_number})
+    assert c.collect(out["orderRef"]).get("hintCode") == "cancelled"
+    assert c.cancel(out["orderRef"])
+    with pytest.raises(exceptions.InvalidParametersError):
+        c.collect(out["orderRef"])
+
+
+@pytest.mark.parametrize("error_code", ["internalError", "maintenance", "requestTimeout", "unauthorized"])
+def test_injected_errors(cert_and_key: Tuple[str, str], ip_address: str, error_code: str) -> None:
+    server = FakeBankIDServer(error_rates={error_code: 1.0})
+    c = BankIDClient(certificates=cert_and_key, test_server=True, transport=FakeBankIDTransport(server))
+    with pytest.raises(exceptions._JSON_ERROR_CODE_TO_CLASS[error_code]):
+        c.authenticate(ip_address)
+
+
+def test_unknown_error_code_is_rejected() -> None:
+    with pytest.raises(ValueError):
+        FakeBankIDServer(error_rates={"noSuchError": 0.5})
+
+
+@pytest.mark.asyncio
+async def test_async_phone_sign_and_collect(cert_and_key: Tuple[str, str], random_personal_number: str) -> None:
+    c = BankIDAsyncClient(certificates=cert_and_key, test_server=True, transport=FakeBankIDTransport())
+    out = await c.phone_sign(random_personal_number, "RP", user_visible_data="The data to be signed")
+    collect_status = await c.collect(out["orderRef"])
+    assert collect_status["status"] == "pending"
+    with pytest.raises(exceptions.InvalidParametersError):
+        await c.phone_sign(random_personal_number, "RP", user_visible_data="")
+
+
+@pytest.mark.asyncio
+async def test_run_load_test() -> None:
+    server = FakeBankIDServer(time_scale=0.001, seed=1)
+    report = await run_load_test(journeys=50, concurrency=10, server=server, phone_share=0.5, seed=1)
+    assert sum(report.outcomes.values()) == 50
+    summary = report.summary()
+    assert summary["collect"]["requests"] >= 50
+    assert summary["auth"]["requests"] + summary["phone/auth"]["requests"] == 50
+
+
+def test_percentile() -> None:
+    values = [float(i) for i in range(1, 101)]
+    assert percentile(values, 50) == 50.0
+    assert percentile(values, 99) == 99.0
+    assert percentile([], 50) == 0.0
@@ -0,0 +1,117 @@
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Any, Dict, Iterator, List, Tuple
+
+import httpx
+import pytest
+
+from bankid import BankIDAsyncClient, BankIDClient, exceptions
+from bankid.tracing import BankIDTracer, Span
+from bankid.testing import FakeBankIDServer, FakeBankIDTransport
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self) -> None:
+        self.rfile.read(int(self.headers["Content-Length"]))
+        body = b'{"orderRef":"ref-from-response"}'
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+@pytest.fixture
+def local_url() -> Iterator[str]:
+    server = HTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield "http://127.0.0.1:{0}/rp/v6.0/auth".format(server.server_port)
+    server.shutdown()
+    server.server_close()
+
+
+class _OTelSpan:
+    def __init__(self, name: str, kwargs: Dict[str, Any]):
+        self.name = name
+        self.kwargs = kwargs
+        self.exceptions: List[BaseException] = []
+        self.end_time = 0
+
+    def record_exception(self, error: BaseException) -> None:
+        self.exceptions.append(error)
+
+    def end(self, end_time: int) -> None:
+        self.end_time = end_time
+
+
+class _OTelTracer:
+    def __init__(self) -> None:
+        self.spans: List[_OTelSpan] = []
+
+    def start_span(self, name: str, **kwargs: Any) -> _OTelSpan:
+        self.spans.append(_OTelSpan(name, kwargs))
+        return self.spans[-1]
+
+
+def test_network_phases(local_url: str) -> None:
+    spans: List[Span] = []
+    tracer = BankIDTracer(on_span=spans.append)
+    with httpx.Client() as client:
+        for _ in range(2):
+            with tracer.span("POST", local_url, "auth") as span:
+                span.response = client.post(local_url, json={}, extensions={"trace": span.trace})
+
+    first, second = (s.attributes for s in spans)
+    assert first["bankid.connection_reused"] is False
+    assert second["bankid.connection_reused"] is True
+    assert "bankid.timing.connect" in first and "bankid.timing.connect" not in second
+    for attributes in (first, second):
+        assert attributes["bankid.order_ref"] == "ref-from-response"
+        assert attributes["http.response.status_code"] == 200
+        assert attributes["server.address"] == "127.0.0.1"
+        assert attributes["bankid.timing.write"] >= 0 and attributes["bankid.timing.ttfb"] >= 0
+    assert spans[0].duration > 0
+
+
+def test_client_spans(cert_and_key: Tuple[str, str], ip_address: str) -> None:
+    spans: List[Span] = []
+    otel = _OTelTracer()
+    server = FakeBankIDServer()
+    client = BankIDClient(
+        cert_and_key, test_server=True, transport=FakeBankIDTransport(server), tracer=BankIDTracer(spans.append, otel)
+    )
+    order = client.authenticate(ip_address)
+    client.collect(order["orderRef"])
+    server.error_rates["maintenance"] = 1.0
+    with pytest.raises(exceptions.MaintenanceError):
+        client.cancel(order["orderRef"])
+
+    assert [s.name for s in spans] == ["bankid.auth", "bankid.collect", "bankid.cancel"]
+    for span in spans:
+        assert span.attributes["bankid.order_ref"] == order["orderRef"]
+        assert "bankid.connection_reused" not in span.attributes
+    assert spans[2].attributes["bankid.error_code"] == "maintenance"
+    assert spans[2].attributes["error.type"] == "503"
+    assert [s.name for s in otel.spans] == [s.name for s in spans]
+    assert otel.spans[0].kwargs["start_time"] == spans[0].start_time
+    assert otel.spans[0].end_time == spans[0].end_time
+
+
+@pytest.mark.asyncio
+async def test_async_client_spans(cert_and_key: Tuple[str, str], ip_address: str) -> None:
+    def transport_error(request: httpx.Request) -> httpx.Response:
+        raise httpx.ConnectTimeout("timeout", request=request)
+
+    spans: List[Span] = []
+    client = BankIDAsyncClient(
+        cert_and_key, test_server=True, transport=httpx.MockTransport(transport_error), tracer=BankIDTracer(spans.append)
+    )
+    with pytest.raises(httpx.ConnectTimeout):
+        await client.collect("order-ref")
+    assert spans[0].attributes["bankid.order_ref"] == "order-ref"
+    assert spans[0].attributes["error.type"] == "ConnectTimeout"
+    assert isinstance(spans[0].error, httpx.ConnectTimeout)
@@ -0,0 +1,273 @@
+# mypy: allow-untyped-calls
+import base64
+import json
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+
+import httpx
+import pytest
+
+pytest.importorskip("OpenSSL")
+pytest.importorskip("cryptography")
+
+from bankid import BankIDAsyncClient  # noqa: E402
+from bankid.certs import get_test_cert_and_key  # noqa: E402
+from bankid.exceptions import SignatureVerificationError  # noqa: E402
+from bankid.experimental import engine  # noqa: E402
+from bankid.experimental.cache import VerificationCache  # noqa: E402
+from bankid.experimental.fixtures import SignatureFixtures  # noqa: E402
+from bankid.experimental.helper import B64Value, BankIdSignatureContainer, CompletionDataContainer, _element_text  # noqa: E402
+from bankid.experimental.verify import main as verify_main  # noqa: E402
+from bankid.experimental.verify import verify_bankid_response, verify_bankid_response_async, verify_many  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def fixtures() -> Any:
+    return SignatureFixtures()
+
+
+def test_verify_synthetic_response(fixtures: Any) -> None:
+    response = fixtures.collect_response(user_non_visible_data="Order 1234")
+    produced_at = verify_bankid_response(response, BANK_ID_ROOT_CERT=fixtures.root_cert_pem)
+    assert len(produced_at) == len("2024-05-01 12:00:00")
+
+
+def test_tampered_signed_data_is_rejected(fixtures: Any) -> None:
+    response = fixtures.collect_response(user_visible_data="Pay 100 SEK")
+    xml = base64.b64decode(response["completionData"]["signature"]).decode()
+    visible = base64.b64encode(b"Pay 100 SEK").decode()
+    xml = xml.replace(visible, base64.b64encode(b"Pay 999 SEK").decode())
+    response["completionData"]["signature"] = base64.b64encode(xml.encode()).decode()
+    with pytest.raises(AssertionError, match="Signed Data hash"):
+        verify_bankid_response(response, BANK_ID_ROOT_CERT=fixtures.root_cert_pem)
+
+
+def test_ocsp_response_of_other_signature_is_rejected(fixtures: Any) -> None:
+    response = fixtures.collect_response()
+    response["completionData"]["ocspResponse"] = fixtures.ocsp_response(fixtures.signature())
+    with pytest.raises(AssertionError, match="nonce"):
+        verify_bankid_response(response, BANK_ID_ROOT_CERT=fixtures.root_cert_pem)
+
+
+def test_other_root_is_rejected(fixtures: Any) -> None:
+    other = SignatureFixtures(key_size=1024)
+    with pytest.raises(AssertionError, match="chain"):
+        verify_bankid_response(fixtures.collect_response(), BANK_ID_ROOT_CERT=other.root_cert_pem)
+
+
+def test_cryptography_engine(fixtures: Any) -> None:
+    cache = VerificationCache()
+    response = fixtures.collect_response(user_non_visible_data="Order 1234")
+    expected = verify_bankid_response(response, BANK_ID_ROOT_CERT=fixtures.root_cert_pem)
+    for _ in range(2):
+        assert engine.verify_bankid_response(response, BANK_ID_ROOT_CERT=fixtures.root_cert_pem, cache=cache) == expected
+    # Certificates of the two CAs and the root, their verified public keys and the verified OCSP responder.
+    assert len(cache) == 5 and cache.hits == 5
+
+    other_ocsp = fixtures.collect_response()
+    other_ocsp["completionData"]["ocspResponse"] = fixtures.ocsp_response(fixtures.signature())
+    with pytest.raises(AssertionError, match="nonce"):
+        engine.verify_bankid_response(other_ocsp, BANK_ID_ROOT_CERT=fixtures.root_cert_pem, cache=cache)
+
+    xml = base64.b64decode(response["completionData"]["signature"])
+    signature_value = xml[xml.index(b"<SignatureValue>") + 16 :]
+    tampered = xml.replace(signature_value[:8], base64.b64encode(b"forged")[:8], 1)
+    response["completionData"]["signature"] = base64.b64encode(tampered).decode()
+    with pytest.raises(AssertionError, match="BankID signature"):
+        engine.verify_bankid_response(response, BANK_ID_ROOT_CERT=fixtures.root_cert_pem, cache=cache)
+
+    other = SignatureFixtures(key_size=1024)
+    with pytest.raises(AssertionError, match="chain"):
+        engine.verify_bankid_response(fixtures.collect_response(), BANK_ID_ROOT_CERT=other.root_cert_pem, cache=cache)
+
+
+def test_signature_container_decodes_once(fixtures: Any) -> None:
+    completion_data = fixtures.completion_data(user_visible_data="Skriv under avtalet, Åsa")
+    cdc = CompletionDataContainer(completion_data)
+    container = cdc.signature_container
+    assert cdc.signature_container is container
+    xml = base64.b64decode(completion_data["signature"])
+    text = xml.decode()
+
+    start, stop = container.signed_info_span
+    assert xml[start:stop].startswith(b"<SignedInfo") and xml[start:stop].endswith(b"</SignedInfo>")
+    assert container.signed_info == text[text.find("<SignedInfo") : text.find("</SignedInfo>")] + "</SignedInfo>"
+    assert container.key_info_raw == text[text.find("<KeyInfo") : text.find("</KeyInfo>")] + "</KeyInfo>"
+    assert container.bid_signed_data_raw == text[text.find("<Object>") + len("<Object>") : text.find("</Object>")]
+    assert container.bid_signed_data_bytes.tobytes() == container.bid_signed_data_raw.encode()
+    assert container.certificates is container.certificates
+    assert len(container.certificates) == 3
+
+    with pytest.raises(ValueError, match="KeyInfo"):
+        BankIdSignatureContainer(B64Value(base64.b64encode(b"<Signature><SignedInfo></SignedInfo></Signature>").decode()))
+
+
+def test_signed_data_is_read_without_element_tree(fixtures: Any) -> None:
+    completion_data = fixtures.completion_data(user_visible_data="Skriv under & betala", user_non_visible_data="Order 1")
+    container = CompletionDataContainer(completion_data).signature_container
+    assert container.user_visible_data == base64.b64encode("Skriv under & betala".encode()).decode()
+    assert container.user_non_visible_data == base64.b64encode(b"Order 1").decode()
+    assert container.server_info == {"name": b"Name=Test RP,OU=0000000000,O=Test RP AB,C=SE", "displayName": b"Test RP"}
+    assert container._root is None
+    # The same values as the element tree has.
+    assert container.user_visible_data == container.root[3][0][0].text
+    assert container.user_non_visible_data == container.root[3][0][1].text
+
+    xml = b"<Object><a><usrNonVisibleDataX>x</usrNonVisibleDataX><usrNonVisibleData/><b>&lt;1&gt;</b></a></Object>"
+    assert _element_text(xml, b"usrNonVisibleData", 0, len(xml)) == (None, xml.index(b"<b>"))
+    assert _element_text(xml, b"b", 0, len(xml))[0] == "<1>"
+    assert _element_text(xml, b"c", 3, len(xml)) == (None, 3)
+
+
+def test_verification_cache(fixtures: Any) -> None:
+    cache = VerificationCache(maxsize=16, ttl=60)
+    for _ in range(3):
+        verify_bankid_response(fixtures.collect_response(), BANK_ID_ROOT_CERT=fixtures.root_cert_pem, cache=cache)
+    # Certificates of the OCSP responder, the two CAs and the root, the store and the verified responder chain.
+    assert len(cache) == 6
+    assert cache.misses == 6 and cache.hits == 12
+
+    other = SignatureFixtures(key_size=1024)
+    with pytest.raises(AssertionError, match="chain"):
+        verify_bankid_response(fixtures.collect_response(), BANK_ID_ROOT_CERT=other.root_cert_pem, cache=cache)
+    verify_bankid_response(fixtures.collect_response(), BANK_ID_ROOT_CERT=fixtures.root_cert_pem, cache=cache)
+
+
+def test_verification_cache_bounds() -> None:
+    now = [0.0]
+    cache = VerificationCache(maxsize=2, ttl=10, clock=lambda: now[0])
+    assert cache.get("a", lambda: 1) == 1
+    assert cache.get("b", lambda: 2, expires=lambda value: 5.0) == 2
+    assert cache.get("a", lambda: 3) == 1
+    cache.get("c", lambda: 4)
+    assert cache.get("b", lambda: 5) == 5
+    now[0] = 11.0
+    assert cache.get("b", lambda: 6) == 6
+    assert VerificationCache(maxsize=0).get("a", lambda: 1) == 1
+
+
+def test_verify_many(fixtures: Any) -> None:
+    responses = [json.dumps(r) for r in fixtures.collect_responses(5, ["190000000000", "190000000001"])]
+    responses.insert(2, "not json")
+    for workers in (0, 2):
+        results = list(verify_many(responses, fixtures.root_cert_pem, workers=workers, chunk_size=2, max_in_flight=1))
+        assert [r.position for r in results] == list(range(6))
+        assert [r.ok for r in results] == [True, True, False, True, True, True]
+        assert results[2].error is not None and results[2].error.startswith("JSONDecodeError")
+        assert results[0].order_ref == json.loads(responses[0])["orderRef"]
+    results = list(verify_many(responses, fixtures.root_cert_pem, workers=0, engine="cryptography"))
+    assert [r.ok for r in results] == [True, True, False, True, True, True]
+    with pytest.raises(ValueError, match="engine"):
+        list(verify_many(responses, fixtures.root_cert_pem, engine="openssl"))
+
+
+def test_verify_cli_resumes(fixtures: Any, tmp_path: Path) -> None:
+    responses = fixtures.collect_responses(4)
+    responses[3]["completionData"]["ocspResponse"] = responses[0]["completionData"]["ocspResponse"]
+    inputs = tmp_path / "responses.jsonl"
+    inputs.write_text("\n".join(json.dumps(r) for r in responses) + "\n\n")
+    root = tmp_path / "root.pem"
+    root.write_text(fixtures.root_cert_pem)
+    output = tmp_path / "results.jsonl"
+    # An interrupted run, with a partially written last line.
+    output.write_text('{"source": "x", "ok": true}\n{"source": "y", "ok": tr')
+
+    args = [str(inputs), "--root-cert", str(root), "--output", str(output), "--workers", "0"]
+    assert verify_main(args) == 1
+    results = [json.loads(line) for line in output.read_text().splitlines()]
+    assert [r["source"] for r in results] == ["x"] + ["{0}:{1}".format(inputs, n) for n in (2, 3, 4)]
+    assert [r["ok"] for r in results] == [True, True, True, False]
+    assert "nonce" in results[-1]["error"]
+
+
+@pytest.mark.asyncio
+async def test_verify_async(fixtures: Any) -> None:
+    response = fixtures.collect_response()
+    expected = verify_bankid_response(response, BANK_ID_ROOT_CERT=fixtures.root_cert_pem)
+    assert await verify_bankid_response_async(response, BANK_ID_ROOT_CERT=fixtures.root_cert_pem) == expected
+    with ThreadPoolExecutor(3) as executor:
+        for name in ("pyopenssl", "cryptography"):
+            produced_at = await verify_bankid_response_async(
+                response, BANK_ID_ROOT_CERT=fixtures.root_cert_pem, executor=executor, engine=name
+            )
+            assert produced_at == expected
+    with ProcessPoolExecutor(1) as executor:
+        produced_at = await verify_bankid_response_async(
+            response, BANK_ID_ROOT_CERT=fixtures.root_cert_pem, executor=executor
+        )
+        assert produced_at == expected
+
+    # The signature and the OCSP response are checked concurrently, the errors raised in the order of the checks.
+    tampered = fixtures.collect_response()
+    tampered["completionData"]["ocspResponse"] = fixtures.ocsp_response(fixtures.signature())
+    xml = base64.b64decode(tampered["completionData"]["signature"]).replace(b"<DigestValue>", b"<DigestValue>AAAA", 1)
+    tampered["completionData"]["signature"] = base64.b64encode(xml).decode()
+    with pytest.raises(AssertionError, match="Signed Data hash"):
+        await verify_bankid_response_async(tampered, BANK_ID_ROOT_CERT=fixtures.root_cert_pem)
+    with pytest.raises(TypeError):
+        await verify_bankid_response_async([], BANK_ID_ROOT_CERT=fixtures.root_cert_pem)  # type: ignore[arg-type]
+
+
+@pytest.mark.asyncio
+async def test_collect_verifies_completed_orders(fixtures: Any) -> None:
+    body = fixtures.collect_response()
+    forged = fixtures.collect_response()
+    forged["completionData"]["ocspResponse"] = body["completionData"]["ocspResponse"]
+    bodies = [body, forged]
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, json=bodies.pop(0)))
+    cert, key = get_test_cert_and_key()
+    for response_format in ("dict", "struct"):
+        bodies = [body, forged]
+        client = BankIDAsyncClient(
+            (str(cert), str(key)),
+            test_server=True,
+            transport=transport,
+            response_format=response_format,
+            bankid_root_cert=fixtures.root_cert_pem,
+        )
+        assert (await client.collect(body["orderRef"], verify=True))["status"] == "complete"
+        with pytest.raises(SignatureVerificationError, match="nonce") as e:
+            await client.collect(forged["orderRef"], verify=True)
+        assert e.value.json["orderRef"] == forged["orderRef"] and e.value.rfa == 22
+
+    with pytest.raises(ValueError, match="bankid_root_cert"):
+        await BankIDAsyncClient((str(cert), str(key)), test_server=True).collect(body["orderRef"], verify=True)
+
+    # Errors other than failed verification, here from a shut down executor, are not wrapped.
+    executor = ThreadPoolExecutor(1)
+    executor.shutdown()
+    client = BankIDAsyncClient(
+        (str(cert), str(key)),
+        test_server=True,
+        transport=httpx.MockTransport(lambda request: httpx.Response(200, json=body)),
+        bankid_root_cert=fixtures.root_cert_pem,
+        verify_executor=executor,
+    )
+    with pytest.raises(RuntimeError, match="shutdown"):
+        await client.collect(body["orderRef"], verify=True)
+
+
+@pytest.mark.asyncio
+async def test_collect_wraps_malformed_completion_data(fixtures: Any) -> None:
+    body = fixtures.collect_response()
+    no_signed_info = base64.b64encode(b"<Signature><KeyInfo></KeyInfo><Object></Object></Signature>").decode()
+    malformed = [
+        ("SignedInfo", {"signature": no_signed_info}),
+        ("", {"signature": "not base64!"}),
+        ("", {"ocspResponse": base64.b64encode(b"garbage").decode()}),
+        ("", {"ocspResponse": "AAAA"}),
+    ]
+    cert, key = get_test_cert_and_key()
+    for match, fields in malformed:
+        response = fixtures.collect_response()
+        response["completionData"].update(fields)
+        client = BankIDAsyncClient(
+            (str(cert), str(key)),
+            test_server=True,
+            transport=httpx.MockTransport(lambda request: httpx.Response(200, json=response)),
+            bankid_root_cert=fixtures.root_cert_pem,
+        )
+        with pytest.raises(SignatureVerificationError, match=match) as e:
+            await client.collect(body["orderRef"], verify=True)
+        assert e.value.rfa == 22
@@ -0,0 +1,117 @@
+import asyncio
+import json
+from typing import List, Tuple
+
+import httpx
+import pytest
+
+from bankid import BankIDAsyncClient, exceptions
+from bankid.testing import FakeBankIDServer, FakeBankIDTransport, Journey
+from bankid.watcher import OrderUpdate, OrderWatcher
+
+
+def _client(cert_and_key: Tuple[str, str], server: FakeBankIDServer) -> BankIDAsyncClient:
+    return BankIDAsyncClient(certificates=cert_and_key, test_server=True, transport=FakeBankIDTransport(server))
+
+
+@pytest.mark.asyncio
+async def test_wait_for_many_orders(cert_and_key: Tuple[str, str], ip_address: str) -> None:
+    server = FakeBankIDServer(
+        journeys=[Journey([("outstandingTransaction", 0.05), ("userSign", 0.05)])], latency=0.001
+    )
+    c = _client(cert_and_key, server)
+    async with OrderWatcher(c, interval=0.02, jitter=0.5, max_concurrency=50) as watcher:
+        order_refs = [(await c.authenticate(ip_address))["orderRef"] for _ in range(200)]
+        results = await asyncio.gather(*(watcher.wait_for(o, timeout=5) for o in order_refs))
+    assert all(r["status"] == "complete" for r in results)
+    assert len(watcher) == 0
+
+
+@pytest.mark.asyncio
+async def test_updates_only_on_change(cert_and_key: Tuple[str, str], ip_address: str) -> None:
+    server = FakeBankIDServer(journeys=[Journey([("outstandingTransaction", 0.1), ("userSign", 0.1)], "failed", "userCancel")])
+    c = _client(cert_and_key, server)
+    async with OrderWatcher(c, interval=0.01) as watcher:
+        queue = watcher.subscribe()
+        order_ref = (await c.authenticate(ip_address))["orderRef"]
+        watcher.watch(order_ref)
+        updates: List[OrderUpdate] = []
+        while not updates or not updates[-1].is_final:
+            updates.append(await asyncio.wait_for(queue.get(), 5))
+    assert [(u.response or {}).get("hintCode") for u in updates] == ["outstandingTransaction", "userSign", "userCancel"]
+
+
+@pytest.mark.asyncio
+async def test_collect_error_is_raised(cert_and_key: Tuple[str, str]) -> None:
+    c = _client(cert_and_key, FakeBankIDServer())
+    async with OrderWatcher(c, interval=0.01) as watcher:
+        with pytest.raises(exceptions.InvalidParametersError):
+            await watcher.wait_for("not-an-order", timeout=5)
+
+
+@pytest.mark.asyncio
+async def test_unexpected_error_is_retried(cert_and_key: Tuple[str, str]) -> None:
+    order_ref = "131daac9-16c6-4618-beb0-365768f37288"
+    failed = {"orderRef": order_ref, "status": "failed", "hintCode": "userCancel"}
+    bodies = [b"<html>Bad gateway</html>", json.dumps(failed).encode()]
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, content=bodies.pop(0)))
+    c = BankIDAsyncClient(certificates=cert_and_key, test_server=True, transport=transport)
+    async with OrderWatcher(c, interval=0.01) as watcher:
+        result = await asyncio.wait_for(watcher.wait_for(order_ref), 5)
+    assert result["hintCode"] == "userCancel" and not bodies
+
+
+@pytest.mark.asyncio
+async def test_stop_and_start_with_collect_in_flight(cert_and_key: Tuple[str, str]) -> None:
+    order_ref = "131daac9-16c6-4618-beb0-365768f37288"
+    in_flight = asyncio.Event()
+    calls: List[int] = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(1)
+        if len(calls) == 1:
+            in_flight.set()
+            await asyncio.sleep(60)
+        return httpx.Response(200, json={"orderRef": order_ref, "status": "complete", "completionData": {}})
+
+    c = BankIDAsyncClient(certificates=cert_and_key, test_server=True, transport=httpx.MockTransport(handler))
+    watcher = OrderWatcher(c, interval=0.01)
+    watcher.start()
+    watcher.watch(order_ref)
+    await asyncio.wait_for(in_flight.wait(), 5)
+    await watcher.stop()
+    assert order_ref in watcher
+
+    watcher.start()
+    try:
+        result = await watcher.wait_for(order_ref, timeout=5)
+    finally:
+        await watcher.stop()
+    assert result["status"] == "complete" and len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_rewatch_keeps_one_polling_chain(cert_and_key: Tuple[str, str]) -> None:
+    order_ref = "131daac9-16c6-4618-beb0-365768f37288"
+    calls: List[float] = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(asyncio.get_running_loop().time())
+        await asyncio.sleep(0.02)
+        return httpx.Response(200, json={"orderRef": order_ref, "status": "pending", "hintCode": "userSign"})
+
+    c = BankIDAsyncClient(certificates=cert_and_key, test_server=True, transport=httpx.MockTransport(handler))
+    async with OrderWatcher(c, interval=0.1, jitter=0.0) as watcher:
+        watcher.watch(order_ref)
+        # Re-watched once while the first collect is in flight, and once while waiting for the next.
+        await asyncio.sleep(0.01)
+        watcher.unwatch(order_ref)
+        watcher.watch(order_ref)
+        await asyncio.sleep(0.07)
+        watcher.unwatch(order_ref)
+        watcher.watch(order_ref)
+        await asyncio.sleep(1.0)
+        watcher.unwatch(order_ref)
+    # One chain collects every 0.12 seconds, one per re-watch plus about nine; two chains twice as often.
+    assert len(calls) <= 13
+    assert min(b - a for a, b in zip(calls[3:], calls[4:])) >= 0.1